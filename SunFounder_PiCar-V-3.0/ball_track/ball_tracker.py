@@ -1,11 +1,20 @@
 from picar import front_wheels, back_wheels
 from picar.SunFounder_PCA9685 import Servo
+import os
+import sys
+# ServoLUT is the remote_control camera driver's, not a copy of it
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'remote_control'))
+from remote_control.driver.servo_lut import ServoLUT
+from detector import BallDetector, HOUGH, CONTOUR
+from tracker import BallTracker, VELOCITY, KALMAN
+from follow import Follower, Actuators, PAN_ANGLE_MIN, PAN_ANGLE_MAX, TILT_ANGLE_MIN, TILT_ANGLE_MAX
+from controller import PIDFollower
+from pipeline import Pipeline
 import picar
 from time import sleep
 import cv2
 import numpy as np
 import picar
-import os
 
 picar.setup()
 # Show image captured by camera, True to turn on, you will need #DISPLAY and it also slows the speed of tracking
@@ -46,25 +55,27 @@ smx = 255
 vmn = 186
 vmx = 255
 
+# Ball detection: HOUGH (HoughCircles, as before) or CONTOUR (biggest blob, much cheaper)
+detect_method = HOUGH
+detector = BallDetector(detect_method)
+# Once the ball is found, only look around where it should be next (see tracker.py)
+roi_tracking_enable = True
+tracker = BallTracker(detector, VELOCITY)
+
 # camera follow mode:
 # 0 = step by step(slow, stable), 
 # 1 = calculate the step(fast, unstable)
-follow_mode = 1
+# 2 = PID with feed-forward, gains in the config file (see controller.py)
+follow_mode = 2
 
-CAMERA_STEP = 2
-CAMERA_X_ANGLE = 20
-CAMERA_Y_ANGLE = 20
+# Capture, detection and actuation each in their own thread (see pipeline.py)
+pipeline_enable = True
+# Processes for detection in the pipeline, 0 to detect in a thread (keeps roi_tracking_enable)
+detect_processes = 0
 
-MIDDLE_TOLERANT = 5
-PAN_ANGLE_MAX   = 170
-PAN_ANGLE_MIN   = 10
-TILT_ANGLE_MAX  = 150
-TILT_ANGLE_MIN  = 70
-FW_ANGLE_MAX    = 90+30
-FW_ANGLE_MIN    = 90-30
-
-SCAN_POS = [[20, TILT_ANGLE_MIN], [50, TILT_ANGLE_MIN], [90, TILT_ANGLE_MIN], [130, TILT_ANGLE_MIN], [160, TILT_ANGLE_MIN], 
-            [160, 80], [130, 80], [90, 80], [50, 80], [20, 80]]
+if pipeline_enable and show_image_enable:
+    print('Warning: "show_image_enable" needs the main thread, turn off "pipeline_enable"')
+    pipeline_enable = False
 
 bw = back_wheels.Back_Wheels()
 fw = front_wheels.Front_Wheels()
@@ -76,29 +87,46 @@ fw.offset = 0
 pan_servo.offset = 10
 tilt_servo.offset = 0
 
+# Angle -> PCA9685 count tables with the offsets and the angle limits baked in
+pan_lut = ServoLUT(pan_servo, PAN_ANGLE_MIN, PAN_ANGLE_MAX)
+tilt_lut = ServoLUT(tilt_servo, TILT_ANGLE_MIN, TILT_ANGLE_MAX)
+
 bw.speed = 0
 fw.turn(90)
-pan_servo.write(90)
-tilt_servo.write(90)
+pan_lut.write(90)
+tilt_lut.write(90)
 
 motor_speed = 60
 
+if follow_mode == 2:
+    follower = PIDFollower(SCREEN_WIDTH, SCREEN_HIGHT, scan=scan_enable)
+else:
+    follower = Follower(SCREEN_WIDTH, SCREEN_HIGHT, follow_mode, scan_enable)
+# Only what is enabled gets commands
+actuators = Actuators(pan_lut if pan_tilt_enable else None,
+                      tilt_lut if pan_tilt_enable else None,
+                      fw if front_wheels_enable else None,
+                      bw if rear_wheels_enable else None,
+                      motor_speed)
+
 def nothing(x):
     pass
 
 def main():
-    pan_angle = 90              # initial angle for pan
-    tilt_angle = 90             # initial angle for tilt
-    fw_angle = 90
-
-    scan_count = 0
     print("Begin!")
+    if pipeline_enable:
+        pipeline = Pipeline(img.read, detect, follower, actuators,
+                            processes=detect_processes, method=detect_method)
+        pipeline.run()
+        return
+
     while True:
         x = 0             # x initial in the middle
         y = 0             # y initial in the middle
         r = 0             # ball radius initial to 0(no balls if r < ball_size)
 
-        for _ in range(10):
+        # While tracking, a miss is the tracker's to handle; retry only when searching
+        for _ in range(1 if tracker.tracking else 10):
             (tmp_x, tmp_y), tmp_r = find_blob()
             if tmp_r > BALL_SIZE_MIN:
                 x = tmp_x
@@ -108,87 +136,9 @@ def main():
 
         print(x, y, r)
 
-        # scan:
-        if r < BALL_SIZE_MIN:
-            bw.stop()
-            if scan_enable:
-                #bw.stop()
-                pan_angle = SCAN_POS[scan_count][0]
-                tilt_angle = SCAN_POS[scan_count][1]
-                if pan_tilt_enable:
-                    pan_servo.write(pan_angle)
-                    tilt_servo.write(tilt_angle)
-                scan_count += 1
-                if scan_count >= len(SCAN_POS):
-                    scan_count = 0
-            else:
-                sleep(0.1)
-            
-        elif r < BALL_SIZE_MAX:
-            if follow_mode == 0:
-                if abs(x - CENTER_X) > MIDDLE_TOLERANT:
-                    if x < CENTER_X:                              # Ball is on left
-                        pan_angle += CAMERA_STEP
-                        #print("Left   ", )
-                        if pan_angle > PAN_ANGLE_MAX:
-                            pan_angle = PAN_ANGLE_MAX
-                    else:                                         # Ball is on right
-                        pan_angle -= CAMERA_STEP
-                        #print("Right  ",)
-                        if pan_angle < PAN_ANGLE_MIN:
-                            pan_angle = PAN_ANGLE_MIN
-                if abs(y - CENTER_Y) > MIDDLE_TOLERANT:
-                    if y < CENTER_Y :                             # Ball is on top
-                        tilt_angle += CAMERA_STEP
-                        #print("Top    " )
-                        if tilt_angle > TILT_ANGLE_MAX:
-                            tilt_angle = TILT_ANGLE_MAX
-                    else:                                         # Ball is on bottom
-                        tilt_angle -= CAMERA_STEP
-                        #print("Bottom ")
-                        if tilt_angle < TILT_ANGLE_MIN:
-                            tilt_angle = TILT_ANGLE_MIN
-            else:
-                delta_x = CENTER_X - x
-                delta_y = CENTER_Y - y
-                #print("x = %s, delta_x = %s" % (x, delta_x))
-                #print("y = %s, delta_y = %s" % (y, delta_y))
-                delta_pan = int(float(CAMERA_X_ANGLE) / SCREEN_WIDTH * delta_x)
-                #print("delta_pan = %s" % delta_pan)
-                pan_angle += delta_pan
-                delta_tilt = int(float(CAMERA_Y_ANGLE) / SCREEN_HIGHT * delta_y)
-                #print("delta_tilt = %s" % delta_tilt)
-                tilt_angle += delta_tilt
-
-                if pan_angle > PAN_ANGLE_MAX:
-                    pan_angle = PAN_ANGLE_MAX
-                elif pan_angle < PAN_ANGLE_MIN:
-                    pan_angle = PAN_ANGLE_MIN
-                if tilt_angle > TILT_ANGLE_MAX:
-                    tilt_angle = TILT_ANGLE_MAX
-                elif tilt_angle < TILT_ANGLE_MIN:
-                    tilt_angle = TILT_ANGLE_MIN
-            
-            if pan_tilt_enable:
-                pan_servo.write(pan_angle)
-                tilt_servo.write(tilt_angle)
-            sleep(0.01)
-            fw_angle = 180 - pan_angle
-            if fw_angle < FW_ANGLE_MIN or fw_angle > FW_ANGLE_MAX:
-                fw_angle = ((180 - fw_angle) - 90)/2 + 90
-                if front_wheels_enable:
-                    fw.turn(fw_angle)
-                if rear_wheels_enable:
-                    bw.speed = motor_speed
-                    bw.backward()
-            else:
-                if front_wheels_enable:
-                    fw.turn(fw_angle)
-                if rear_wheels_enable:
-                    bw.speed = motor_speed
-                    bw.forward()
-        else:
-            bw.stop()
+        actuators.apply(follower.update((x, y, r) if r > BALL_SIZE_MIN else None))
+        if r <= BALL_SIZE_MIN and not scan_enable:
+            sleep(0.1)
         
 def destroy():
     bw.stop()
@@ -197,65 +147,37 @@ def destroy():
 def test():
     fw.turn(90)
 
+def detect(bgr_image, now=None):
+    '''(x, y, radius) of the ball, or None'''
+    if roi_tracking_enable:
+        return tracker.update(bgr_image, now)
+    return detector.detect(bgr_image)
+
 def find_blob() :
     radius = 0
     # Load input image
-    #_, bgr_image = img.read()
     ret, bgr_image = img.read()
-    if ret == False:
+    if ret == False or bgr_image is None:
         print("Failed to read image")
-        
-    orig_image = bgr_image
-
-    bgr_image = cv2.medianBlur(bgr_image, 3)
-  
-    # Convert input image to HSV
-    hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
-
-    # Threshold the HSV image, keep only the red pixels
-    lower_red_hue_range = cv2.inRange(hsv_image, (0, 100, 100), (10, 255, 255))
-    upper_red_hue_range = cv2.inRange(hsv_image, (160, 100, 100), (179, 255, 255))
-    # Combine the above two images
-    red_hue_image = cv2.addWeighted(lower_red_hue_range, 1.0, upper_red_hue_range, 1.0, 0.0)
-
-    red_hue_image = cv2.GaussianBlur(red_hue_image, (9, 9), 2, 2)
+        return (0, 0), 0
 
-    # Use the Hough transform to detect circles in the combined threshold image
-    circles = cv2.HoughCircles(red_hue_image, cv2.HOUGH_GRADIENT, 1, 120, 100, 20, 10, 0)
-    
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
- 
-    # Loop over all detected circles and outline them on the original image
-        all_r = np.array([])
-    # print("circles: %s"%circles)
-        try:
-            for i in circles[0,:]:
-                # print("i: %s"%i)
-                all_r = np.append(all_r, int(round(i[2])))
-            closest_ball = all_r.argmax()
-            center=(int(round(circles[0][closest_ball][0])), int(round(circles[0][closest_ball][1])))
-            radius=int(round(circles[0][closest_ball][2]))
-            if draw_circle_enable:
-                cv2.circle(orig_image, center, radius, (0, 255, 0), 5)
-        except IndexError:
-            pass
-            #print("circles: %s"%circles)
+    ball = detect(bgr_image)
+    if ball is not None:
+        center = (int(round(ball[0])), int(round(ball[1])))
+        radius = int(round(ball[2]))
+        if draw_circle_enable:
+            cv2.circle(bgr_image, center, radius, (0, 255, 0), 5)
 
     # Show images
     if show_image_enable:
-        cv2.namedWindow("Threshold lower image", cv2.WINDOW_AUTOSIZE)
-        cv2.imshow("Threshold lower image", lower_red_hue_range)
-        cv2.namedWindow("Threshold upper image", cv2.WINDOW_AUTOSIZE)
-        cv2.imshow("Threshold upper image", upper_red_hue_range)
-        cv2.namedWindow("Combined threshold images", cv2.WINDOW_AUTOSIZE)
-        cv2.imshow("Combined threshold images", red_hue_image)
+        cv2.namedWindow("Threshold image", cv2.WINDOW_AUTOSIZE)
+        cv2.imshow("Threshold image", detector.mask)
         cv2.namedWindow("Detected red circles on the input image", cv2.WINDOW_AUTOSIZE)
-        cv2.imshow("Detected red circles on the input image", orig_image)
+        cv2.imshow("Detected red circles on the input image", bgr_image)
 
-    k = cv2.waitKey(5) & 0xFF
-    if k == 27:
-        return (0, 0), 0
+        k = cv2.waitKey(5) & 0xFF
+        if k == 27:
+            return (0, 0), 0
     if radius > 3:
         return center, radius
     else:
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : controller.py
+* Description : PID pan/tilt and steering control for ball_tracker.py,
+*               gains from the config file
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+PIDFollower is a follow.Follower, follow_mode 2 in ball_tracker.py.
+Each servo is an Axis driven at a rate in degrees per second:
+
+  rate  = kp * error + ki * integral + kd * d(error)/dt + kff * feedforward
+  angle = angle + limit(rate, max_rate) * dt, within the servo's limits
+
+For pan and tilt the error is how far the servo has still to turn to
+centre the ball: the ball's offset from the picture centre in degrees,
+less what the servo turned since the frame was captured (`latency`
+seconds before the update; without this the loop overshoots as soon
+as it runs faster than the camera delay). The feed-forward is the
+ball's own angular speed, from the same angles. The steering
+follows 180 - pan the same way. The integral only grows while the
+output is not saturated, and errors within the deadband count as none.
+An output moves only once the angle is `hysteresis` degrees from it,
+so noise around the centre writes nothing.
+
+Gains are read from the config file next to this one, "name = value"
+as picar's filedb writes it; see GAINS for the names and the defaults.
+Every update is traced, and replay_log() feeds the detections
+replay.py saved back through a controller to tune the gains offline:
+
+  python controller.py detections.txt [trace.txt]
+'''
+
+import collections
+import os
+import time
+from follow import Follower, Command, FOLLOW_MODE, FORWARD, BACKWARD, STOP, \
+    PAN_ANGLE_MIN, PAN_ANGLE_MAX, TILT_ANGLE_MIN, TILT_ANGLE_MAX, FW_ANGLE_MIN, FW_ANGLE_MAX
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+DT_DEFAULT = 1 / 30.0       # Seconds assumed before the second update
+DT_MAX = 0.2                # Longer gaps count as this long
+VELOCITY_SMOOTHING = 0.3    # Weight of the newest ball speed
+TRACE_SAMPLES = 10000
+
+GAINS = collections.OrderedDict([
+    ('fov_x', 60.0),        # Camera field of view, degrees
+    ('fov_y', 45.0),
+    ('pan_kp', 8.0),        # 1/s: degrees per second for each degree of error
+    ('pan_ki', 1.0),
+    ('pan_kd', 0.0),
+    ('pan_kff', 0.8),       # Share of the ball's own speed fed forward
+    ('pan_rate', 240.0),    # Degrees per second at most
+    ('tilt_kp', 8.0),
+    ('tilt_ki', 1.0),
+    ('tilt_kd', 0.0),
+    ('tilt_kff', 0.8),
+    ('tilt_rate', 240.0),
+    ('steer_kp', 6.0),
+    ('steer_rate', 180.0),
+    ('deadband', 1.0),      # Degrees of error that count as none
+    ('hysteresis', 1.5),    # Degrees an angle moves before its output does
+    ('latency', 0.08),      # Seconds from a frame's capture to its update
+])
+
+Trace = collections.namedtuple('Trace', 'time error_x error_y speed_x speed_y pan tilt steer')
+
+def read_config(path=CONFIG):
+    '''{name: value string} of a "name = value" file'''
+    values = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            values[name.strip()] = value.strip()
+    return values
+
+def load_gains(path=CONFIG):
+    '''GAINS, with the ones the config file has replaced'''
+    gains = dict(GAINS)
+    try:
+        values = read_config(path)
+    except IOError:
+        return gains
+    for name in GAINS:
+        if name in values:
+            gains[name] = float(values[name])
+    return gains
+
+class Axis(object):
+    '''One servo driven at a PID rate, see the module docstring'''
+
+    def __init__(self, kp, ki=0.0, kd=0.0, kff=0.0, rate=180.0, low=0, high=180, deadband=0.0, hysteresis=0.0,
+                 angle=90):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.kff = kff
+        self.max_rate = rate
+        self.low = low
+        self.high = high
+        self.deadband = deadband
+        self.hysteresis = hysteresis
+        self.angle = float(angle)   # Where the controller wants the servo
+        self.output = int(angle)    # What is written to it
+        self.rate = 0.0
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error, dt, feedforward=0.0):
+        '''The output angle after dt seconds with this error, both in degrees'''
+        if abs(error) <= self.deadband:
+            error = 0.0
+        derivative = 0.0
+        if self.last_error is not None and dt > 0:
+            derivative = (error - self.last_error) / dt
+        self.last_error = error
+        wanted = self.kp * error + self.ki * self.integral + self.kd * derivative + self.kff * feedforward
+        rate = min(max(wanted, -self.max_rate), self.max_rate)
+        angle = min(max(self.angle + rate * dt, self.low), self.high)
+        # Anti-windup: no integrating further into a limit
+        saturated = rate != wanted or angle in (self.low, self.high)
+        if not saturated or error * wanted < 0:
+            self.integral += error * dt
+        self.rate = (angle - self.angle) / dt if dt > 0 else 0.0
+        self.angle = angle
+        if abs(self.angle - self.output) >= self.hysteresis or angle in (self.low, self.high):
+            self.output = int(round(self.angle))
+        return self.output
+
+class PIDFollower(Follower):
+    '''Follower with an Axis each for pan, tilt and steering'''
+
+    def __init__(self, width=160, height=120, gains=None, scan=False, clock=time.monotonic):
+        Follower.__init__(self, width, height, FOLLOW_MODE, scan, clock)
+        if gains is None:
+            gains = load_gains()
+        self.gains = gains
+        self.degrees_x = gains['fov_x'] / width     # Per pixel
+        self.degrees_y = gains['fov_y'] / height
+        deadband, hysteresis = gains['deadband'], gains['hysteresis']
+        self.pan_axis = Axis(gains['pan_kp'], gains['pan_ki'], gains['pan_kd'], gains['pan_kff'], gains['pan_rate'],
+                             PAN_ANGLE_MIN, PAN_ANGLE_MAX, deadband, hysteresis)
+        self.tilt_axis = Axis(gains['tilt_kp'], gains['tilt_ki'], gains['tilt_kd'], gains['tilt_kff'],
+                              gains['tilt_rate'], TILT_ANGLE_MIN, TILT_ANGLE_MAX, deadband, hysteresis)
+        # Steers after the camera, including the mirrored angle when backing up
+        self.steer_axis = Axis(gains['steer_kp'], rate=gains['steer_rate'], low=45, high=135,
+                               deadband=deadband, hysteresis=hysteresis)
+        self.latency = gains['latency']
+        self.speed = [0.0, 0.0]     # The ball's angular speed, degrees per second
+        self.history = collections.deque(maxlen=64)     # (time, pan, tilt) written
+        self.trace = collections.deque(maxlen=TRACE_SAMPLES)
+        self._last = None           # Time, ball angles of the last update
+
+    def update(self, ball):
+        if ball is None or ball[2] <= self.ball_size_min:
+            return self.lost()
+        if ball[2] >= self.ball_size_max:
+            return Command(None, None, None, STOP)
+        now = self.clock()
+        dt = DT_DEFAULT
+        pan, tilt = self.seen_from(now)
+        # Where the ball is, as the servo angles that would centre it, and
+        # how far that is from where the servos are going now
+        angle_x = pan + (self.center_x - ball[0]) * self.degrees_x
+        angle_y = tilt + (self.center_y - ball[1]) * self.degrees_y
+        error_x = angle_x - self.pan_axis.angle
+        error_y = angle_y - self.tilt_axis.angle
+        if self._last is not None:
+            dt = min(max(now - self._last[0], 1e-3), DT_MAX)
+            for i, (angle, last) in enumerate(((angle_x, self._last[1]), (angle_y, self._last[2]))):
+                self.speed[i] += VELOCITY_SMOOTHING * ((angle - last) / dt - self.speed[i])
+        self._last = (now, angle_x, angle_y)
+        self.pan = self.pan_axis.update(error_x, dt, self.speed[0])
+        self.tilt = self.tilt_axis.update(error_y, dt, self.speed[1])
+        self.history.append((now, self.pan, self.tilt))
+        return self.drive(dt, error_x, error_y)
+
+    def seen_from(self, now):
+        '''Pan and tilt the camera was at when the frame of an update at
+        `now` was captured, `latency` seconds before'''
+        pan, tilt = self.pan_axis.output, self.tilt_axis.output
+        for then, pan_then, tilt_then in reversed(self.history):
+            if then <= now - self.latency:
+                return pan_then, tilt_then
+            pan, tilt = pan_then, tilt_then
+        return pan, tilt
+
+    def drive(self, dt=DT_DEFAULT, error_x=0.0, error_y=0.0):
+        fw_angle = 180 - self.pan_axis.angle
+        drive = FORWARD
+        if fw_angle < FW_ANGLE_MIN or fw_angle > FW_ANGLE_MAX:
+            fw_angle = ((180 - fw_angle) - 90) / 2 + 90
+            drive = BACKWARD
+        steer = self.steer_axis.update(fw_angle - self.steer_axis.angle, dt)
+        self.trace.append(Trace(self.clock(), error_x, error_y, self.speed[0], self.speed[1],
+                                self.pan, self.tilt, steer))
+        return Command(self.pan, self.tilt, steer, drive)
+
+    def lost(self):
+        self.pan_axis.reset()
+        self.tilt_axis.reset()
+        self.speed = [0.0, 0.0]
+        self._last = None
+        command = Follower.lost(self)
+        if command.pan is not None:     # Scanning moved the camera
+            self.pan_axis.angle = self.pan_axis.output = command.pan
+            self.tilt_axis.angle = self.tilt_axis.output = command.tilt
+        return command
+
+    def save_trace(self, path):
+        with open(path, 'w') as f:
+            f.write('# %s\n' % ' '.join(Trace._fields))
+            for sample in self.trace:
+                f.write('%.4f %.3f %.3f %.2f %.2f %d %d %d\n' % sample)
+
+def read_detections(path):
+    '''(time, ball or None) per line of a replay.py detections file'''
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2 or fields[0].startswith('#'):
+                continue
+            ball = tuple(float(v) for v in fields[2:5]) if len(fields) >= 5 else None
+            yield float(fields[1]), ball
+
+def replay_log(detections, follower):
+    '''Feed (time, ball) pairs through follower at their own times; returns
+    the Commands. The camera does not move the ball here, so this shows
+    how the outputs react, not how fast the loop settles: see benchmark()
+    for that.'''
+    now = [0.0]
+    follower.clock = lambda: now[0]
+    commands = []
+    for now[0], ball in detections:
+        commands.append(follower.update(ball))
+    return commands
+
+def count_writes(commands):
+    '''Writes per part Actuators would make for these Commands'''
+    writes = collections.Counter()
+    last = {}
+    for command in commands:
+        for part, value in zip(Command._fields, command):
+            if value is not None and last.get(part) != value:
+                last[part] = value
+                writes[part] += 1
+    return writes
+
+def simulate(follower, seconds=8.0, fps=30.0, latency=1, noise=0.5, fov_x=60.0, fov_y=45.0,
+             width=160, height=120, seed=0):
+    '''Closed loop: a camera at the pan/tilt angles `latency` frames ago
+    sees a ball that steps 20 degrees aside, sits still, then circles.
+    Returns the Commands and the pan error, in degrees, per frame.'''
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    now = [0.0]
+    follower.clock = lambda: now[0]
+    pan, tilt = [90] * (latency + 1), [90] * (latency + 1)
+    commands = []
+    errors = []
+    for i in range(int(seconds * fps)):
+        t = now[0] = i / fps
+        if t < seconds / 2:
+            azimuth, elevation = (90.0, 100.0) if t < 0.5 else (110.0, 110.0)
+        else:
+            phase = 2 * np.pi * (t - seconds / 2) / 2.0
+            azimuth, elevation = 90 + 25 * np.sin(phase), 100 + 10 * np.cos(phase)
+        x = width / 2 - (azimuth - pan[0]) / fov_x * width + rng.normal(0, noise)
+        y = height / 2 - (elevation - tilt[0]) / fov_y * height + rng.normal(0, noise)
+        ball = (x, y, height / 6) if 0 <= x < width and 0 <= y < height else None
+        command = follower.update(ball)
+        commands.append(command)
+        pan.append(pan[-1] if command.pan is None else command.pan)
+        tilt.append(tilt[-1] if command.tilt is None else command.tilt)
+        del pan[0], tilt[0]
+        errors.append(azimuth - pan[-1])
+    return commands, errors
+
+def benchmark(cases=((30, 1), (30, 2), (30, 3), (60, 1), (60, 3), (60, 5))):
+    '''follow_mode 1 and the PID in the closed loop of simulate(), at
+    (frames per second, frames of delay) each: pan and tilt writes, time
+    to settle within 2 degrees after the step, and the RMS and worst pan
+    error while the ball circles'''
+    import numpy as np
+    followers = (('mode 1', lambda: Follower(mode=1)), ('pid', lambda: PIDFollower(gains=dict(GAINS))))
+    for fps, latency in cases:
+        for name, make in followers:
+            commands, errors = simulate(make(), fps=fps, latency=latency)
+            errors = np.abs(errors)
+            n = len(errors)
+            step = errors[int(0.5 * fps):n // 2]
+            outside = np.nonzero(step > 2.0)[0]
+            settled = not len(outside) or outside[-1] + 1 < len(step)
+            settle = (outside[-1] + 1) / fps if len(outside) else 0.0
+            moving = errors[n // 2 + int(fps):]
+            writes = count_writes(commands)
+            print('%2d fps %d frames late  %-6s  writes %3d  settle %s  moving rms %4.1f max %4.1f deg' % (
+                fps, latency, name, writes['pan'] + writes['tilt'],
+                '%4.2f s' % settle if settled else 'never ', np.sqrt((moving ** 2).mean()), moving.max()))
+
+def main():
+    import sys
+    if len(sys.argv) < 2:
+        benchmark()
+        return
+    follower = PIDFollower()
+    commands = replay_log(read_detections(sys.argv[1]), follower)
+    writes = count_writes(commands)
+    print('%d detections, writes %s' % (len(commands), ' '.join('%s %d' % (part, writes[part])
+                                                                for part in ('pan', 'tilt', 'steer', 'drive'))))
+    if len(sys.argv) > 2:
+        follower.save_trace(sys.argv[2])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : detector.py
+* Description : Red ball detector for ball_tracker.py, with buffers
+*               reused across frames and a per stage timing breakdown
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+Stages, each timed:
+  blur    3x3 median blur of the BGR frame
+  hsv     BGR -> HSV
+  mask    one cv2.LUT() over all three channels maps every byte to a
+          class code, then one inRange() keeps the pixels whose hue is
+          red (which wraps around from 179 to 0) and whose saturation and
+          value pass their thresholds; see mask_lut()
+  detect  'hough':   Gaussian blur and HoughCircles, the biggest circle
+          'contour': outer contours of the mask, the biggest by area,
+                     its centre from the moments; much cheaper than Hough
+
+All intermediate images live in buffers allocated on the first frame and
+reused for every later frame that fits in them, so a region of interest
+of a different size each frame (tracker.py) costs no allocation either.
+'''
+
+import time
+import cv2
+import numpy as np
+
+HOUGH = 'hough'
+CONTOUR = 'contour'
+METHODS = (HOUGH, CONTOUR)
+
+HUE_RANGE = (160, 10)       # Red; low > high wraps past 179
+SAT_MIN = 100
+VAL_MIN = 100
+MIN_RADIUS = 3              # Smaller finds are noise
+MIN_FILL = 0.5              # Contour area / enclosing circle area below this is not a ball
+
+STAGES = ('blur', 'hsv', 'mask', 'detect')
+
+def mask_lut(hue_range=HUE_RANGE, sat_min=SAT_MIN, val_min=VAL_MIN):
+    '''One 256 entry LUT for every byte of an HSV image, and the inRange()
+    bounds that turn its output into the mask.
+
+    A byte is "in hue" or not, and passes 0, 1 or 2 of the two thresholds.
+    The codes are ordered so that each condition is one interval:
+
+      code   0    1    2    3    4    5
+      hue    -    -    -    in   in   in
+      passes 0    1    2    2    1    0
+
+    so hue is [3, 5], "passes the lower threshold" is [1, 4] and "passes
+    the higher threshold" is [2, 3].'''
+    v = np.arange(256)
+    low, high = hue_range
+    if low <= high:
+        hue = (v >= low) & (v <= high)
+    else:
+        hue = (v >= low) | (v <= high)
+    hue &= v < 180
+    first, second = sorted((sat_min, val_min))
+    passes = (v >= first).astype(np.int32) + (v >= second)
+    lut = np.where(hue, 5 - passes, passes).astype(np.uint8)
+    sat = (1, 4) if sat_min == first else (2, 3)
+    val = (2, 3) if sat_min == first else (1, 4)
+    if sat_min == val_min:
+        sat = val = (2, 3)
+    lower = np.array([3, sat[0], val[0]], np.uint8)
+    upper = np.array([5, sat[1], val[1]], np.uint8)
+    return lut, lower, upper
+
+class BallDetector(object):
+    '''Finds the biggest red ball in BGR frames'''
+
+    def __init__(self, method=HOUGH, hue_range=HUE_RANGE, sat_min=SAT_MIN, val_min=VAL_MIN,
+                 min_radius=MIN_RADIUS, median=True):
+        if method not in METHODS:
+            raise ValueError('method must be one of %s, not "%s"' % (METHODS, method))
+        self.method = method
+        self.lut, self.lower, self.upper = mask_lut(hue_range, sat_min, val_min)
+        self.min_radius = min_radius
+        self.median = median
+        self.capacity = (0, 0)      # Height and width the buffers can hold
+        self.frames = 0
+        self.last = dict.fromkeys(STAGES, 0.0)      # Seconds per stage, last frame
+        self.total = dict.fromkeys(STAGES, 0.0)     # Seconds per stage, all frames
+
+    def _buffers(self, height, width):
+        '''Point the working images at the top left height x width of the buffers'''
+        if height > self.capacity[0] or width > self.capacity[1]:
+            self.capacity = (max(height, self.capacity[0]), max(width, self.capacity[1]))
+            self._blurred = np.empty(self.capacity + (3,), np.uint8)
+            self._hsv = np.empty(self.capacity + (3,), np.uint8)
+            self._codes = np.empty(self.capacity + (3,), np.uint8)
+            self._mask = np.empty(self.capacity, np.uint8)
+            self._smooth = np.empty(self.capacity, np.uint8)
+        self.blurred = self._blurred[:height, :width]
+        self.hsv = self._hsv[:height, :width]
+        self.codes = self._codes[:height, :width]
+        self.mask = self._mask[:height, :width]
+        self.smooth = self._smooth[:height, :width]
+
+    def detect(self, frame):
+        '''(x, y, radius) of the biggest red ball in frame, or None. frame
+        may be a slice of a bigger image, see tracker.py.'''
+        height, width = frame.shape[:2]
+        self._buffers(height, width)
+        t0 = time.perf_counter()
+        if self.median:
+            cv2.medianBlur(frame, 3, dst=self.blurred)
+            frame = self.blurred
+        t1 = time.perf_counter()
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self.hsv)
+        t2 = time.perf_counter()
+        # Single channel views (rows stay contiguous), so one LUT serves all three channels
+        cv2.LUT(self.hsv.reshape(height, width * 3), self.lut, dst=self.codes.reshape(height, width * 3))
+        cv2.inRange(self.codes, self.lower, self.upper, dst=self.mask)
+        t3 = time.perf_counter()
+        if self.method == HOUGH:
+            ball = self._hough()
+        else:
+            ball = self._contour()
+        t4 = time.perf_counter()
+        for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            self.last[stage] = seconds
+            self.total[stage] += seconds
+        self.frames += 1
+        if ball is None or ball[2] <= self.min_radius:
+            return None
+        return ball
+
+    def _hough(self):
+        cv2.GaussianBlur(self.mask, (9, 9), 2, dst=self.smooth, sigmaY=2)
+        # The parameters the old find_blob() ended up passing: its 100 went
+        # into the `circles` output argument, not param1
+        circles = cv2.HoughCircles(self.smooth, cv2.HOUGH_GRADIENT, 1, 120,
+                                   param1=20, param2=10, minRadius=0, maxRadius=0)
+        if circles is None:
+            return None
+        circles = circles[0]
+        x, y, r = circles[circles[:, 2].argmax()]
+        return float(x), float(y), float(r)
+
+    def _contour(self):
+        contours = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        if not contours:
+            return None
+        areas = np.fromiter((cv2.contourArea(c) for c in contours), np.float64, len(contours))
+        biggest = contours[areas.argmax()]
+        m = cv2.moments(biggest)
+        if m['m00'] == 0:
+            return None
+        _, r = cv2.minEnclosingCircle(biggest)
+        if m['m00'] < MIN_FILL * np.pi * r * r:
+            return None
+        return m['m10'] / m['m00'], m['m01'] / m['m00'], float(r)
+
+    def timings(self):
+        '''Average milliseconds per stage, and their sum'''
+        n = max(self.frames, 1)
+        ms = dict((stage, self.total[stage] * 1000 / n) for stage in STAGES)
+        ms['total'] = sum(ms.values())
+        return ms
+
+    def reset(self):
+        self.frames = 0
+        self.total = dict.fromkeys(STAGES, 0.0)
+
+def legacy_find_blob(bgr_image):
+    '''The find_blob() detection this module replaces, for benchmark()'''
+    bgr_image = cv2.medianBlur(bgr_image, 3)
+    hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
+    lower_red_hue_range = cv2.inRange(hsv_image, (0, 100, 100), (10, 255, 255))
+    upper_red_hue_range = cv2.inRange(hsv_image, (160, 100, 100), (179, 255, 255))
+    red_hue_image = cv2.addWeighted(lower_red_hue_range, 1.0, upper_red_hue_range, 1.0, 0.0)
+    red_hue_image = cv2.GaussianBlur(red_hue_image, (9, 9), 2, 2)
+    circles = cv2.HoughCircles(red_hue_image, cv2.HOUGH_GRADIENT, 1, 120, 100, 20, 10, 0)
+    if circles is None:
+        return None
+    circles = np.uint16(np.around(circles))
+    all_r = np.array([])
+    for i in circles[0, :]:
+        all_r = np.append(all_r, int(round(i[2])))
+    closest_ball = all_r.argmax()
+    x, y, r = circles[0][closest_ball]
+    return float(x), float(y), float(r)
+
+def synthetic_frame(width, height, x, y, r, rng=None, color=(40, 30, 210)):
+    '''A noisy dull background with a red ball of radius r at (x, y)'''
+    if rng is None:
+        rng = np.random.default_rng()
+    frame = rng.integers(60, 140, (height, width, 3), np.uint8)
+    frame[..., 2] //= 2                     # Keep the background away from red
+    if r > 0:
+        cv2.circle(frame, (int(round(x)), int(round(y))), int(round(r)), color, -1, cv2.LINE_AA)
+    return frame
+
+def benchmark(frames=200, sizes=((160, 120), (320, 240), (640, 480))):
+    '''Frames per second, stage times and centre error of the old pipeline
+    and both methods on synthetic frames'''
+    rng = np.random.default_rng(1)
+    for width, height in sizes:
+        truth = []
+        images = []
+        for i in range(frames):
+            r = height / 8
+            x = width / 2 + width / 3 * np.sin(i / 15.0)
+            y = height / 2 + height / 4 * np.cos(i / 20.0)
+            truth.append((x, y))
+            images.append(synthetic_frame(width, height, x, y, r, rng))
+        detectors = [('legacy', legacy_find_blob)]
+        for method in METHODS:
+            detectors.append((method, BallDetector(method)))
+        for name, detector in detectors:
+            detect = detector if name == 'legacy' else detector.detect
+            found = 0
+            error = 0.0
+            start = time.perf_counter()
+            for (x, y), image in zip(truth, images):
+                ball = detect(image)
+                if ball is not None:
+                    found += 1
+                    error += np.hypot(ball[0] - x, ball[1] - y)
+            elapsed = time.perf_counter() - start
+            stages = ''
+            if name != 'legacy':
+                stages = '  ' + '  '.join('%s %.2f' % item for item in detector.timings().items())
+            print('%dx%d %-8s %7.0f fps  found %3d/%d  error %4.1f px%s' % (
+                width, height, name, frames / elapsed, found, frames, error / max(found, 1), stages))
+
+if __name__ == '__main__':
+    benchmark()
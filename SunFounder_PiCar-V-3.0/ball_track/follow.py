@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : follow.py
+* Description : Follow logic of ball_tracker.py: from a detected ball to
+*               pan/tilt angles, a steering angle and a drive direction
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+Follower holds no hardware, so it runs the same on the car, in the
+pipeline's actuation thread and in an offline replay. Actuators applies
+its Commands to the servos and wheels, writing only what changed.
+'''
+
+import collections
+import time
+
+FORWARD = 'forward'
+BACKWARD = 'backward'
+STOP = 'stop'
+
+# camera follow mode:
+# 0 = step by step(slow, stable),
+# 1 = calculate the step(fast, unstable)
+FOLLOW_MODE = 1
+
+CAMERA_STEP = 2
+CAMERA_X_ANGLE = 20
+CAMERA_Y_ANGLE = 20
+
+MIDDLE_TOLERANT = 5
+PAN_ANGLE_MAX   = 170
+PAN_ANGLE_MIN   = 10
+TILT_ANGLE_MAX  = 150
+TILT_ANGLE_MIN  = 70
+FW_ANGLE_MAX    = 90+30
+FW_ANGLE_MIN    = 90-30
+
+SCAN_POS = [[20, TILT_ANGLE_MIN], [50, TILT_ANGLE_MIN], [90, TILT_ANGLE_MIN], [130, TILT_ANGLE_MIN], [160, TILT_ANGLE_MIN],
+            [160, 80], [130, 80], [90, 80], [50, 80], [20, 80]]
+SCAN_INTERVAL = 0.5         # Seconds at each scan position
+
+# pan, tilt and steer are angles, None leaves that servo alone
+Command = collections.namedtuple('Command', 'pan tilt steer drive')
+
+class Follower(object):
+    '''What the camera and the car should do about a ball at (x, y) with
+    radius r in a width x height picture'''
+
+    def __init__(self, width=160, height=120, mode=FOLLOW_MODE, scan=False, clock=time.monotonic):
+        self.width = width
+        self.height = height
+        self.center_x = width / 2
+        self.center_y = height / 2
+        self.ball_size_min = height / 10
+        self.ball_size_max = height / 3
+        self.mode = mode
+        self.scan = scan
+        self.clock = clock
+        self.pan = 90
+        self.tilt = 90
+        self.scan_count = 0
+        self._next_scan = 0.0
+
+    def update(self, ball):
+        '''Command for a detection, (x, y, r) or None'''
+        if ball is None or ball[2] <= self.ball_size_min:
+            return self.lost()
+        if ball[2] >= self.ball_size_max:
+            return Command(None, None, None, STOP)      # Close enough
+        x, y = ball[0], ball[1]
+        if self.mode == 0:
+            if abs(x - self.center_x) > MIDDLE_TOLERANT:
+                self.pan += CAMERA_STEP if x < self.center_x else -CAMERA_STEP
+            if abs(y - self.center_y) > MIDDLE_TOLERANT:
+                self.tilt += CAMERA_STEP if y < self.center_y else -CAMERA_STEP
+        else:
+            self.pan += int(float(CAMERA_X_ANGLE) / self.width * (self.center_x - x))
+            self.tilt += int(float(CAMERA_Y_ANGLE) / self.height * (self.center_y - y))
+        self.pan = min(max(self.pan, PAN_ANGLE_MIN), PAN_ANGLE_MAX)
+        self.tilt = min(max(self.tilt, TILT_ANGLE_MIN), TILT_ANGLE_MAX)
+        return self.drive()
+
+    def drive(self):
+        '''Steer after the camera: ahead if the ball is within the steering
+        range, else back up turning the other way'''
+        fw_angle = 180 - self.pan
+        if fw_angle < FW_ANGLE_MIN or fw_angle > FW_ANGLE_MAX:
+            return Command(self.pan, self.tilt, ((180 - fw_angle) - 90) / 2 + 90, BACKWARD)
+        return Command(self.pan, self.tilt, fw_angle, FORWARD)
+
+    def lost(self):
+        '''No ball: stop, and look around if scanning is on'''
+        if not self.scan:
+            return Command(None, None, None, STOP)
+        now = self.clock()
+        if now >= self._next_scan:
+            self._next_scan = now + SCAN_INTERVAL
+            self.pan, self.tilt = SCAN_POS[self.scan_count]
+            self.scan_count = (self.scan_count + 1) % len(SCAN_POS)
+        return Command(self.pan, self.tilt, None, STOP)
+
+class Actuators(object):
+    '''Applies Commands; a part given as None is left alone'''
+
+    def __init__(self, pan_lut=None, tilt_lut=None, fw=None, bw=None, speed=60):
+        self.pan_lut = pan_lut
+        self.tilt_lut = tilt_lut
+        self.fw = fw
+        self.bw = bw
+        self.speed = speed
+        self.writes = 0
+        self._last = {}             # What was written last, by part
+
+    def _changed(self, part, value):
+        if value is None or self._last.get(part) == value:
+            return False
+        self._last[part] = value
+        self.writes += 1
+        return True
+
+    def apply(self, command):
+        if self.pan_lut is not None and self._changed('pan', command.pan):
+            self.pan_lut.write(command.pan)
+        if self.tilt_lut is not None and self._changed('tilt', command.tilt):
+            self.tilt_lut.write(command.tilt)
+        if self.fw is not None and self._changed('steer', command.steer):
+            self.fw.turn(command.steer)
+        if self.bw is not None and self._changed('drive', command.drive):
+            if command.drive == STOP:
+                self.bw.stop()
+            else:
+                self.bw.speed = self.speed
+                if command.drive == FORWARD:
+                    self.bw.forward()
+                else:
+                    self.bw.backward()
+
+    def stop(self):
+        self.apply(Command(None, None, None, STOP))
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : pipeline.py
+* Description : Capture, detection and actuation of ball_tracker.py in
+*               their own threads, handing over only the newest item
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+  capture   reads the camera as fast as it delivers  -> frames queue
+  detect    runs the detector on the newest frame     -> results queue
+            (processes > 0: a process pool, frames in flight = processes;
+            each worker has its own whole frame detector, no ROI tracking)
+  actuate   turns each new result into a Command and applies it as soon
+            as it comes, at most `rate` times a second; with no result for
+            STALE seconds, stops the car
+
+Both queues are bounded and drop the oldest item when full, so a slow
+stage works on the newest data instead of a backlog. OpenCV releases
+the GIL, so the threads do run in parallel.
+
+report() gives each stage's rate, the drops and the frame to servo
+latency: from the moment read() returned a frame to the moment the
+Command made from it was applied.
+'''
+
+import collections
+import threading
+import time
+
+CAPTURE = 'capture'
+DETECT = 'detect'
+ACTUATE = 'actuate'
+
+RATE = 50                   # Most Commands applied per second
+STALE = 0.5                 # Seconds without a result before the car stops
+QUEUE_SIZE = 1
+REPORT_INTERVAL = 2.0
+LATENCY_SAMPLES = 500
+
+# seq numbers the frames; time is when read() returned it
+Frame = collections.namedtuple('Frame', 'seq time image')
+Result = collections.namedtuple('Result', 'seq time ball detected')
+
+class LatestQueue(object):
+    '''Bounded queue whose put() never blocks: when full, the oldest item
+    is dropped and counted'''
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.items = collections.deque()
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        '''Oldest item, or None on timeout or close()'''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            return self.items.popleft() if self.items else None
+
+    def get_nowait(self):
+        with self._cond:
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class Meter(object):
+    '''Count and rate of one stage'''
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.count = 0
+        self._mark = (clock(), 0)
+
+    def tick(self):
+        self.count += 1
+
+    def rate(self):
+        '''Per second since the last call'''
+        now = self.clock()
+        then, count = self._mark
+        self._mark = (now, self.count)
+        return (self.count - count) / (now - then) if now > then else 0.0
+
+_worker_detector = None
+
+def _init_worker(method):
+    global _worker_detector
+    from detector import BallDetector
+    _worker_detector = BallDetector(method)
+
+def _detect_in_worker(image):
+    return _worker_detector.detect(image)
+
+class Pipeline(object):
+    '''read() -> (ok, image) like cv2.VideoCapture.read; detect(image, time)
+    -> (x, y, r) or None; follower and actuators as in follow.py'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "pipeline.py":'
+
+    def __init__(self, read, detect, follower, actuators, rate=RATE, processes=0, method=None,
+                 queue_size=QUEUE_SIZE, clock=time.monotonic):
+        self.read = read
+        self.detect = detect
+        self.follower = follower
+        self.actuators = actuators
+        self.period = 1.0 / rate
+        self.processes = processes
+        self.method = method
+        self.clock = clock
+        self.frames = LatestQueue(queue_size)
+        self.results = LatestQueue(queue_size)
+        self.meters = dict((stage, Meter(clock)) for stage in (CAPTURE, DETECT, ACTUATE))
+        self.read_failures = 0
+        self.latency = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.commands = []          # (time, seq, Command), when record=True
+        self.record = False
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        detect = self._detect_pool if self.processes else self._detect_thread
+        for name, target in ((CAPTURE, self._capture), (DETECT, detect), (ACTUATE, self._actuate)):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self.frames.close()
+        self.results.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.actuators.stop()
+
+    def run(self, duration=None, report_interval=REPORT_INTERVAL):
+        '''start(), print report() every report_interval until duration or Ctrl+C, stop()'''
+        self.start()
+        end = None if duration is None else self.clock() + duration
+        try:
+            while end is None or self.clock() < end:
+                wait = report_interval if end is None else min(report_interval, end - self.clock())
+                if self._stop.wait(max(wait, 0)):
+                    break
+                print(self.format_report(self.report()))
+        finally:
+            self.stop()
+
+    def _capture(self):
+        seq = 0
+        failures = 0
+        while not self._stop.is_set():
+            ok, image = self.read()
+            now = self.clock()
+            if not ok or image is None:
+                self.read_failures += 1
+                if self._DEBUG:
+                    print(self._DEBUG_INFO, 'Read failed, %d in a row' % (failures + 1))
+                failures += 1
+                self._stop.wait(min(0.5, 0.01 * 2 ** min(failures, 6)))
+                continue
+            failures = 0
+            seq += 1
+            self.meters[CAPTURE].tick()
+            self.frames.put(Frame(seq, now, image))
+
+    def _detect_thread(self):
+        while not self._stop.is_set():
+            frame = self.frames.get(timeout=0.5)
+            if frame is None:
+                continue
+            ball = self.detect(frame.image, frame.time)
+            self.meters[DETECT].tick()
+            self.results.put(Result(frame.seq, frame.time, ball, self.clock()))
+
+    def _detect_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        slots = threading.Semaphore(self.processes)
+        lock = threading.Lock()
+        published = [0]
+
+        def done(future, frame):
+            slots.release()
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.meters[DETECT].tick()
+            with lock:
+                if frame.seq < published[0]:    # A newer frame is already out
+                    return
+                published[0] = frame.seq
+                self.results.put(Result(frame.seq, frame.time, future.result(), self.clock()))
+
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.method,)) as pool:
+            while not self._stop.is_set():
+                # Take a frame only once a worker is free, so it is the newest
+                if not slots.acquire(timeout=0.5):
+                    continue
+                frame = self.frames.get(timeout=0.5)
+                if frame is None:
+                    slots.release()
+                    continue
+                future = pool.submit(_detect_in_worker, frame.image)
+                future.add_done_callback(lambda future, frame=frame: done(future, frame))
+
+    def _actuate(self):
+        last_result = self.clock()
+        last_apply = None
+        while not self._stop.is_set():
+            result = self.results.get(timeout=self.period)
+            now = self.clock()
+            if result is None:
+                if now - last_result > STALE:
+                    self.actuators.stop()
+                continue
+            if last_apply is not None and now - last_apply < self.period:
+                # No faster than rate; whatever comes in meanwhile replaces result
+                self._stop.wait(self.period - (now - last_apply))
+            newer = self.results.get_nowait()
+            if newer is not None:
+                result = newer
+            last_result = self.clock()
+            command = self.follower.update(result.ball)
+            self.actuators.apply(command)
+            applied = last_apply = self.clock()
+            self.meters[ACTUATE].tick()
+            self.latency.append(applied - result.time)
+            if self.record:
+                self.commands.append((applied, result.seq, command))
+
+    def report(self):
+        latency = sorted(self.latency)
+        n = len(latency)
+
+        def ms(p):
+            return latency[min(n - 1, int(n * p))] * 1000 if n else 0.0
+
+        rates = dict((stage, meter.rate()) for stage, meter in self.meters.items())
+        return {
+            'capture_fps': rates[CAPTURE],
+            'detect_fps': rates[DETECT],
+            'actuate_hz': rates[ACTUATE],
+            'frames_dropped': self.frames.dropped,
+            'results_dropped': self.results.dropped,
+            'read_failures': self.read_failures,
+            'writes': self.actuators.writes,
+            'latency_ms_p50': ms(0.5),
+            'latency_ms_p95': ms(0.95),
+            'latency_ms_max': latency[-1] * 1000 if n else 0.0,
+        }
+
+    @staticmethod
+    def format_report(report):
+        return ('capture %(capture_fps).1f fps, detect %(detect_fps).1f fps, actuate %(actuate_hz).1f Hz, '
+                'dropped %(frames_dropped)d frames %(results_dropped)d results, '
+                'frame->servo %(latency_ms_p50).1f/%(latency_ms_p95).1f/%(latency_ms_max).1f ms p50/p95/max, '
+                '%(writes)d writes' % report)
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+class SyntheticCamera(object):
+    '''A camera delivering a moving red ball at fps, for benchmark()'''
+
+    def __init__(self, width=160, height=120, fps=30):
+        import numpy as np
+        from detector import synthetic_frame
+        rng = np.random.default_rng(3)
+        self.images = []
+        for i in range(60):
+            x = width / 2 + width / 4 * np.sin(i * 2 * np.pi / 60)
+            self.images.append(synthetic_frame(width, height, x, height / 2, height / 6, rng))
+        self.period = 1.0 / fps
+        self.n = 0
+        self._next = time.monotonic()
+
+    def read(self):
+        self._next += self.period
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic()
+        self.n += 1
+        return True, self.images[self.n % len(self.images)]
+
+class SlowPart(object):
+    '''Servo or wheels whose every call takes as long as an I2C write'''
+
+    def __init__(self, delay=0.003):
+        self.delay = delay
+        self.speed = 0
+
+    def _write(self, *args):
+        time.sleep(self.delay)
+
+    write = turn = forward = backward = stop = _write
+
+def benchmark(duration=5.0, width=160, height=120, fps=30):
+    '''Frame to servo latency and rates of the old serial loop, and of the
+    pipeline with a detection thread and with a process pool, on a
+    synthetic camera and I2C parts that take 3 ms a write'''
+    from detector import BallDetector, HOUGH
+    from tracker import BallTracker
+    from follow import Follower, Actuators
+
+    def parts():
+        return Actuators(SlowPart(), SlowPart(), SlowPart(), SlowPart())
+
+    # The loop main() ran before: read, detect, servos, 10 ms, wheels
+    camera = SyntheticCamera(width, height, fps)
+    tracker = BallTracker(BallDetector(HOUGH))
+    follower = Follower(width, height)
+    actuators = parts()
+    latency = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        ok, image = camera.read()
+        read = time.monotonic()
+        command = follower.update(tracker.update(image, read))
+        actuators.apply(command._replace(steer=None, drive=None))
+        time.sleep(0.01)
+        actuators.apply(command)
+        latency.append(time.monotonic() - read)
+    latency.sort()
+    n = len(latency)
+    print('serial            loop %.1f fps, frame->servo %.1f/%.1f/%.1f ms p50/p95/max, %d writes' % (
+        n / duration, latency[n // 2] * 1000, latency[int(n * 0.95)] * 1000, latency[-1] * 1000,
+        actuators.writes))
+
+    for processes in (0, 2):
+        camera = SyntheticCamera(width, height, fps)
+        tracker = BallTracker(BallDetector(HOUGH))
+        pipeline = Pipeline(camera.read, tracker.update, Follower(width, height), parts(),
+                            processes=processes, method=HOUGH)
+        pipeline.start()
+        time.sleep(1.0)                     # Pool start up
+        pipeline.report()
+        pipeline.latency.clear()
+        time.sleep(duration)
+        report = pipeline.report()
+        pipeline.stop()
+        print('pipeline, %d proc  %s' % (processes, pipeline.format_report(report)))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : replay.py
+* Description : Offline replay of ball_tracker.py's detection and follow
+*               logic on recorded video or synthetic frames
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+Every frame goes through the detector (or the tracker around it), the
+Follower and Actuators whose servos and wheels are RecordingParts, so no
+car is needed. Frame i is replayed at time i / fps, which makes a replay
+of the same frames give the same commands every time.
+
+Reported per run:
+  fps         frames per second of detection, follow and actuation,
+              without reading or decoding the frames
+  stages      p50 / p95 milliseconds of read, the detector stages, the
+              tracker around them, follow and actuate
+  precision   hits / detections, recall hits / balls, where a hit is a
+              detection within MATCH_RADII true radii (at least
+              MATCH_MIN pixels) of the true centre
+  commands    every servo and wheel write as "frame part value" lines
+
+Ground truth comes with the synthetic scenes. For a video, a labels file
+has one "frame x y r" line per frame with a ball in it (frames counted
+from 0); frames without a line have no ball. Without labels only fps,
+stages and commands are reported.
+
+  python replay.py                          every scene, every method
+  python replay.py video.h264 --labels video.txt --commands out.txt
+'''
+
+import collections
+import time
+import cv2
+import numpy as np
+from detector import BallDetector, METHODS, HOUGH, STAGES, synthetic_frame
+from tracker import BallTracker, PREDICTORS
+from follow import Follower, Actuators, FOLLOW_MODE
+from controller import PIDFollower, load_gains
+
+FPS = 30.0
+WIDTH = 160
+HEIGHT = 120
+FRAMES = 300
+
+MATCH_RADII = 0.5
+MATCH_MIN = 4
+
+SCENES = ('sweep', 'cross', 'approach', 'hide', 'distractor')
+REPLAY_STAGES = ('read',) + STAGES + ('track', 'follow', 'actuate')
+
+Frame = collections.namedtuple('Frame', 'image truth')     # truth: (x, y, r), None or UNLABELED
+UNLABELED = False
+
+def synthetic_scene(scene, frames=FRAMES, width=WIDTH, height=HEIGHT, fps=FPS, seed=0):
+    '''Frames of a rendered ball moving as `scene` says:
+      sweep       left and right, up and down, speeding up
+      cross       in from the left and out on the right, once a second
+      approach    coming closer until it fills a third of the picture
+      hide        sweep, hidden a third of the time
+      distractor  sweep, with a red square that is not a ball'''
+    if scene not in SCENES:
+        raise ValueError('scene must be one of %s, not "%s"' % (SCENES, scene))
+    rng = np.random.default_rng(seed)
+    result = []
+    for i in range(frames):
+        t = i / fps
+        x = width / 2 + width / 3 * np.sin(1.5 * t + 0.2 * t * t)
+        y = height / 2 + height / 4 * np.cos(2.0 * t)
+        r = height / 8
+        if scene == 'cross':
+            x = -width / 4 + 1.5 * width * (t % 1.0)
+            y = height / 2
+        elif scene == 'approach':
+            x = width / 2 + width / 6 * np.sin(t)
+            r = height / 12 + (height / 2.5 - height / 12) * min(t / (frames / fps * 0.8), 1.0)
+        hidden = scene == 'hide' and (i // 30) % 3 == 2
+        truth = None if hidden else (x, y, r)
+        image = synthetic_frame(width, height, x, y, 0 if hidden else r, rng)
+        if scene == 'distractor':
+            side = height // 10
+            cv2.rectangle(image, (width // 8, height // 8), (width // 8 + side, height // 8 + side // 2),
+                          (40, 30, 210), -1)
+        if truth is not None and (x < 0 or x >= width or y < 0 or y >= height):
+            truth = None            # Centre out of the picture: no ball to find
+        result.append(Frame(image, truth))
+    return result
+
+def read_labels(path):
+    '''{frame: (x, y, r)} from a labels file'''
+    labels = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            labels[int(fields[0])] = tuple(float(v) for v in fields[1:4])
+    return labels
+
+def video_frames(path, labels=None):
+    '''Frames of a video file, with the labels if there are any'''
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise IOError('Cannot open "%s"' % path)
+    i = 0
+    try:
+        while True:
+            ok, image = video.read()
+            if not ok:
+                break
+            yield Frame(image, UNLABELED if labels is None else labels.get(i))
+            i += 1
+    finally:
+        video.release()
+
+class RecordingPart(object):
+    '''Stands in for a ServoLUT, the front wheels or the back wheels and
+    logs every call as (frame, part, value)'''
+
+    def __init__(self, name, replay):
+        self.name = name
+        self.replay = replay
+        self.speed = 0
+
+    def _log(self, value):
+        self.replay.commands.append((self.replay.frame, self.name, value))
+
+    def write(self, angle):
+        self._log(angle)
+
+    def turn(self, angle):
+        self._log(angle)
+
+    def forward(self):
+        self._log('forward')
+
+    def backward(self):
+        self._log('backward')
+
+    def stop(self):
+        self._log('stop')
+
+class Replay(object):
+    '''One configuration of detector, tracker and follower, fed with
+    frames by run()'''
+
+    def __init__(self, method=HOUGH, predictor=None, follow_mode=FOLLOW_MODE, scan=False, fps=FPS,
+                 follower=None):
+        self.method = method
+        self.predictor = predictor
+        self.fps = fps
+        self.detector = BallDetector(method)
+        self.tracker = BallTracker(self.detector, predictor) if predictor else None
+        self.follow_mode = follow_mode
+        self.scan = scan
+        self.follower = follower
+        self.now = 0.0
+        self.frame = -1
+        self.commands = []          # (frame, part, value)
+        self.detections = []        # (frame, time, ball or None)
+        self.times = dict((stage, []) for stage in REPLAY_STAGES)
+        self.counts = collections.Counter()
+        self.error = 0.0
+        self.actuators = Actuators(RecordingPart('pan', self), RecordingPart('tilt', self),
+                                   RecordingPart('steer', self), RecordingPart('drive', self))
+
+    def run(self, frames):
+        clock = time.perf_counter
+        frames = iter(frames)
+        while True:
+            t0 = clock()
+            frame = next(frames, None)
+            if frame is None:
+                break
+            t1 = clock()
+            self.frame += 1
+            self.now = self.frame / self.fps
+            image = frame.image
+            if self.follower is None:
+                height, width = image.shape[:2]
+                if self.follow_mode == 2:
+                    self.follower = PIDFollower(width, height, load_gains(), self.scan, clock=lambda: self.now)
+                else:
+                    self.follower = Follower(width, height, self.follow_mode, self.scan, clock=lambda: self.now)
+            before = dict(self.detector.total)
+            t2 = clock()
+            ball = self.tracker.update(image, self.now) if self.tracker else self.detector.detect(image)
+            t3 = clock()
+            command = self.follower.update(ball)
+            t4 = clock()
+            self.actuators.apply(command)
+            t5 = clock()
+            detector_time = 0.0
+            for stage in STAGES:
+                seconds = self.detector.total[stage] - before[stage]
+                self.times[stage].append(seconds)
+                detector_time += seconds
+            self.times['read'].append(t1 - t0)
+            self.times['track'].append(max(t3 - t2 - detector_time, 0.0))
+            self.times['follow'].append(t4 - t3)
+            self.times['actuate'].append(t5 - t4)
+            self.detections.append((self.frame, self.now, ball))
+            self._score(ball, frame.truth)
+        return self
+
+    def _score(self, ball, truth):
+        if truth is UNLABELED:
+            return
+        if truth is None:
+            self.counts['false' if ball is not None else 'empty'] += 1
+            return
+        if ball is None:
+            self.counts['missed'] += 1
+            return
+        distance = np.hypot(ball[0] - truth[0], ball[1] - truth[1])
+        if distance <= max(MATCH_MIN, MATCH_RADII * truth[2]):
+            self.counts['hits'] += 1
+            self.error += distance
+        else:
+            self.counts['false'] += 1   # Something else found, and the ball missed
+            self.counts['missed'] += 1
+
+    def report(self):
+        frames = self.frame + 1
+        processing = sum(sum(self.times[stage]) for stage in REPLAY_STAGES if stage != 'read')
+        stages = {}
+        for stage in REPLAY_STAGES:
+            times = sorted(self.times[stage])
+            n = len(times)
+            stages[stage] = (times[n // 2] * 1000 if n else 0.0, times[min(n - 1, int(n * 0.95))] * 1000 if n else 0.0)
+        writes = collections.Counter(part for _, part, _ in self.commands)
+        report = {
+            'frames': frames,
+            'fps': frames / processing if processing else 0.0,
+            'stages': stages,
+            'writes': dict(writes),
+        }
+        if self.counts:
+            hits = self.counts['hits']
+            report['precision'] = hits / max(hits + self.counts['false'], 1)
+            report['recall'] = hits / max(hits + self.counts['missed'], 1)
+            report['error'] = self.error / max(hits, 1)
+        return report
+
+    @staticmethod
+    def format_report(report):
+        text = '%5d frames %7.0f fps' % (report['frames'], report['fps'])
+        if 'precision' in report:
+            text += '  precision %.3f recall %.3f error %4.1f px' % (
+                report['precision'], report['recall'], report['error'])
+        text += '  writes %s' % ' '.join('%s %d' % (part, report['writes'].get(part, 0))
+                                        for part in ('pan', 'tilt', 'steer', 'drive'))
+        text += '\n      ms p50/p95  ' + '  '.join('%s %.2f/%.2f' % ((stage,) + report['stages'][stage])
+                                               for stage in REPLAY_STAGES)
+        return text
+
+    def save_commands(self, path):
+        with open(path, 'w') as f:
+            for frame, part, value in self.commands:
+                f.write('%d %s %s\n' % (frame, part, value))
+
+    def save_detections(self, path):
+        '''"frame time x y r" per frame, "frame time" alone for no ball'''
+        with open(path, 'w') as f:
+            for frame, now, ball in self.detections:
+                if ball is None:
+                    f.write('%d %.4f\n' % (frame, now))
+                else:
+                    f.write('%d %.4f %.2f %.2f %.2f\n' % ((frame, now) + tuple(ball)))
+
+def benchmark(frames=FRAMES):
+    '''Every synthetic scene through every method, without and with each
+    tracker predictor'''
+    for scene in SCENES:
+        source = synthetic_scene(scene, frames)
+        for method in METHODS:
+            for predictor in (None,) + PREDICTORS:
+                replay = Replay(method, predictor).run(source)
+                print('%-10s %-7s %-8s %s' % (scene, method, predictor or 'full',
+                                             Replay.format_report(replay.report())))
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay ball_tracker.py offline')
+    parser.add_argument('video', nargs='?', help='video file; none for every synthetic scene')
+    parser.add_argument('--labels', help='"frame x y r" ground truth for the video')
+    parser.add_argument('--scene', choices=SCENES, help='one synthetic scene instead of a video')
+    parser.add_argument('--method', choices=METHODS, default=HOUGH)
+    parser.add_argument('--predictor', choices=PREDICTORS, help='track with this predictor')
+    parser.add_argument('--follow-mode', type=int, choices=(0, 1, 2), default=FOLLOW_MODE,
+                        help='2 for the PID of controller.py, with the gains in config')
+    parser.add_argument('--scan', action='store_true', help='scan for a lost ball')
+    parser.add_argument('--fps', type=float, default=FPS, help='frame rate to replay the video at')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames per synthetic scene')
+    parser.add_argument('--commands', help='write the servo and wheel commands here')
+    parser.add_argument('--detections', help='write the detections here')
+    args = parser.parse_args()
+
+    if args.video is None and args.scene is None:
+        benchmark(args.frames)
+        return
+    if args.video is not None:
+        source = video_frames(args.video, read_labels(args.labels) if args.labels else None)
+    else:
+        source = synthetic_scene(args.scene, args.frames, fps=args.fps)
+    replay = Replay(args.method, args.predictor, args.follow_mode, args.scan, args.fps).run(source)
+    print(Replay.format_report(replay.report()))
+    if args.commands:
+        replay.save_commands(args.commands)
+    if args.detections:
+        replay.save_detections(args.detections)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : tracker.py
+* Description : Ball tracking state machine: search the whole frame
+*               until the ball is found, then only a predicted region
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+
+  SEARCH  run the detector on the whole frame; a hit locks on -> TRACK
+  TRACK   predict where the ball is now from its last positions and run
+          the detector only on a window ROI_RADII ball radii around it,
+          widened by how far the ball can move in between. Every miss
+          widens the window further; after MAX_MISSES misses in a row
+          -> SEARCH
+
+Predictors:
+  velocity  constant velocity, the velocity smoothed over the hits
+  kalman    cv2.KalmanFilter on (x, y, vx, vy), steadier with a noisy
+            detector
+'''
+
+import time
+import cv2
+import numpy as np
+
+SEARCH = 'search'
+TRACK = 'track'
+
+VELOCITY = 'velocity'
+KALMAN = 'kalman'
+PREDICTORS = (VELOCITY, KALMAN)
+
+ROI_RADII = 2.5             # Half window size, in ball radii
+ROI_MIN = 16                # Smallest half window, pixels
+MAX_MISSES = 5              # Misses in a row before a full search
+VELOCITY_SMOOTHING = 0.5    # Weight of the newest velocity
+MATCH_RADII = 0.5           # benchmark(): a hit is this many true radii from the centre at most
+
+class VelocityPredictor(object):
+    def __init__(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+
+    def reset(self, x, y):
+        self.position = np.array([x, y], np.float64)
+        self.velocity = np.zeros(2)
+
+    def predict(self, dt):
+        return self.position + self.velocity * dt
+
+    def correct(self, x, y, dt):
+        measured = np.array([x, y], np.float64)
+        if dt > 0:
+            velocity = (measured - self.position) / dt
+            self.velocity += VELOCITY_SMOOTHING * (velocity - self.velocity)
+        self.position = measured
+
+class KalmanPredictor(object):
+    def __init__(self, process_noise=1000.0, measurement_noise=2.0):
+        # Unmodelled acceleration in pixels/s^2 and detector noise in pixels
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.filter = None
+
+    def reset(self, x, y):
+        kf = cv2.KalmanFilter(4, 2)
+        kf.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], np.float32)
+        kf.measurementNoiseCov = np.eye(2, dtype=np.float32) * self.measurement_noise ** 2
+        kf.errorCovPost = np.diag([4, 4, 1e4, 1e4]).astype(np.float32)
+        kf.statePost = np.array([[x], [y], [0], [0]], np.float32)
+        self.filter = kf
+        self._predicted = False
+        self._elapsed = 0.0         # Seconds the filter has been stepped since the last correct()
+
+    def _step(self, dt):
+        kf = self.filter
+        kf.transitionMatrix = np.array([[1, 0, dt, 0], [0, 1, 0, dt], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32)
+        # White noise acceleration
+        q = self.process_noise ** 2
+        kf.processNoiseCov = np.array([[dt ** 4 / 4, 0, dt ** 3 / 2, 0],
+                                       [0, dt ** 4 / 4, 0, dt ** 3 / 2],
+                                       [dt ** 3 / 2, 0, dt ** 2, 0],
+                                       [0, dt ** 3 / 2, 0, dt ** 2]], np.float32) * q
+        return kf.predict()
+
+    def predict(self, dt):
+        '''dt is the time since the last hit; predict() moves statePost, so
+        on a miss only the time since the previous predict() is stepped'''
+        state = self._step(dt - self._elapsed)
+        self._elapsed = dt
+        self._predicted = True
+        return state[:2, 0].astype(np.float64)
+
+    def correct(self, x, y, dt):
+        if not self._predicted or dt != self._elapsed:
+            self._step(dt - self._elapsed)
+        self.filter.correct(np.array([[x], [y]], np.float32))
+        self._predicted = False
+        self._elapsed = 0.0
+
+    @property
+    def velocity(self):
+        return self.filter.statePost[2:, 0].astype(np.float64)
+
+class BallTracker(object):
+    '''Wraps a detector.BallDetector; update() returns the ball in whole
+    frame coordinates like detect() does'''
+
+    def __init__(self, detector, predictor=VELOCITY, max_misses=MAX_MISSES, clock=time.monotonic):
+        if predictor not in PREDICTORS:
+            raise ValueError('predictor must be one of %s, not "%s"' % (PREDICTORS, predictor))
+        self.detector = detector
+        self.predictor = VelocityPredictor() if predictor == VELOCITY else KalmanPredictor()
+        self.max_misses = max_misses
+        self.clock = clock
+        self.state = SEARCH
+        self.misses = 0
+        self.radius = 0.0
+        self.roi = None             # (x0, y0, x1, y1) searched last, None for the whole frame
+        self.last_time = None
+        self.frames = 0
+        self.searches = 0           # Whole frame searches
+        self.pixels = 0             # Pixels run through the detector
+        self.frame_pixels = 0       # Pixels in the frames given
+
+    @property
+    def tracking(self):
+        return self.state == TRACK
+
+    def update(self, frame, now=None):
+        '''(x, y, radius) of the ball in frame, or None'''
+        if now is None:
+            now = self.clock()
+        height, width = frame.shape[:2]
+        self.frames += 1
+        self.frame_pixels += height * width
+        if self.state == TRACK:
+            dt = now - self.last_time
+            x, y = self.predictor.predict(dt)
+            # Room for the ball, for a velocity error, and more after every miss
+            speed = np.hypot(*self.predictor.velocity)
+            half = max(ROI_MIN, ROI_RADII * self.radius + 0.5 * speed * dt) * (1 + self.misses)
+            x0 = int(max(0, x - half))
+            y0 = int(max(0, y - half))
+            x1 = int(min(width, x + half + 1))
+            y1 = int(min(height, y + half + 1))
+            if x1 - x0 < 8 or y1 - y0 < 8:
+                ball = None             # Predicted out of the picture
+            else:
+                self.roi = (x0, y0, x1, y1)
+                self.pixels += (x1 - x0) * (y1 - y0)
+                ball = self.detector.detect(frame[y0:y1, x0:x1])
+                if ball is not None:
+                    ball = (ball[0] + x0, ball[1] + y0, ball[2])
+            if ball is not None:
+                self.predictor.correct(ball[0], ball[1], dt)
+                self.radius = ball[2]
+                self.misses = 0
+                self.last_time = now
+                return ball
+            self.misses += 1
+            if self.misses < self.max_misses:
+                return None
+            self.state = SEARCH
+            self.misses = 0
+        self.roi = None
+        self.searches += 1
+        self.pixels += height * width
+        ball = self.detector.detect(frame)
+        if ball is not None:
+            self.state = TRACK
+            self.predictor.reset(ball[0], ball[1])
+            self.radius = ball[2]
+            self.misses = 0
+            self.last_time = now
+        return ball
+
+    def reset(self):
+        self.state = SEARCH
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'frames': self.frames,
+            'searches': self.searches,
+            'scanned': self.pixels / max(self.frame_pixels, 1),     # Fraction of the pixels run through the detector
+        }
+
+def benchmark(frames=300, sizes=((160, 120), (320, 240), (640, 480)), fps=30.0):
+    '''Detector time per frame with a whole frame search every frame vs
+    tracking, on a synthetic ball that moves, speeds up and hides for a while.
+    A detection counts as a hit only within MATCH_RADII ball radii of the
+    true centre; one further away is both false and a miss.'''
+    from detector import BallDetector, HOUGH, CONTOUR, synthetic_frame
+    rng = np.random.default_rng(2)
+    for width, height in sizes:
+        truth = []
+        images = []
+        for i in range(frames):
+            t = i / fps
+            r = height / 10
+            x = width / 2 + width / 3 * np.sin(1.5 * t + 0.3 * t * t)
+            y = height / 2 + height / 4 * np.cos(2.0 * t)
+            hidden = 150 <= i < 160
+            truth.append(None if hidden else (x, y, r))
+            images.append(synthetic_frame(width, height, x, y, 0 if hidden else r, rng))
+        for method in (HOUGH, CONTOUR):
+            runs = [('full', None)] + [(predictor, predictor) for predictor in PREDICTORS]
+            for name, predictor in runs:
+                detector = BallDetector(method)
+                tracker = BallTracker(detector, predictor) if predictor else None
+                hits = misses = false = 0
+                error = 0.0
+                start = time.perf_counter()
+                for i, (expected, image) in enumerate(zip(truth, images)):
+                    ball = tracker.update(image, i / fps) if tracker else detector.detect(image)
+                    if ball is None:
+                        misses += expected is not None
+                    elif expected is None:
+                        false += 1
+                    else:
+                        distance = np.hypot(ball[0] - expected[0], ball[1] - expected[1])
+                        if distance <= max(4, MATCH_RADII * expected[2]):
+                            hits += 1
+                            error += distance
+                        else:
+                            false += 1
+                            misses += 1
+                elapsed = time.perf_counter() - start
+                extra = ''
+                if tracker:
+                    stats = tracker.stats()
+                    extra = '  searches %3d  scanned %3.0f%%' % (stats['searches'], stats['scanned'] * 100)
+                print('%dx%d %-7s %-8s %6.2f ms/frame  hits %3d  missed %2d  false %d  error %4.1f px%s' % (
+                    width, height, method, name, elapsed * 1000 / frames, hits, misses, false,
+                    error / max(hits, 1), extra))
+
+if __name__ == '__main__':
+    benchmark()
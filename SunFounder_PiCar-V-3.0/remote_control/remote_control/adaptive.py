@@ -0,0 +1,201 @@
+'''
+**********************************************************************
+* Filename    : adaptive.py
+* Description : Per viewer MJPEG quality, scale and frame rate, adapted
+*               to how fast the viewer's connection drains
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+After every frame the stream looks at how long the send took, how many
+bytes still sit unsent in the kernel's socket buffer and, on Linux, the
+TCP round trip time. A congested viewer steps down, one step per
+COOLDOWN: JPEG quality first, then the picture size, then the frame
+rate. After GOOD_FRAMES clean frames in a row it steps back up in the
+reverse order. The steps are coarse on purpose, so viewers in the same
+state share the Broadcaster's encodes.
+'''
+
+import collections
+import fcntl
+import socket
+import struct
+import termios
+import time
+
+QUALITY = (35, 85)          # JPEG quality bounds, in steps of QUALITY_STEP down from the top
+QUALITY_STEP = 10
+SCALES = (1.0, 0.75, 0.5, 0.25)     # Downscale ladder
+MIN_SCALE = 0.5
+FPS = (5, 30)               # Frame rate bounds
+
+RTT_HIGH = 0.25             # Seconds of round trip that count as congestion
+RTT_LOW = 0.08
+COOLDOWN = 0.5              # Seconds between two steps down
+GOOD_FRAMES = 30            # Clean frames in a row before a step up
+BITRATE_WINDOW = 2.0        # Seconds the bitrate is averaged over
+
+_TCP_INFO_RTT = 68          # Offset of tcpi_rtt (microseconds) in struct tcp_info
+
+def send_queue(sock):
+    '''Bytes written to sock the peer has not taken yet, or None'''
+    if sock is None:
+        return None
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def tcp_rtt(sock):
+    '''Smoothed TCP round trip time of sock in seconds, or None'''
+    if sock is None or not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from('I', info, _TCP_INFO_RTT)[0] / 1e6
+    except (OSError, struct.error):
+        return None
+
+class AdaptiveStream(object):
+    '''The encoding parameters of one viewer. Call wait() before taking a
+    frame, params() for its (quality, scale) and sent() once it went out.'''
+
+    def __init__(self, sock=None, name='', quality=QUALITY, min_scale=MIN_SCALE, fps=FPS, clock=time.monotonic):
+        self.sock = sock
+        self.name = name
+        self.clock = clock
+        self.qualities = list(range(quality[1], quality[0] - 1, -QUALITY_STEP))
+        self.scales = [scale for scale in SCALES if scale >= min_scale]
+        self.fps_min, self.fps_max = fps
+        self.quality_index = 0
+        self.scale_index = 0
+        self.fps = float(self.fps_max)
+        self.frames = 0
+        self.skipped = 0            # Newer frames were there before this viewer took one
+        self.congested = 0
+        self.good = 0
+        self.send_time = 0.0
+        self.queued = None
+        self.rtt = None
+        self.started = clock()
+        self._last_frame = None
+        self._last_down = None
+        self._sent = collections.deque()    # (time, bytes)
+        self._sent_bytes = 0
+
+    @property
+    def quality(self):
+        return self.qualities[self.quality_index]
+
+    @property
+    def scale(self):
+        return self.scales[self.scale_index]
+
+    def params(self):
+        return self.quality, self.scale
+
+    def wait(self):
+        '''Seconds to hold off so the viewer stays at its frame rate'''
+        if self._last_frame is None:
+            return 0.0
+        return max(0.0, self._last_frame + 1.0 / self.fps - self.clock())
+
+    def sent(self, nbytes, send_time, skipped=0):
+        '''A frame of nbytes went out in send_time seconds; adapt to it'''
+        now = self.clock()
+        self._last_frame = now
+        self.frames += 1
+        self.skipped += skipped
+        self.send_time = send_time
+        self._sent.append((now, nbytes))
+        self._sent_bytes += nbytes
+        while self._sent and self._sent[0][0] < now - BITRATE_WINDOW:
+            self._sent_bytes -= self._sent.popleft()[1]
+        self.queued = send_queue(self.sock)
+        self.rtt = tcp_rtt(self.sock)
+
+        budget = 1.0 / self.fps
+        congested = (send_time > budget / 2
+                     or (self.queued is not None and self.queued > 2 * nbytes)
+                     or (self.rtt is not None and self.rtt > RTT_HIGH))
+        clean = (send_time < budget / 5
+                 and (self.queued is None or self.queued < nbytes / 2)
+                 and (self.rtt is None or self.rtt < RTT_LOW))
+        if congested:
+            self.good = 0
+            if self._last_down is None or now - self._last_down >= COOLDOWN:
+                self._last_down = now
+                if self._step_down():
+                    self.congested += 1
+        elif clean:
+            self.good += 1
+            if self.good >= GOOD_FRAMES:
+                self.good = 0
+                self._step_up()
+        else:
+            self.good = 0
+
+    def _step_down(self):
+        if self.quality_index < len(self.qualities) - 1:
+            self.quality_index += 1
+        elif self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+        elif self.fps > self.fps_min:
+            self.fps = max(self.fps_min, self.fps / 2)
+        else:
+            return False
+        return True
+
+    def _step_up(self):
+        if self.fps < self.fps_max:
+            self.fps = min(self.fps_max, self.fps * 2)
+        elif self.scale_index > 0:
+            self.scale_index -= 1
+        elif self.quality_index > 0:
+            self.quality_index -= 1
+        else:
+            return False
+        return True
+
+    def bitrate(self):
+        '''Bits per second sent over the last BITRATE_WINDOW'''
+        if not self._sent:
+            return 0.0
+        span = min(BITRATE_WINDOW, max(self.clock() - self.started, 1e-3))
+        return self._sent_bytes * 8 / span
+
+    def stats(self):
+        return {
+            'client': self.name,
+            'quality': self.quality,
+            'scale': self.scale,
+            'fps': self.fps,
+            'bitrate': round(self.bitrate()),
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'congested': self.congested,
+            'send_ms': round(self.send_time * 1000, 1),
+            'queued': self.queued,
+            'rtt_ms': None if self.rtt is None else round(self.rtt * 1000, 1),
+        }
+
+def test():
+    '''A viewer whose link drops from fast to slow and back'''
+    now = [0.0]
+    stream = AdaptiveStream(clock=lambda: now[0])
+    for phase, bytes_per_second, seconds in (('fast', 20e6, 2), ('slow', 150e3, 6), ('fast', 20e6, 8)):
+        end = now[0] + seconds
+        while now[0] < end:
+            now[0] += stream.wait()
+            quality, scale = stream.params()
+            size = int(25000 * scale * scale * quality / 85)      # Rough JPEG size at 320x240
+            send_time = size / bytes_per_second
+            now[0] += send_time
+            stream.sent(size, send_time)
+        print('%-4s link: quality %d, scale %.2f, %4.1f fps, %6.0f kbit/s' % (
+            phase, stream.quality, stream.scale, stream.fps, stream.bitrate() / 1000))
+
+if __name__ == '__main__':
+    test()
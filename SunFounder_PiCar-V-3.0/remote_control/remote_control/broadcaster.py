@@ -0,0 +1,265 @@
+'''
+**********************************************************************
+* Filename    : broadcaster.py
+* Description : Encode each camera frame to JPEG once and hand the
+*               bytes to every MJPEG viewer
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+One thread follows the FrameRing and encodes each new frame while at
+least one viewer is subscribed. Viewers wait on a condition for a
+sequence number past the one they sent last and always get the newest
+JPEG, so a slow viewer skips frames instead of queueing them.
+
+A viewer with an AdaptiveStream (adaptive.py) asks for its own quality
+and scale; each such variant is encoded once per frame as well, on first
+request, and shared by every viewer that asks for the same one.
+'''
+
+import threading
+import time
+import cv2
+
+class Broadcaster(object):
+    '''Latest JPEG of a FrameRing, shared by all subscribers'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "broadcaster.py":'
+
+    def __init__(self, ring, quality=None):
+        self.ring = ring
+        self.quality = quality
+        self.seq = 0                # Ring sequence number of self.jpeg
+        self.jpeg = None
+        self.frame = None           # Copy of frame seq, for the variants
+        self.variants = {}          # (quality, scale) -> JPEG of frame seq
+        self.timestamp = 0.0        # Capture time of the frame in self.jpeg
+        self.subscribers = 0
+        self.streams = set()        # AdaptiveStreams of the viewers that have one
+        self.listeners = []         # Called from the encoder thread after each new frame
+        self.encodes = 0
+        self.torn = 0               # Encodes thrown away, the slot was overwritten
+        self._cond = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        last = 0
+        while self._running:
+            with self._cond:
+                # Nobody watching, nothing to encode
+                self._cond.wait_for(lambda: self.subscribers or not self._running)
+            seq = self.ring.wait(last, timeout=0.5)
+            if seq is None:
+                continue
+            claimed = self.ring.claim(seq)
+            if claimed is None:
+                continue
+            _, timestamp, view = claimed
+            frame = view.copy()
+            if not self.ring.valid(seq):
+                self.torn += 1
+                continue
+            last = seq
+            jpeg = _encode(frame, self.quality, 1.0)
+            if jpeg is None:
+                continue
+            self.encodes += 1
+            with self._cond:
+                self.seq = seq
+                self.jpeg = jpeg
+                self.frame = frame
+                self.variants = {(self.quality, 1.0): jpeg}
+                self.timestamp = timestamp
+                self._cond.notify_all()
+            for listener in list(self.listeners):
+                listener()
+
+    def next(self, after, timeout=1.0):
+        '''(seq, jpeg) of the newest frame past `after`, or None on timeout or stop'''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after or not self._running, timeout):
+                return None
+            if self.seq <= after:
+                return None
+            return self.seq, self.jpeg
+
+    def variant(self, quality, scale):
+        '''(seq, jpeg) of the current frame at another quality and scale'''
+        with self._cond:
+            seq, frame, variants = self.seq, self.frame, self.variants
+        key = (quality, scale)
+        jpeg = variants.get(key)
+        if jpeg is None and frame is not None:
+            with self._encode_lock:         # Viewers asking for the same variant wait for one encode
+                jpeg = variants.get(key)
+                if jpeg is None:
+                    jpeg = variants[key] = _encode(frame, quality, scale)
+                    self.encodes += 1
+        return seq, jpeg
+
+    def subscribe(self, stream=None):
+        '''Count a viewer in; frames are only encoded while there is one'''
+        with self._cond:
+            self.subscribers += 1
+            if stream is not None:
+                self.streams.add(stream)
+            self._cond.notify_all()
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Subscribed, %d viewers' % self.subscribers)
+
+    def unsubscribe(self, stream=None):
+        with self._cond:
+            self.subscribers -= 1
+            self.streams.discard(stream)
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Unsubscribed, %d viewers' % self.subscribers)
+
+    def frames(self, stream=None):
+        '''Generator of JPEG bytes for one viewer, skipping what it was too
+        slow for. With an AdaptiveStream, the viewer gets its own quality,
+        scale and frame rate, adapted to how its sends go.'''
+        viewer = Viewer(self, stream)
+        self.subscribe(stream)
+        try:
+            while self._running:
+                delay = viewer.delay()
+                if delay:
+                    time.sleep(delay)
+                if self.next(viewer.last) is None:
+                    continue
+                jpeg = viewer.take()
+                if jpeg is None:
+                    continue
+                start = time.monotonic()
+                yield jpeg
+                # The server wrote the chunk before asking for the next one
+                viewer.sent(len(jpeg), time.monotonic() - start)
+        finally:
+            self.unsubscribe(stream)
+
+    def stats(self):
+        with self._cond:
+            streams = list(self.streams)
+            stats = {
+                'seq': self.seq,
+                'subscribers': self.subscribers,
+                'encodes': self.encodes,
+                'torn': self.torn,
+            }
+        stats['clients'] = [stream.stats() for stream in streams]
+        return stats
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+class Viewer(object):
+    '''Per frame bookkeeping of one viewer of a Broadcaster, shared by
+    frames() and video_server.py: the last frame it got, the frames it
+    skipped and, with an AdaptiveStream, its own variant and rate'''
+
+    def __init__(self, broadcaster, stream=None):
+        self.broadcaster = broadcaster
+        self.stream = stream
+        self.last = 0               # Sequence number of the last frame taken
+        self.skipped = 0            # Frames skipped before it
+
+    def delay(self):
+        '''Seconds to wait before the next frame, to keep the stream's rate'''
+        return self.stream.wait() if self.stream is not None else 0.0
+
+    def take(self):
+        '''JPEG of the newest frame for this viewer, or None. May encode a
+        variant, so an event loop should run it in an executor.'''
+        if self.stream is None:
+            with self.broadcaster._cond:
+                seq, jpeg = self.broadcaster.seq, self.broadcaster.jpeg
+        else:
+            seq, jpeg = self.broadcaster.variant(*self.stream.params())
+        if jpeg is None or seq <= self.last:
+            return None
+        self.skipped = seq - self.last - 1 if self.last else 0
+        self.last = seq
+        return jpeg
+
+    def sent(self, nbytes, send_time):
+        '''The JPEG from take() went out in send_time seconds'''
+        if self.stream is not None:
+            self.stream.sent(nbytes, send_time, self.skipped)
+
+def _encode(frame, quality, scale):
+    '''JPEG bytes of frame, scaled down by scale, or None'''
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    params = [] if quality is None else [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    ok, jpeg = cv2.imencode('.jpg', frame, params)
+    return jpeg.tobytes() if ok else None
+
+def test(viewers=3, fps=30, duration=2.0):
+    '''Viewers of different speeds on a synthetic camera: one encode per
+    frame however many watch, and the slow viewer skips frames'''
+    import numpy as np
+    try:
+        from .frame_ring import FrameRing
+    except ImportError:
+        from frame_ring import FrameRing
+    ring = FrameRing.create((240, 320, 3))
+    broadcaster = Broadcaster(ring)
+    broadcaster.start()
+    received = [0] * viewers
+
+    def viewer(i):
+        delay = 0.2 if i == viewers - 1 else 0      # The last one is slow
+        for jpeg in broadcaster.frames():
+            received[i] += 1
+            time.sleep(delay)
+            if time.monotonic() > end:
+                break
+
+    end = time.monotonic() + duration
+    threads = [threading.Thread(target=viewer, args=(i,)) for i in range(viewers)]
+    for thread in threads:
+        thread.start()
+    frame = np.zeros((240, 320, 3), np.uint8)
+    written = 0
+    while time.monotonic() < end:
+        frame[:] = written % 256
+        ring.write(frame)
+        written += 1
+        time.sleep(1.0 / fps)
+    broadcaster.stop()              # Ends the viewers' frames()
+    for thread in threads:
+        thread.join()
+    ring.close()
+    print('written %d, encoded %d, torn %d, received %s' % (written, broadcaster.encodes, broadcaster.torn, received))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,241 @@
+'''
+**********************************************************************
+* Filename    : capture.py
+* Description : Camera capture loop: timestamps, failure recovery and
+*               frame rate, latency and drop counters
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Capture reads the camera as fast as it delivers and writes every good
+frame into a FrameRing, which numbers it and keeps only the newest few.
+A failed read (False or None from the camera) is never passed on: the
+loop backs off, doubling from BACKOFF_MIN up to BACKOFF_MAX, and after
+every REOPEN_AFTER failures in a row it reopens the camera and starts
+the back off over.
+
+Counted along the way:
+  dropped     frames the camera skipped, from gaps in the read times
+              longer than 1.5 frame periods
+  duplicates  reads that came back at once with the same picture as the
+              last one, i.e. a stale buffer
+  latency     how long each read() blocked, as percentiles
+'''
+
+import collections
+import threading
+import time
+import cv2
+
+BACKOFF_MIN = 0.05          # Seconds after the first failed read
+BACKOFF_MAX = 2.0
+REOPEN_AFTER = 5            # Failed reads in a row before the camera is reopened
+STATS_INTERVAL = 1.0        # Seconds between two on_stats() calls
+SAMPLES = 300               # Read times kept for the percentiles
+DUPLICATE_READ = 0.002      # A read faster than this may be a stale buffer
+
+class Capture(object):
+    '''Reads `source` (a cv2.VideoCapture index or path, or any object
+    with read() and release()) into `ring` until stop()'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "capture.py":'
+
+    def __init__(self, source, ring, width=320, height=240, on_stats=None, clock=time.monotonic):
+        self.source = source
+        self.ring = ring
+        self.width = width
+        self.height = height
+        self.on_stats = on_stats
+        self.clock = clock
+        self.camera = None
+        self.period = None          # Seconds between frames, from the camera or measured
+        self.frames = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.failures = 0           # Failed reads in total
+        self.reopens = 0
+        self._failed = 0            # Failed reads in a row
+        self._latency = collections.deque(maxlen=SAMPLES)
+        self._intervals = collections.deque(maxlen=SAMPLES)
+        self._times = collections.deque()   # Frame times over the last STATS_INTERVAL
+        self._last_time = None
+        self._last_sample = None
+        self._stop = threading.Event()
+
+    def open(self):
+        if self.camera is not None:
+            self.camera.release()
+        if hasattr(self.source, 'read'):
+            self.camera = self.source
+        else:
+            self.camera = cv2.VideoCapture(self.source)
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            fps = self.camera.get(cv2.CAP_PROP_FPS)
+            if fps and 1 <= fps <= 240:
+                self.period = 1.0 / fps
+        self._last_time = None
+        self._last_sample = None
+
+    def read(self):
+        '''One read: returns the frame's sequence number in the ring, or None'''
+        start = self.clock()
+        try:
+            ok, frame = self.camera.read()
+        except cv2.error:
+            ok, frame = False, None
+        now = self.clock()
+        if not ok or frame is None:
+            self._fail()
+            return None
+        self._failed = 0
+        self._latency.append(now - start)
+        sample = frame[::16, ::16].copy()
+        if (now - start < DUPLICATE_READ and self._last_sample is not None
+                and sample.shape == self._last_sample.shape and (sample == self._last_sample).all()):
+            self.duplicates += 1
+            return None
+        self._last_sample = sample
+        if self._last_time is not None:
+            interval = now - self._last_time
+            self._intervals.append(interval)
+            period = self.period or self._median_interval()
+            if period and interval > 1.5 * period:
+                self.dropped += int(round(interval / period)) - 1
+        self._last_time = now
+        self.frames += 1
+        self._times.append(now)
+        return self.ring.write(frame, now)
+
+    def _fail(self):
+        self.failures += 1
+        self._failed += 1
+        self._last_time = None      # A gap after a failure is not a drop
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Read failed, %d in a row' % self._failed)
+        if self._failed % REOPEN_AFTER == 0:
+            self.reopens += 1
+            if self._DEBUG:
+                print(self._DEBUG_INFO, 'Reopening the camera')
+            try:
+                self.open()
+            except cv2.error:
+                pass
+        self._stop.wait(min(BACKOFF_MAX, BACKOFF_MIN * 2 ** ((self._failed - 1) % REOPEN_AFTER)))
+
+    def _median_interval(self):
+        if len(self._intervals) < 10:
+            return None
+        return sorted(self._intervals)[len(self._intervals) // 2]
+
+    def run(self):
+        '''Capture until stop(), calling on_stats(stats()) every STATS_INTERVAL'''
+        self._stop.clear()
+        if self.camera is None:
+            self.open()
+        next_stats = self.clock() + STATS_INTERVAL
+        while not self._stop.is_set():
+            self.read()
+            now = self.clock()
+            if self.on_stats is not None and now >= next_stats:
+                next_stats = max(next_stats + STATS_INTERVAL, now)
+                self.on_stats(self.stats())
+        if self.camera is not None and self.camera is not self.source:
+            self.camera.release()
+
+    def stop(self):
+        self._stop.set()
+
+    def fps(self):
+        '''Frames per second over the last STATS_INTERVAL'''
+        now = self.clock()
+        while self._times and self._times[0] < now - STATS_INTERVAL:
+            self._times.popleft()
+        return len(self._times) / STATS_INTERVAL
+
+    def stats(self):
+        latency = sorted(self._latency)
+        n = len(latency)
+
+        def percentile(p):
+            return round(latency[min(n - 1, int(n * p))] * 1000, 2) if n else None
+
+        return {
+            'seq': self.ring.latest_seq,
+            'fps': self.fps(),
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'duplicates': self.duplicates,
+            'failures': self.failures,
+            'reopens': self.reopens,
+            'read_ms_p50': percentile(0.5),
+            'read_ms_p95': percentile(0.95),
+            'read_ms_p99': percentile(0.99),
+            'read_ms_max': round(latency[-1] * 1000, 2) if n else None,
+        }
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+class FlakyCamera(object):
+    '''Synthetic 30 fps camera that skips frames, hands out stale buffers
+    and fails for a while, for test()'''
+
+    def __init__(self, fps=30, skip_every=20, stale_every=25, fail_at=60, fail_for=8):
+        import numpy as np
+        self.frame = np.zeros((240, 320, 3), np.uint8)
+        self.period = 1.0 / fps
+        self.skip_every = skip_every
+        self.stale_every = stale_every
+        self.fail_at = fail_at
+        self.fail_for = fail_for
+        self.n = 0
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        if self.fail_at <= self.reads < self.fail_at + self.fail_for:
+            return False, None
+        if self.reads % self.stale_every == 0:
+            return True, self.frame.copy()          # At once, the same picture
+        self.n += 1
+        if self.n % self.skip_every == 0:
+            self.n += 1
+            time.sleep(self.period)                 # One frame the camera missed
+        time.sleep(self.period)
+        self.frame[:] = self.n % 256
+        return True, self.frame.copy()
+
+    def release(self):
+        pass
+
+def test(duration=6.0):
+    '''Capture a flaky synthetic camera and print the counters each second'''
+    try:
+        from .frame_ring import FrameRing
+    except ImportError:
+        from frame_ring import FrameRing
+    ring = FrameRing.create((240, 320, 3))
+    capture = Capture(FlakyCamera(), ring, on_stats=print)
+    thread = threading.Thread(target=capture.run)
+    thread.start()
+    time.sleep(duration)
+    capture.stop()
+    thread.join()
+    print(capture.stats())
+    ring.close()
+
+if __name__ == '__main__':
+    test()
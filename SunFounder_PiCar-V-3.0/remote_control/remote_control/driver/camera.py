@@ -13,7 +13,25 @@
 
 from picar.SunFounder_PCA9685 import Servo
 import time
+import threading
+from concurrent.futures import Future
 from picar import filedb
+try:
+	from .servo_lut import ServoLUT
+except ImportError:			# Run as a script
+	from servo_lut import ServoLUT
+
+class Trajectory(Future):
+	'''Future of one Camera.to_position() move. progress runs from 0.0 to 1.0
+	while it moves; the result is the (pan, tilt) reached. It is cancelled
+	when a newer move or step takes over the servos.'''
+	def __init__(self, start, target, duration):
+		Future.__init__(self)
+		self.start = start
+		self.target = target
+		self.duration = duration
+		self.progress = 0.0
+		self.started = None
 
 class Camera(object):
 	'''Camera movement control class'''
@@ -26,6 +44,7 @@ class Camera(object):
 	CALI_TILT = 90			# Calibration position angle
 
 	CAMERA_DELAY = 0.005
+	TRAJECTORY_TICK = 0.02		# Seconds between servo updates of a to_position() move
 	PAN_STEP = 15				# Pan step = 5 degree
 	TILT_STEP = 10			# Tilt step = 5 degree
 
@@ -40,6 +59,8 @@ class Camera(object):
 
 		self.pan_servo = Servo.Servo(self.pan_channel, bus_number=bus_number, offset=self.pan_offset)
 		self.tilt_servo = Servo.Servo(self.tilt_channel, bus_number=bus_number, offset=self.tilt_offset)
+		self.pan_lut = ServoLUT(self.pan_servo)		# Writes go through these; set offsets on them, not on the servos
+		self.tilt_lut = ServoLUT(self.tilt_servo)
 		self.debug = debug
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Pan servo channel:', self.pan_channel)
@@ -49,6 +70,9 @@ class Camera(object):
 
 		self.current_pan = 0
 		self.current_tilt = 0
+		self._lock = threading.Condition()
+		self._trajectory = None
+		self._thread = None
 		self.ready()
 
 	def safe_plus(self, variable, plus_value):
@@ -64,104 +88,157 @@ class Camera(object):
 		''' Control the pan servo to make the camera turning left '''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn left at step:', step)
-		self.current_pan = self.safe_plus(self.current_pan, step)
-		self.pan_servo.write(self.current_pan)
+		with self._lock:
+			self._cancel()
+			self.current_pan = self.safe_plus(self.current_pan, step)
+			self.pan_lut.write(self.current_pan)
 
 	def turn_right(self, step=PAN_STEP):
 		''' Control the pan servo to make the camera turning right '''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn right at step:', step)
-		self.current_pan = self.safe_plus(self.current_pan, -step)
-		self.pan_servo.write(self.current_pan)
+		with self._lock:
+			self._cancel()
+			self.current_pan = self.safe_plus(self.current_pan, -step)
+			self.pan_lut.write(self.current_pan)
 
 	def turn_up(self, step=TILT_STEP):
 		''' Control the tilt servo to make the camera turning up '''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn up at step:', step)
-		self.current_tilt = self.safe_plus(self.current_tilt, step)
-		self.tilt_servo.write(self.current_tilt)
+		with self._lock:
+			self._cancel()
+			self.current_tilt = self.safe_plus(self.current_tilt, step)
+			self.tilt_lut.write(self.current_tilt)
 
 	def turn_down(self, step=TILT_STEP):
 		'''Control the tilt servo to make the camera turning down'''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn down at step:', step)
-		self.current_tilt = self.safe_plus(self.current_tilt, -step)
-		self.tilt_servo.write(self.current_tilt)
+		with self._lock:
+			self._cancel()
+			self.current_tilt = self.safe_plus(self.current_tilt, -step)
+			self.tilt_lut.write(self.current_tilt)
 
 	def to_position(self, expect_pan, expect_tilt, delay=CAMERA_DELAY):
-		'''Control two servo to write the camera to ready position'''
-		pan_diff = self.current_pan - expect_pan
-		tilt_diff = self.current_tilt - expect_tilt
+		'''Move both servos to (pan, tilt) together, taking delay seconds per
+		degree of the longer axis, without waiting for it. Returns a Trajectory
+		future; a move still in flight is cancelled and the new one starts
+		from wherever the camera got to.'''
+		expect_pan = self.safe_plus(expect_pan, 0)
+		expect_tilt = self.safe_plus(expect_tilt, 0)
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn to posision [%s, %s] (pan, tilt)' % (expect_pan, expect_tilt))
-		while True:
-			if pan_diff != 0 or tilt_diff != 0:
-				pan_diff = self.current_pan - expect_pan
-				tilt_diff = self.current_tilt - expect_tilt
-				if abs(pan_diff) > 1:
-					if pan_diff < 0:
-						self.current_pan = self.safe_plus(self.current_pan, 1)
-					elif pan_diff > 0:
-						self.current_pan = self.safe_plus(self.current_pan, -1)
-				else:
+		with self._lock:
+			self._cancel()
+			start = (self.current_pan, self.current_tilt)
+			distance = max(abs(expect_pan - start[0]), abs(expect_tilt - start[1]))
+			trajectory = Trajectory(start, (expect_pan, expect_tilt), distance * delay)
+			if trajectory.duration <= 0:		# Nowhere to go, or no time to take: jump
+				if expect_pan != self.current_pan:
 					self.current_pan = expect_pan
-				if abs(tilt_diff) > 1:
-					if tilt_diff < 0:
-						self.current_tilt = self.safe_plus(self.current_tilt, 1)
-					elif tilt_diff > 0:
-						self.current_tilt = self.safe_plus(self.current_tilt, -1)
-				else:
+					self.pan_lut.write(expect_pan)
+				if expect_tilt != self.current_tilt:
 					self.current_tilt = expect_tilt
+					self.tilt_lut.write(expect_tilt)
+				trajectory.progress = 1.0
+				trajectory.set_result(trajectory.target)
+				return trajectory
+			self._trajectory = trajectory
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name='camera trajectory')
+				self._thread.daemon = True
+				self._thread.start()
+			self._lock.notify()
+		return trajectory
+
+	def stop(self):
+		''' Stop a to_position() move where it is '''
+		with self._lock:
+			self._cancel()
 
-				self.pan_servo.write(self.current_pan)
-				self.tilt_servo.write(self.current_tilt)
-				time.sleep(delay)
-			else:
-				break
+	def _cancel(self):
+		if self._trajectory is not None:
+			self._trajectory.cancel()
+			self._trajectory = None
+
+	def _run(self):
+		while True:
+			with self._lock:
+				while self._trajectory is None:
+					self._lock.wait()
+				trajectory = self._trajectory
+				try:
+					now = time.monotonic()
+					if trajectory.started is None:
+						trajectory.started = now
+					progress = 1.0
+					if trajectory.duration > 0:
+						progress = min(1.0, (now - trajectory.started) / trajectory.duration)
+					(start_pan, start_tilt), (expect_pan, expect_tilt) = trajectory.start, trajectory.target
+					pan = int(round(start_pan + (expect_pan - start_pan) * progress))
+					tilt = int(round(start_tilt + (expect_tilt - start_tilt) * progress))
+					if pan != self.current_pan:		# Only write the servos that move this tick
+						self.current_pan = pan
+						self.pan_lut.write(pan)
+					if tilt != self.current_tilt:
+						self.current_tilt = tilt
+						self.tilt_lut.write(tilt)
+					trajectory.progress = progress
+					if progress >= 1.0:
+						self._trajectory = None
+						trajectory.set_result(trajectory.target)
+				except BaseException as e:		# Fail this move, keep the thread for the next one
+					self._trajectory = None
+					if not trajectory.done():
+						trajectory.set_exception(e)
+			time.sleep(self.TRAJECTORY_TICK)
 
 	def ready(self):
 		''' Set the camera to ready position '''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn to "Ready" position')
-		self.pan_servo.offset = self.pan_offset
-		self.tilt_servo.offset = self.tilt_offset
+		self.stop()
+		self.pan_lut.offset = self.pan_offset
+		self.tilt_lut.offset = self.tilt_offset
 		self.current_pan = self.READY_PAN
 		self.current_tilt = self.READY_TILT
-		self.pan_servo.write(self.current_pan)
-		self.tilt_servo.write(self.current_tilt)
+		self.pan_lut.write(self.current_pan)
+		self.tilt_lut.write(self.current_tilt)
 
 	def calibration(self):
 		''' Control two servo to write the camera to calibration position '''
 		if self._DEBUG:
 			print(self._DEBUG_INFO, 'Turn to "Calibration" position')
-		self.pan_servo.write(self.CALI_PAN)
-		self.tilt_servo.write(self.CALI_TILT)
+		self.stop()
+		self.pan_lut.write(self.CALI_PAN)
+		self.tilt_lut.write(self.CALI_TILT)
 		self.cali_pan_offset = self.pan_offset
 		self.cali_tilt_offset = self.tilt_offset
 
 	def cali_up(self):
 		''' Calibrate the camera to up '''
 		self.cali_tilt_offset += 1
-		self.tilt_servo.offset = self.cali_tilt_offset
-		self.tilt_servo.write(self.CALI_TILT)
+		self.tilt_lut.offset = self.cali_tilt_offset
+		self.tilt_lut.write(self.CALI_TILT)
 
 	def cali_down(self):
 		''' Calibrate the camera to down '''
 		self.cali_tilt_offset -= 1
-		self.tilt_servo.offset = self.cali_tilt_offset
-		self.tilt_servo.write(self.CALI_TILT)
+		self.tilt_lut.offset = self.cali_tilt_offset
+		self.tilt_lut.write(self.CALI_TILT)
 
 	def cali_left(self):
 		''' Calibrate the camera to left '''
 		self.cali_pan_offset += 1
-		self.pan_servo.offset = self.cali_pan_offset
-		self.pan_servo.write(self.CALI_PAN)
+		self.pan_lut.offset = self.cali_pan_offset
+		self.pan_lut.write(self.CALI_PAN)
 
 	def cali_right(self):
 		''' Calibrate the camera to right '''
 		self.cali_pan_offset -= 1
-		self.pan_servo.offset = self.cali_pan_offset
-		self.pan_servo.write(self.CALI_PAN)
+		self.pan_lut.offset = self.cali_pan_offset
+		self.pan_lut.write(self.CALI_PAN)
 
 	def cali_ok(self):
 		''' Save the calibration value '''
@@ -217,9 +294,9 @@ if __name__ == '__main__':
 		camera.ready()
 
 		print("Camera move to position (0, 0)")
-		camera.to_posision(0, 0)
+		camera.to_position(0, 0).result()
 		print("Camera move to position (180, 180)")
-		camera.to_posision(180, 180)
+		camera.to_position(180, 180).result()
 
 		print("Camera move to ready position")
 		camera.ready()
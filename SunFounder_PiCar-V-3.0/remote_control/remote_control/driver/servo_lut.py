@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : servo_lut.py
+* Description : Precomputed angle -> PCA9685 OFF count table for a
+*               picar Servo, with offset and limits baked in
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+**********************************************************************
+'''
+
+class ServoLUT(object):
+	'''Writes angles to a picar Servo through a table of the 181 OFF counts
+	Servo.write() would compute, clamped to [angle_min, angle_max]. The
+	table is built once; set the offset through `offset` (calibration), or
+	call rebuild() after changing the servo's frequency, so a lookup is
+	only an index.'''
+
+	def __init__(self, servo, angle_min=0, angle_max=180):
+		self.servo = servo
+		self.angle_min = angle_min
+		self.angle_max = angle_max
+		self.table = []
+		self.builds = 0
+		self._key = None
+		self.rebuild()
+
+	def _calibration(self):
+		return (self.servo.offset, getattr(self.servo, 'frequency', None), self.angle_min, self.angle_max)
+
+	def rebuild(self):
+		key = self._calibration()
+		if key == self._key:
+			return False
+		self._key = key
+		offset = self.servo.offset
+		self.table = [self.servo._angle_to_analog(min(max(angle, self.angle_min), self.angle_max)) + offset
+				for angle in range(181)]
+		self.builds += 1
+		return True
+
+	@property
+	def offset(self):
+		return self.servo.offset
+
+	@offset.setter
+	def offset(self, offset):
+		'''Set the servo's offset and rebuild the table for it'''
+		self.servo.offset = offset
+		self.rebuild()
+
+	def __getitem__(self, angle):
+		if 0 <= angle <= 180:
+			try:
+				return self.table[angle]
+			except TypeError:		# A float angle
+				return self.table[int(angle)]
+		return self.table[0 if angle < 0 else 180]
+
+	def write(self, angle):
+		''' Same as Servo.write(angle) '''
+		self.servo.pwm.write(self.servo.channel, 0, self[angle])
@@ -0,0 +1,242 @@
+'''
+**********************************************************************
+* Filename    : frame_ring.py
+* Description : Ring of camera frames in shared memory, for handing
+*               frames between processes without pickling them
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+One writer, any number of readers. Each slot has a sequence word that
+is odd while the writer fills the slot and 2*seq once frame `seq` is in
+it (a seqlock). A reader takes a NumPy view of the newest slot and,
+once done with it, checks the word did not move; if it did, the frame
+was overwritten under it and the result must be thrown away.
+'''
+
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+_MAGIC = 0x46524E47         # 'FRNG'
+_META = 8                   # uint32 words: magic, slots, height, width, channels
+_ALIGN = 64
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+class FrameRing(object):
+    '''`slots` preallocated frames of one shape in a SharedMemory block.
+
+    Layout: meta (uint32 x 8) | latest seq (uint64) | slot seq (uint64 x slots)
+            | slot capture time (float64 x slots) | frames (uint8)
+    '''
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        meta = np.ndarray((_META,), np.uint32, shm.buf, 0)
+        if meta[0] != _MAGIC:
+            raise ValueError('%s is not a frame ring' % shm.name)
+        self.slots = int(meta[1])
+        self.shape = (int(meta[2]), int(meta[3]), int(meta[4]))
+        offset = meta.nbytes
+        self._latest = np.ndarray((1,), np.uint64, shm.buf, offset)
+        offset += 8
+        self._seq = np.ndarray((self.slots,), np.uint64, shm.buf, offset)
+        offset += 8 * self.slots
+        self._times = np.ndarray((self.slots,), np.float64, shm.buf, offset)
+        offset = _align(offset + 8 * self.slots)
+        self.frames = np.ndarray((self.slots,) + self.shape, np.uint8, shm.buf, offset)
+
+    @classmethod
+    def size(cls, shape, slots):
+        header = _align(4 * _META + 8 + 16 * slots)
+        return header + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, shape=(240, 320, 3), slots=4, name=None):
+        '''A new ring; the creating process unlinks it on close()'''
+        if len(shape) == 2:
+            shape = tuple(shape) + (1,)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(shape, slots))
+        meta = np.ndarray((_META,), np.uint32, shm.buf, 0)
+        meta[:] = 0
+        meta[1:5] = (slots,) + tuple(shape)
+        np.ndarray((1 + slots,), np.uint64, shm.buf, meta.nbytes)[:] = 0
+        meta[0] = _MAGIC
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        '''Open a ring another process created'''
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latest_seq(self):
+        '''Sequence number of the newest complete frame, 0 before the first'''
+        return int(self._latest[0])
+
+    def write(self, frame, timestamp=None):
+        '''Copy a frame into the next slot; returns its sequence number.
+        A frame of another size is resized into the slot.'''
+        seq = int(self._latest[0]) + 1
+        slot = seq % self.slots
+        self._seq[slot] = 2 * seq - 1                   # Odd: being written
+        target = self.frames[slot]
+        if frame.shape == self.shape:
+            np.copyto(target, frame)
+        elif frame.shape[:2] == self.shape[:2] and frame.size == target.size:
+            np.copyto(target, frame.reshape(self.shape))
+        else:
+            import cv2
+            target[...] = cv2.resize(frame, (self.shape[1], self.shape[0])).reshape(self.shape)
+        self._times[slot] = time.monotonic() if timestamp is None else timestamp
+        self._seq[slot] = 2 * seq                       # Even: frame seq is complete
+        self._latest[0] = seq
+        return seq
+
+    def claim(self, seq=None):
+        '''View of frame `seq` (default: the newest) without copying, as
+        (seq, timestamp, view), or None if it is not (or no longer) in the
+        ring. Call valid(seq) after using the view.'''
+        if seq is None:
+            seq = int(self._latest[0])
+        if seq == 0:
+            return None
+        slot = seq % self.slots
+        if int(self._seq[slot]) != 2 * seq:
+            return None
+        timestamp = float(self._times[slot])
+        view = self.frames[slot]
+        if int(self._seq[slot]) != 2 * seq:
+            return None
+        return seq, timestamp, view
+
+    def valid(self, seq):
+        '''True if frame seq was not overwritten since claim()'''
+        return int(self._seq[seq % self.slots]) == 2 * seq
+
+    def read(self, retries=3):
+        '''Copy of the newest frame as (seq, timestamp, frame), or None'''
+        for _ in range(retries):
+            claimed = self.claim()
+            if claimed is None:
+                return None
+            seq, timestamp, view = claimed
+            frame = view.copy()
+            if self.valid(seq):
+                return seq, timestamp, frame
+        return None
+
+    def wait(self, after, timeout=1.0, poll=0.002):
+        '''Newest sequence number once it is past `after`, or None on timeout'''
+        deadline = time.monotonic() + timeout
+        while True:
+            seq = int(self._latest[0])
+            if seq > after:
+                return seq
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self):
+        self._latest = self._seq = self._times = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _produce(target, shape, duration, fps, result):
+    if isinstance(target, str):
+        ring = FrameRing.attach(target)
+    else:
+        ring = None
+    data = np.random.randint(0, 255, shape, np.uint8)
+    start = time.monotonic()
+    cpu = time.process_time()
+    n = 0
+    while time.monotonic() - start < duration:
+        n += 1
+        if ring is not None:
+            ring.write(data)
+        else:
+            target[0] = data
+            target[1] = n
+        if fps:
+            time.sleep(max(0.0, start + n / fps - time.monotonic()))
+    result.put((n, time.process_time() - cpu))
+    if ring is not None:
+        ring.close()
+
+def _cpu_seconds(pid):
+    '''utime + stime of another process, from /proc'''
+    import os
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+def benchmark(duration=2.0, resolutions=((240, 320), (480, 640)), rates=(30, None)):
+    '''Frames/s a reader gets and CPU seconds spent, Manager().list() vs
+    FrameRing, with the writer at camera rate and flat out. The reader
+    touches every new frame (a sum) like an encoder would; "server" is
+    the CPU of the Manager's server process, which does the pickling.'''
+    from multiprocessing import Manager, Process, Queue
+    print('%-8s %-8s %5s %10s %8s %6s %8s %8s %8s' % (
+        'method', 'size', 'fps', 'written/s', 'read/s', 'torn', 'writer', 'reader', 'server'))
+    for height, width in resolutions:
+        shape = (height, width, 3)
+        for fps in rates:
+            for method in ('manager', 'ring'):
+                result = Queue()
+                if method == 'manager':
+                    manager = Manager()
+                    target = manager.list([np.zeros(shape, np.uint8), 0])
+                    server_cpu = _cpu_seconds(manager._process.pid)
+                else:
+                    ring = FrameRing.create(shape)
+                    target = ring.name
+                producer = Process(target=_produce, args=(target, shape, duration, fps, result))
+                producer.start()
+                start = time.monotonic()
+                cpu = time.process_time()
+                read = torn = last = 0
+                while producer.is_alive() and time.monotonic() - start < duration:
+                    if method == 'manager':
+                        frame = target[0]
+                        seq = target[1]
+                        if seq != last:
+                            int(frame.sum())
+                            read += 1
+                            last = seq
+                        continue
+                    seq = ring.wait(last, timeout=0.1)
+                    claimed = ring.claim(seq) if seq else None
+                    if claimed is None:
+                        continue
+                    int(claimed[2].sum())
+                    if ring.valid(seq):
+                        read += 1
+                    else:
+                        torn += 1
+                    last = seq
+                reader_cpu = time.process_time() - cpu
+                written, writer_cpu = result.get()
+                producer.join()
+                if method == 'manager':
+                    server = '%7.2fs' % (_cpu_seconds(manager._process.pid) - server_cpu)
+                    manager.shutdown()
+                else:
+                    server = '%8s' % '-'
+                    ring.close()
+                print('%-8s %-8s %5s %10.0f %8.0f %6d %7.2fs %7.2fs %s' % (
+                    method, '%dx%d' % (width, height), fps or 'max', written / duration, read / duration,
+                    torn, writer_cpu, reader_cpu, server))
+
+if __name__ == '__main__':
+    benchmark()
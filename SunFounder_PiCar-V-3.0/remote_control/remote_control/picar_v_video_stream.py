@@ -1,54 +1,50 @@
-import numpy as np
 import cv2
-import threading
-import os
-from flask import Flask, render_template, Response
 from multiprocessing import Process, Manager
-import time
-import datetime
+import atexit
+import asyncio
+try:
+    from .frame_ring import FrameRing
+    from .broadcaster import Broadcaster
+    from .video_server import VideoServer
+    from .capture import Capture
+    from . import adaptive
+except ImportError:
+    from frame_ring import FrameRing
+    from broadcaster import Broadcaster
+    from video_server import VideoServer
+    from capture import Capture
+    import adaptive
 
 
 
-app = Flask(__name__)
-@app.route('/')
-def index():
-    """Video streaming home page."""
-    return render_template('index.html')
-
-def gen():
-    """Video streaming generator function."""
-    while True:  
-
-        frame = cv2.imencode('.jpg', Vilib.img_array[0])[1].tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-        
-
-@app.route('/mjpg')
-def video_feed():
-    # from camera import Camera
-    """Video streaming route. Put this in the src attribute of an img tag."""
-    return Response(gen(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame') 
-
 def web_camera_start():
-    app.run(host='0.0.0.0', port=8765,threaded=True)
+    """Serve the index page, /mjpg and /stats on port 8765 until SIGINT/SIGTERM"""
+    broadcaster = Broadcaster(Vilib.ring, quality=adaptive.QUALITY[1])
+    try:
+        asyncio.run(VideoServer(broadcaster, stats=Vilib.capture_stats.copy).serve())
+    except KeyboardInterrupt:
+        pass
 
 
 class Vilib(object): 
 
     video_source = 0
 
-    detect_obj_parameter = Manager().dict()
-    img_array = Manager().list(range(2))
-    rt_img = np.ones((320,240),np.uint8)     
-    img_array[0] = rt_img
+    manager = Manager()
+    detect_obj_parameter = manager.dict()
+    capture_stats = manager.dict()      # Capture.stats() of the camera process, once a second
+    ring = None                 # FrameRing the camera process writes, see frame_ring.py
+    frame_shape = (240, 320, 3)
 
 
     @staticmethod
     def camera_start(web_func = True):
         from multiprocessing import Process
+
+        # Before the workers fork, so they all map the same frames
+        if Vilib.ring is None:
+            Vilib.ring = FrameRing.create(Vilib.frame_shape)
+            atexit.register(Vilib.ring.close)
        
         worker_2 = Process(name='worker 2',target=Vilib.camera_clone)
         if web_func == True:
@@ -63,21 +59,15 @@ class Vilib(object):
 
     @staticmethod
     def camera():
- 
-        camera = cv2.VideoCapture(Vilib.video_source)
-
-        camera.set(3,320)
-        camera.set(4,240)
-        width = int(camera.get(3))
-        height = int(camera.get(4))
-        camera.set(cv2.CAP_PROP_BUFFERSIZE,1)
         cv2.setUseOptimized(True)
- 
+        height, width = Vilib.frame_shape[:2]
+        capture = Capture(Vilib.video_source, Vilib.ring, width, height, on_stats=Vilib.capture_stats.update)
+        capture.run()
 
-        while True:
-            _, img = camera.read()
-
-            Vilib.img_array[0] = img
+    @staticmethod
+    def read():
+        '''Copy of the newest frame as (seq, timestamp, frame), or None'''
+        return Vilib.ring.read()
 
 if __name__ == "__main__":
     Vilib.camera_start()
@@ -0,0 +1,217 @@
+'''
+**********************************************************************
+* Filename    : video_server.py
+* Description : asyncio HTTP server for the camera stream: the index
+*               page, /mjpg and /stats on port 8765
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Every viewer is a coroutine rather than a thread. A viewer has at most
+one frame in flight: the next part is only written once drain() says
+the last one left the transport buffer, so a slow viewer costs
+WRITE_BUFFER bytes at most and skips frames. Every viewer shares the
+Broadcaster's JPEG bytes. Connections that send no request within
+REQUEST_TIMEOUT are closed, and past MAX_CLIENTS new ones get a 503.
+'''
+
+import asyncio
+import json
+import signal
+import time
+try:
+    from . import adaptive
+    from . import broadcaster
+except ImportError:
+    import adaptive
+    import broadcaster
+
+HOST = ''
+PORT = 8765
+MAX_CLIENTS = 512
+REQUEST_LIMIT = 8192        # Bytes of request line and headers
+REQUEST_TIMEOUT = 10.0      # Seconds to send them in
+SEND_TIMEOUT = 30.0         # A viewer that takes no data for this long is dropped
+WRITE_BUFFER = 64 * 1024    # Transport buffer above which drain() waits
+BOUNDARY = b'frame'
+
+INDEX = b'''<!DOCTYPE html>
+<html>
+<head><title>PiCar-V camera</title></head>
+<body style="margin:0;background:#000">
+<img src="/mjpg" style="display:block;margin:auto;max-width:100%;height:100vh;object-fit:contain">
+</body>
+</html>
+'''
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            408: 'Request Timeout', 431: 'Request Header Fields Too Large', 503: 'Service Unavailable'}
+
+def _head(status, content_type, length=None):
+    lines = ['HTTP/1.1 %d %s' % (status, _REASONS[status]),
+             'Content-Type: ' + content_type,
+             'Cache-Control: no-cache, no-store',
+             'Connection: close']
+    if length is not None:
+        lines.append('Content-Length: %d' % length)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+class VideoServer(object):
+    '''Serves a Broadcaster's frames to any number of viewers'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "video_server.py":'
+
+    def __init__(self, broadcaster, host=HOST, port=PORT, max_clients=MAX_CLIENTS, stats=None):
+        self.broadcaster = broadcaster
+        self.stats = stats          # Returns the capture counters for /stats, if given
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.clients = set()        # Tasks of the open connections
+        self.viewers = 0
+        self._frame = None          # asyncio.Event set on the next new frame
+        self._loop = None
+        self._stopping = False
+
+    def _new_frame(self):
+        '''Encoder thread: wake every viewer on the event loop'''
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        event, self._frame = self._frame, asyncio.Event()
+        event.set()
+
+    async def next_frame(self, after):
+        '''Wait until the broadcaster has a frame newer than `after`'''
+        while self.broadcaster.seq <= after:
+            await self._frame.wait()
+        return self.broadcaster.seq, self.broadcaster.jpeg
+
+    async def handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            if len(self.clients) > self.max_clients:
+                await self.respond(writer, 503, 'text/plain', b'Too many viewers\n')
+                return
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self.respond(writer, 408, 'text/plain', b'')
+                return
+            except asyncio.LimitOverrunError:
+                await self.respond(writer, 431, 'text/plain', b'')
+                return
+            except asyncio.IncompleteReadError:
+                return
+            try:
+                method, target, _ = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+            except ValueError:
+                await self.respond(writer, 400, 'text/plain', b'')
+                return
+            path, _, query = target.partition('?')
+            if method not in ('GET', 'HEAD'):
+                await self.respond(writer, 405, 'text/plain', b'')
+            elif path == '/':
+                await self.respond(writer, 200, 'text/html; charset=utf-8', INDEX, method == 'HEAD')
+            elif path == '/stats':
+                stats = self.broadcaster.stats()
+                stats['connections'] = len(self.clients)
+                if self.stats is not None:
+                    stats['capture'] = self.stats()
+                await self.respond(writer, 200, 'application/json', json.dumps(stats).encode(), method == 'HEAD')
+            elif path == '/mjpg':
+                await self.stream(writer, 'adaptive=0' not in query.split('&'))
+            else:
+                await self.respond(writer, 404, 'text/plain', b'Not found\n')
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            pass                    # Shutting down; end like a dropped connection
+        finally:
+            self.clients.discard(task)
+            if self._stopping:
+                writer.transport.abort()        # Do not wait to flush a stalled viewer
+            else:
+                writer.close()
+
+    async def respond(self, writer, status, content_type, body, head_only=False):
+        writer.write(_head(status, content_type, len(body)))
+        if not head_only:
+            writer.write(body)
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    async def stream(self, writer, adapt=True):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        stream = None
+        if adapt:
+            stream = adaptive.AdaptiveStream(sock=writer.get_extra_info('socket'), name='%s:%s' % peer[:2])
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+        writer.write(_head(200, 'multipart/x-mixed-replace; boundary=' + BOUNDARY.decode()))
+        loop = asyncio.get_running_loop()
+        self.broadcaster.subscribe(stream)
+        self.viewers += 1
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Viewer %s:%s, %d watching' % (peer[0], peer[1], self.viewers))
+        viewer = broadcaster.Viewer(self.broadcaster, stream)
+        try:
+            while True:
+                delay = viewer.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                await self.next_frame(viewer.last)
+                if stream is None:
+                    jpeg = viewer.take()
+                else:
+                    jpeg = await loop.run_in_executor(None, viewer.take)
+                if jpeg is None:
+                    continue
+                writer.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(jpeg))
+                writer.write(jpeg)
+                writer.write(b'\r\n')
+                start = time.monotonic()
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+                viewer.sent(len(jpeg), time.monotonic() - start)
+        finally:
+            self.viewers -= 1
+            self.broadcaster.unsubscribe(stream)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._frame = asyncio.Event()
+        self.broadcaster.listeners.append(self._new_frame)
+        self.broadcaster.start()
+        server = await asyncio.start_server(self.handle_client, self.host or None, self.port,
+                                            reuse_address=True, limit=REQUEST_LIMIT)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, stop.set)
+        print('Camera stream on port', self.port)
+        try:
+            await stop.wait()
+        finally:
+            self._stopping = True
+            server.close()
+            for task in list(self.clients):
+                task.cancel()
+            await asyncio.gather(*self.clients, return_exceptions=True)
+            await server.wait_closed()
+            self.broadcaster.listeners.remove(self._new_frame)
+            self.broadcaster.stop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._loop.remove_signal_handler(signum)
+            print('Camera stream stopped')
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 from tkinter import *
 import socket
+import struct
+import time
 
 ctrl_cmd = ['forward', 'backward', 'left', 'right', 'stop', 'read cpu_temp', 'home', 'distance', 'x+', 'x-', 'y+', 'y-', 'xy_home']
 
@@ -16,53 +18,135 @@ ADDR = (HOST, PORT)
 tcpCliSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)   # Create a socket
 tcpCliSock.connect(ADDR)                    # Connect with the server
 
+# =============================================================================
+# End every command with a newline, so the server can still tell them apart
+# when TCP puts several into one packet (see server/framing.py).
+# =============================================================================
+tcpCliSock.send('framing=line\n'.encode())
+
+def send_cmd(cmd):
+    tcpCliSock.send((cmd + '\n').encode())
+
+# =============================================================================
+# UDP mode (the server must run with SMARTCAR_UDP=1): driving and camera
+# buttons only change the state below, which is sent as one datagram every
+# UDP_INTERVAL ms. A lost datagram is replaced by the next one instead of
+# holding up the rest like TCP does. See server/udp_control.py.
+# =============================================================================
+UDP_MODE = False
+UDP_PORT = 21568
+UDP_INTERVAL = 20
+UDP_PACKET = struct.Struct('<BIdbBhh')  # version, seq, timestamp, throttle, steer, pan, tilt
+
+state = {'throttle': 0, 'steer': 128, 'pan': 0, 'tilt': 0}
+udp_seq = 0
+udpCliSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if UDP_MODE else None
+
+def send_state():
+    global udp_seq
+    udpCliSock.sendto(UDP_PACKET.pack(1, udp_seq & 0xFFFFFFFF, time.monotonic(), state['throttle'],
+                                      state['steer'], state['pan'], state['tilt']), (HOST, UDP_PORT))
+    udp_seq += 1
+    top.after(UDP_INTERVAL, send_state)
+
+# =============================================================================
+# Tell the server we are still here every HEARTBEAT_INTERVAL ms, so its
+# deadman watchdog (server/watchdog.py) does not stop the car while a button
+# is held down. In UDP mode the datagram stream does that.
+# =============================================================================
+HEARTBEAT_INTERVAL = 250
+
+def heartbeat():
+    send_cmd('ping')
+    top.after(HEARTBEAT_INTERVAL, heartbeat)
+
+def set_state(**changes):
+    state.update(changes)
+
+def move_camera(dx, dy):
+    state['pan'] = min(max(state['pan'] + dx, -250), 250)
+    state['tilt'] = min(max(state['tilt'] + dy, -80), 420)
+
 # =============================================================================
 # The function is to send the command forward to the server, so as to make the 
 # car move forward.
 # ============================================================================= 
 def forward_fun(event):
     print('forward')
-    tcpCliSock.send('forward'.encode())
+    if UDP_MODE:
+        set_state(throttle=spd)
+    else:
+        send_cmd('forward')
 
 def backward_fun(event):
     print('backward')
-    tcpCliSock.send('backward'.encode())
+    if UDP_MODE:
+        set_state(throttle=-spd)
+    else:
+        send_cmd('backward')
 
 def left_fun(event):
     print('left')
-    tcpCliSock.send('left'.encode())
+    if UDP_MODE:
+        set_state(steer=0)
+    else:
+        send_cmd('left')
 
 def right_fun(event):
     print('right')
-    tcpCliSock.send('right'.encode())
+    if UDP_MODE:
+        set_state(steer=255)
+    else:
+        send_cmd('right')
 
 def stop_fun(event):
     print('stop')
-    tcpCliSock.send('stop'.encode())
+    if UDP_MODE:
+        set_state(throttle=0)
+    else:
+        send_cmd('stop')
 
 def home_fun(event):
     print('home')
-    tcpCliSock.send('home'.encode())
+    if UDP_MODE:
+        set_state(steer=128)
+    else:
+        send_cmd('home')
 
 def x_increase(event):
     print('x+')
-    tcpCliSock.send('x+'.encode())
+    if UDP_MODE:
+        move_camera(-25, 0)
+    else:
+        send_cmd('x+')
 
 def x_decrease(event):
     print('x-')
-    tcpCliSock.send('x-'.encode())
+    if UDP_MODE:
+        move_camera(25, 0)
+    else:
+        send_cmd('x-')
 
 def y_increase(event):
     print('y+')
-    tcpCliSock.send('y+'.encode())
+    if UDP_MODE:
+        move_camera(0, 25)
+    else:
+        send_cmd('y+')
 
 def y_decrease(event):
     print('y-')
-    tcpCliSock.send('y-'.encode())
+    if UDP_MODE:
+        move_camera(0, -25)
+    else:
+        send_cmd('y-')
 
 def xy_home(event):
     print('xy_home')
-    tcpCliSock.send('xy_home'.encode())
+    if UDP_MODE:
+        set_state(pan=0, tilt=0)
+    else:
+        send_cmd('xy_home')
 
 # =============================================================================
 # Exit the GUI program and close the network connection between the client 
@@ -70,7 +154,7 @@ def xy_home(event):
 # =============================================================================
 def quit_fun(event):
     top.quit()
-    tcpCliSock.send('stop'.encode())
+    send_cmd('stop')
     tcpCliSock.close()
 
 # =============================================================================
@@ -161,7 +245,7 @@ def changeSpeed(ev=None):
     spd = speed.get()
     data = tmp + str(spd)
     print('sendData = %s' % data)
-    tcpCliSock.send(data.encode())
+    send_cmd(data)
 
 label = Label(top, text='Speed:', fg='red')
 label.grid(row=6, column=0)
@@ -171,6 +255,10 @@ speed.set(50)
 speed.grid(row=6, column=1)
 
 def main():
+    if UDP_MODE:
+        send_state()
+    else:
+        heartbeat()
     top.mainloop()
 
 if __name__ == '__main__':
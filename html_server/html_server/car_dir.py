@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 import Sunfounder_PWM_Servo_Driver.Servo_init as servo
 import time                # Import necessary modules
-
-FILE_CONFIG = "/home/pi/Sunfounder_Smart_Video_Car_Kit_for_RaspberryPi/server/config"
+import car_config
 
 def Map(x, in_min, in_max, out_min, out_max):
 	return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
@@ -12,13 +11,7 @@ def setup():
 	leftPWM = 400
 	homePWM = 450
 	rightPWM = 500
-	offset =0
-	try:
-		for line in open(FILE_CONFIG):
-			if line[0:8] == 'offset =':
-				offset = int(line[9:-1])
-	except:
-		print 'config error'
+	offset = car_config.get().offset
 	leftPWM += offset
 	homePWM += offset
 	rightPWM += offset
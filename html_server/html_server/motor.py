@@ -2,6 +2,7 @@
 import RPi.GPIO as GPIO
 import Sunfounder_PWM_Servo_Driver.Servo_init as pwm
 import time    # Import necessary modules
+import car_config
 
 # ===========================================================================
 # Raspberry Pi pin11, 12, 13 and 15 to realize the clockwise/counterclockwise
@@ -12,8 +13,6 @@ Motor0_B = 12  # pin12
 Motor1_A = 13  # pin13
 Motor1_B = 15  # pin15
 
-FILE_CONFIG = "/home/pi/Sunfounder_Smart_Video_Car_Kit_for_RaspberryPi/server/config"
-
 # ===========================================================================
 # Set channel 4 and 5 of the servo driver IC to generate PWM, thus 
 # controlling the speed of the car
@@ -37,18 +36,11 @@ def setSpeed(speed):
 
 def setup():
 	global forward0, forward1, backward1, backward0
-	forward0 = 'True'
-	forward1 = 'True'
 	GPIO.setwarnings(False)
 	GPIO.setmode(GPIO.BOARD)        # Number GPIOs by its physical location
-	try:
-		for line in open(FILE_CONFIG):
-			if line[0:8] == "forward0":
-				forward0 = line[11:-1]
-			if line[0:8] == "forward1":
-				forward1 = line[11:-1]
-	except:
-		pass
+	config = car_config.get()
+	forward0 = str(config.forward0)
+	forward1 = str(config.forward1)
 	if forward0 == 'True':
 		backward0 = 'False'
 	elif forward0 == 'False':
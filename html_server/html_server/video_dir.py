@@ -1,29 +1,19 @@
 #!/usr/bin/env python
 import Sunfounder_PWM_Servo_Driver.Servo_init as servo
 import time                  # Import necessary modules
+import car_config
 
 MinPulse = 200
 MaxPulse = 700
 
-FILE_CONFIG = "/home/pi/Sunfounder_Smart_Video_Car_Kit_for_RaspberryPi/server/config"
-
 Current_x = 0
 Current_y = 0
 
 def setup():
 	global Xmin, Ymin, Xmax, Ymax, home_x, home_y, pwm
-	offset_x = 0
-	offset_y = 0
-	try:
-		for line in open(FILE_CONFIG):
-			if line[0:8] == 'offset_x':
-				offset_x = int(line[11:-1])
-				#print 'offset_x =', offset_x
-			if line[0:8] == 'offset_y':
-				offset_y = int(line[11:-1])
-				#print 'offset_y =', offset_y
-	except:
-		pass
+	config = car_config.get()
+	offset_x = config.offset_x
+	offset_y = config.offset_y
 	Xmin = MinPulse + offset_x
 	Xmax = MaxPulse + offset_x
 	Ymin = MinPulse + offset_y
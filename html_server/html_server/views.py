@@ -3,6 +3,7 @@ from django.shortcuts import render
 import video_dir
 import car_dir
 import motor
+import car_config
 import os
 
 
@@ -25,25 +26,23 @@ motor.setup()     # Initialize the Raspberry Pi GPIO connected to the DC motor.
 video_dir.home_x_y()
 car_dir.home()
 
-# Read config file
-FILE_CONFIG = "/home/pi/Sunfounder_Smart_Video_Car_Kit_for_RaspberryPi/server/config"
-offset = "0"
-offset_x = "0"
-offset_y = "0"
+# Calibration being edited, loaded from the config file at start and by calibration_mode()
+offset = 0
+offset_x = 0
+offset_y = 0
 forward0 = "True"
 forward1 = "True"
 
-for line in open(FILE_CONFIG):
-	if line[0:8] == 'offset_x':
-		offset_x = int(line[11:-1])
-	if line[0:8] == 'offset_y':
-		offset_y = int(line[11:-1])
-	if line[0:8] == 'offset =':
-		offset = int(line[9:-1])
-	if line[0:8] == "forward0":
-		forward0 = line[11:-1]
-	if line[0:8] == "forward1":
-		forward1 = line[11:-1]
+def load_config():
+	global offset, offset_x, offset_y, forward0, forward1
+	config = car_config.get()
+	offset = config.offset
+	offset_x = config.offset_x
+	offset_y = config.offset_y
+	forward0 = str(config.forward0)
+	forward1 = str(config.forward1)
+
+load_config()
 
 def motor_forward(request):
 	motor.forward()
@@ -103,6 +102,7 @@ def run_mode(request):
 	return HttpResponse("Run mode start")
 
 def calibration_mode(request):
+	load_config()
 	video_dir.calibrate(offset_x, offset_y)
 	car_dir.calibrate(offset)
 	return HttpResponse("Calibration mode start")
@@ -170,12 +170,10 @@ def calibrate_tile(request, direction, in_offset_y):
 
 def calibrate_confirm(request):
 	global offset, offset_x, offset_y, forward0, forward1
-	config = 'offset_x = %s\noffset_y = %s\noffset = %s\nforward0 = %s\nforward1 = %s\n ' % (offset_x, offset_y, offset, forward0, forward1)
-
-	fd = open(FILE_CONFIG, 'w')
-	fd.write(config)
-	fd.close()
-	return HttpResponse(config)
+	config = car_config.get()
+	config.save(offset_x=offset_x, offset_y=offset_y, offset=offset,
+				forward0=forward0 == "True", forward1=forward1 == "True")
+	return HttpResponse(config.format())
 
 def test(request, direction, text):
 	text = direction + str(text)
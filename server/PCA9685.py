@@ -11,9 +11,68 @@
 **********************************************************************
 '''
 
-import smbus
+import os
 import time
+import contextlib
 import math
+import threading
+from hardware import BACKEND, smbus
+
+LOCK_FILE = os.environ.get('PCA9685_LOCK_FILE')   # e.g. /tmp/pca9685-{bus}-{address:02X}.lock
+
+class BusLock(object):
+    '''Serialises register access to one PCA9685.
+
+    Threads of one process share a re-entrant lock. With a lock file, the
+    outermost acquire also takes an flock on it, so other processes (Django,
+    tcp_server.py, ball_tracker.py) never interleave partial register writes.
+    The file holds a write counter; `stale` is set when another process wrote
+    since we last held the lock.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stale = False
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._seen = 0
+        self._dirty = False
+        if path is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and self._fd is not None:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            data = os.pread(self._fd, 8, 0)
+            generation = int.from_bytes(data, 'little') if len(data) == 8 else 0
+            if generation != self._seen:
+                self.stale = True
+                self._seen = generation
+        return self
+
+    def __exit__(self, *args):
+        if self._depth == 1 and self._fd is not None:
+            import fcntl
+            if self._dirty:
+                self._seen = (self._seen + 1) & 0xFFFFFFFFFFFFFFFF
+                os.pwrite(self._fd, self._seen.to_bytes(8, 'little'), 0)
+                self._dirty = False
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._depth -= 1
+        self._lock.release()
+
+    def touch(self):
+        '''Note that the chip was written while holding the lock'''
+        self._dirty = True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
 class PWM(object):
     """A PWM control class for PCA9685."""
@@ -33,11 +92,16 @@ class PWM(object):
     _ALL_LED_OFF_H      = 0xFD
 
     _RESTART            = 0x80
+    _AI                 = 0x20
     _SLEEP              = 0x10
     _ALLCALL            = 0x01
     _INVRT              = 0x10
     _OUTDRV             = 0x04
 
+    _BLOCK_MAX          = 32    # SMBus block transfers carry at most 32 bytes
+    _CHANNELS           = 16
+    _CACHED_REGISTERS   = (_MODE1, _MODE2, _PRESCALE)
+
     RPI_REVISION_0 = ["900092"]
     RPI_REVISION_1_MODULE_B = ["Beta", "0002", "0003", "0004", "0005", "0006", "000d", "000e", "000f"]
     RPI_REVISION_1_MODULE_A = ["0007", "0008", "0009",]
@@ -50,8 +114,13 @@ class PWM(object):
     _DEBUG = False
     _DEBUG_INFO = 'DEBUG "PCA9685.py":'
 
-    def _get_bus_number(self):
-        pi_revision = self._get_pi_revision()
+    trace = None        # A pwm_trace.TraceRecorder, gets every issued channel write
+
+    @classmethod
+    def _get_bus_number(cls):
+        if BACKEND == 'sim':
+            return 1
+        pi_revision = cls._get_pi_revision()
         if   pi_revision == '0':
             return 0
         elif pi_revision == '1 Module B':
@@ -69,73 +138,122 @@ class PWM(object):
         elif pi_revision == '3 Module B+':
             return 1
 
-    def _get_pi_revision(self):
+    @classmethod
+    def _get_pi_revision(cls):
         "Gets the version number of the Raspberry Pi board"
         try:
             with open('/proc/cpuinfo','r') as f:
                 for line in f:
                     if line.startswith('Revision'):
-                        return self._get_revision_from_line(line.strip())
+                        return cls._get_revision_from_line(line.strip())
         except Exception as e:
             print(e)
             print('Exiting...')
             quit()
 
-    def _get_revision_from_line(self, line):
+    @classmethod
+    def _get_revision_from_line(cls, line):
         revision = line.split(':')[1].strip()
-        if revision in self.RPI_REVISION_0:
+        if revision in cls.RPI_REVISION_0:
             return '0'
-        elif revision in self.RPI_REVISION_1_MODULE_B:
+        elif revision in cls.RPI_REVISION_1_MODULE_B:
             return '1 Module B'
-        elif revision in self.RPI_REVISION_1_MODULE_A:
+        elif revision in cls.RPI_REVISION_1_MODULE_A:
             return '1 Module A'
-        elif revision in self.RPI_REVISION_1_MODULE_BP:
+        elif revision in cls.RPI_REVISION_1_MODULE_BP:
             return '1 Module B+'
-        elif revision in self.RPI_REVISION_1_MODULE_AP:
+        elif revision in cls.RPI_REVISION_1_MODULE_AP:
             return '1 Module A+'
-        elif revision in self.RPI_REVISION_2_MODULE_B:
+        elif revision in cls.RPI_REVISION_2_MODULE_B:
             return '2 Module B'
-        elif revision in self.RPI_REVISION_3_MODULE_B:
+        elif revision in cls.RPI_REVISION_3_MODULE_B:
             return '3 Module B'
-        elif revision in self.RPI_REVISION_3_MODULE_BP:
+        elif revision in cls.RPI_REVISION_3_MODULE_BP:
             return '3 Module B+'
         else:
             print(f"Error. Pi revision didn't recognize, module number: {revision}")
             print('Exiting...')
             quit()
 
-    def __init__(self, bus_number=None, address=0x40):
-        '''Init the class with bus_number and address'''
+    def __init__(self, bus_number=None, address=0x40, bus=None, lock=None):
+        '''Init the class with bus_number and address, or an already opened bus.
+        Use get_pwm() instead to share one initialized PWM per device.'''
         if self._DEBUG:
             print(self._DEBUG_INFO, "Debug on")
         self.address = address
-        if bus_number is None:
-            self.bus_number = self._get_bus_number()
-        else:
+        self.lock = lock if lock is not None else BusLock()
+        self._registers = {}
+        self._shadow = [None] * self._CHANNELS
+        self.issued_writes = 0
+        self.elided_writes = 0
+        if bus is not None:
             self.bus_number = bus_number
-        self.bus = smbus.SMBus(self.bus_number)
-        if self._DEBUG:
-            print(self._DEBUG_INFO, 'Resetting PCA9685 MODE1 (without SLEEP) and MODE2')
-        self.write_all_value(0, 0)
-        self._write_byte_data(self._MODE2, self._OUTDRV)
-        self._write_byte_data(self._MODE1, self._ALLCALL)
-        time.sleep(0.005)
-
-        mode1 = self._read_byte_data(self._MODE1)
-        mode1 = mode1 & ~self._SLEEP
-        self._write_byte_data(self._MODE1, mode1)
-        time.sleep(0.005)
-        self._frequency = 60
+            self.bus = bus
+        else:
+            if bus_number is None:
+                self.bus_number = self._get_bus_number()
+            else:
+                self.bus_number = bus_number
+            if smbus is None:
+                raise ImportError('smbus is not installed, install python3-smbus, pass a bus object or set SMARTCAR_BACKEND=sim')
+            self.bus = smbus.SMBus(self.bus_number)
+        with self._locked():
+            if self.lock.path is not None and self._configured():
+                if self._DEBUG:
+                    print(self._DEBUG_INFO, 'PCA9685 already set up by another process, resync only')
+                self.resync()
+                return
+            if self._DEBUG:
+                print(self._DEBUG_INFO, 'Resetting PCA9685 MODE1 (without SLEEP, with auto-increment) and MODE2')
+            self._write_byte_data(self._MODE2, self._OUTDRV)
+            self._write_byte_data(self._MODE1, self._ALLCALL | self._AI)
+            time.sleep(0.005)
+            self.write_all_value(0, 0)
+
+            mode1 = self._read_register(self._MODE1)
+            mode1 = mode1 & ~self._SLEEP
+            self._write_byte_data(self._MODE1, mode1)
+            time.sleep(0.005)
+            self._frequency = self._prescale_to_frequency(self._read_register(self._PRESCALE))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        '''Hold the bus lock, dropping the shadow if another process wrote meanwhile'''
+        with self.lock:
+            if self.lock.stale:
+                self.lock.stale = False
+                self.invalidate()
+            yield
+
+    def _configured(self):
+        '''True if MODE1/MODE2 already hold what __init__ would write'''
+        mode1 = self._read_register(self._MODE1)
+        mode2 = self._read_register(self._MODE2)
+        return mode1 & (self._AI | self._SLEEP) == self._AI and mode2 == self._OUTDRV
 
     def _write_byte_data(self, reg, value):
         '''Write data to I2C with self.address'''
         if self._DEBUG:
             print(self._DEBUG_INFO, f'Writing value {value:2X} to {reg:2X}')
+        self.lock.touch()
         try:
             self.bus.write_byte_data(self.address, reg, value)
         except Exception as i:
             print(i)
             self._check_i2c()
+        if reg in self._CACHED_REGISTERS:
+            self._cache_register(reg, value)
+
+    def _write_block_data(self, reg, data):
+        '''Write a run of registers starting at reg in one I2C transaction'''
+        if self._DEBUG:
+            print(self._DEBUG_INFO, f'Writing {len(data)} bytes from {reg:2X}')
+        self.lock.touch()
+        try:
+            self.bus.write_i2c_block_data(self.address, reg, data)
+        except Exception as i:
+            print(i)
+            self._check_i2c()
 
     def _read_byte_data(self, reg):
         '''Read data from I2C with self.address'''
@@ -148,6 +266,51 @@ class PWM(object):
             print(i)
             self._check_i2c()
 
+    def _cache_register(self, reg, value):
+        if reg == self._MODE1:
+            value &= ~self._RESTART     # RESTART is a one-shot, never keep it
+        self._registers[reg] = value
+
+    def _read_register(self, reg):
+        '''Read MODE1, MODE2 or PRESCALE from the shadow, going to I2C only once'''
+        if reg not in self._registers:
+            self._cache_register(reg, self._read_byte_data(reg))
+        return self._registers[reg]
+
+    def invalidate(self):
+        '''Forget the shadow registers, so the next writes all go to the chip.
+        Call it when another process may have touched the PCA9685.'''
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Invalidate shadow registers')
+        self._registers = {}
+        self._shadow = [None] * self._CHANNELS
+
+    def resync(self):
+        '''Reload the shadow registers from the chip'''
+        if self._DEBUG:
+            print(self._DEBUG_INFO, 'Resync shadow registers')
+        with self._locked():
+            self.invalidate()
+            data = []
+            length = self._CHANNELS * 4
+            while len(data) < length:
+                count = min(self._BLOCK_MAX, length - len(data))
+                try:
+                    data += self.bus.read_i2c_block_data(self.address, self._LED0_ON_L+len(data), count)
+                except Exception as i:
+                    print(i)
+                    self._check_i2c()
+            for channel in range(self._CHANNELS):
+                on_l, on_h, off_l, off_h = data[channel*4:channel*4+4]
+                self._shadow[channel] = ((on_h << 8) | on_l, (off_h << 8) | off_l)
+            for reg in self._CACHED_REGISTERS:
+                self._read_register(reg)
+            self._frequency = self._prescale_to_frequency(self._registers[self._PRESCALE])
+
+    @staticmethod
+    def _prescale_to_frequency(prescale):
+        return int(round(25000000.0 / 4096.0 / (prescale + 1)))
+
     def _check_i2c(self):
         import subprocess
         bus_number = self._get_bus_number()
@@ -209,32 +372,83 @@ class PWM(object):
         prescale = math.floor(prescale_value + 0.5)
         if self._DEBUG:
             print(self._DEBUG_INFO, f'Final pre-scale: {prescale}')
+        with self._locked():
+            if self._registers.get(self._PRESCALE) == prescale:
+                self.elided_writes += 1
+                return
+
+            old_mode = self._read_register(self._MODE1)
+            new_mode = (old_mode & 0x7F) | 0x10
+            self._write_byte_data(self._MODE1, new_mode)
+            self._write_byte_data(self._PRESCALE, int(math.floor(prescale)))
+            self._write_byte_data(self._MODE1, old_mode)
+            time.sleep(0.005)
+            self._write_byte_data(self._MODE1, old_mode | 0x80)
 
-        old_mode = self._read_byte_data(self._MODE1)
-        new_mode = (old_mode & 0x7F) | 0x10
-        self._write_byte_data(self._MODE1, new_mode)
-        self._write_byte_data(self._PRESCALE, int(math.floor(prescale)))
-        self._write_byte_data(self._MODE1, old_mode)
-        time.sleep(0.005)
-        self._write_byte_data(self._MODE1, old_mode | 0x80)
+    @staticmethod
+    def _pack(on, off):
+        '''ON_L, ON_H, OFF_L, OFF_H bytes of one channel'''
+        on = int(on)
+        off = int(off)
+        return [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
 
     def write(self, channel, on, off):
         '''Set on and off value on specific channel'''
         if self._DEBUG:
             print(self._DEBUG_INFO, f'Set channel "{channel}" to value "{off}"')
-        self._write_byte_data(self._LED0_ON_L+4*channel, int(on) & 0xFF)
-        self._write_byte_data(self._LED0_ON_H+4*channel, int(on) >> 8)
-        self._write_byte_data(self._LED0_OFF_L+4*channel, int(off) & 0xFF)
-        self._write_byte_data(self._LED0_OFF_H+4*channel, int(off) >> 8)
+        with self._locked():
+            value = (int(on), int(off))
+            if self._shadow[channel] == value:
+                self.elided_writes += 1
+                return
+            self._write_block_data(self._LED0_ON_L+4*channel, self._pack(*value))
+            self._shadow[channel] = value
+            self.issued_writes += 1
+            if self.trace is not None:
+                self.trace.record_pwm(channel, *value)
+
+    def write_many(self, values):
+        '''Set on and off values of several channels, given as {channel: (on, off)}
+
+        Adjacent channels are sent together, so pan/tilt (14, 15) or the motor
+        enables (4, 5) cost a single I2C transaction.
+        '''
+        if self._DEBUG:
+            print(self._DEBUG_INFO, f'Set channels {values}')
+        with self._locked():
+            per_block = self._BLOCK_MAX // 4
+            start = None
+            data = []
+            for channel in sorted(values):
+                on, off = values[channel]
+                value = (int(on), int(off))
+                if self._shadow[channel] == value:
+                    self.elided_writes += 1
+                    continue
+                self._shadow[channel] = value
+                self.issued_writes += 1
+                if self.trace is not None:
+                    self.trace.record_pwm(channel, *value)
+                if start is not None and channel == start + len(data)//4 and len(data) < per_block*4:
+                    data += self._pack(on, off)
+                    continue
+                if start is not None:
+                    self._write_block_data(self._LED0_ON_L+4*start, data)
+                start = channel
+                data = self._pack(on, off)
+            if start is not None:
+                self._write_block_data(self._LED0_ON_L+4*start, data)
 
     def write_all_value(self, on, off):
         '''Set on and off value on all channel'''
         if self._DEBUG:
             print(self._DEBUG_INFO, f'Set all channel to value "{off}"')
-        self._write_byte_data(self._ALL_LED_ON_L, on & 0xFF)
-        self._write_byte_data(self._ALL_LED_ON_H, on >> 8)
-        self._write_byte_data(self._ALL_LED_OFF_L, off & 0xFF)
-        self._write_byte_data(self._ALL_LED_OFF_H, off >> 8)
+        with self._locked():
+            self._write_block_data(self._ALL_LED_ON_L, self._pack(on, off))
+            self._shadow = [(int(on), int(off))] * self._CHANNELS
+            self.issued_writes += 1
+            if self.trace is not None:
+                self.trace.record_pwm(0xFFFF, on, off)     # pwm_trace.ALL_CHANNELS
 
     def map(self, x, in_min, in_max, out_min, out_max):
         '''To map the value from arange to another'''
@@ -257,6 +471,28 @@ class PWM(object):
         else:
             print(self._DEBUG_INFO, "Set debug off")
 
+_devices = {}
+_devices_lock = threading.Lock()
+
+def get_pwm(bus_number=None, address=0x40, lock_file=LOCK_FILE):
+    '''Return the shared PWM of a (bus, address) pair.
+
+    The chip is initialized on the first call only; later calls hand out the
+    same object, which lives as long as the process and is never closed.
+    lock_file may hold {bus} and {address} fields and turns on the
+    cross-process lock.
+    '''
+    if bus_number is None:
+        bus_number = PWM._get_bus_number()
+    key = (bus_number, address)
+    with _devices_lock:
+        if key not in _devices:
+            lock = BusLock()
+            if lock_file:
+                lock = BusLock(lock_file.format(bus=bus_number, address=address))
+            _devices[key] = PWM(bus_number=bus_number, address=address, lock=lock)
+        return _devices[key]
+
 if __name__ == '__main__':
     import time
 
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO   
+from hardware import GPIO   
 import video_dir   #local file
 import car_dir   #local file
 import motor   # local file
+import pwm_writer   # local file
+import framing   # local file
+import protocol   # local file
+import car_config   # local file
 from socket import *
 from time import ctime          # Import necessary modules   
 
@@ -20,122 +24,127 @@ busnum = 1          # Edit busnum to 0, if you uses Raspberry Pi 1 or 0
 
 def setup():
     global offset_x,  offset_y, offset, forward0, forward1
-    offset_x = 0
-    offset_y = 0
-    offset = 0
-    forward0 = 'True'
-    forward1 = 'False'
-    try:
-        with open('config') as f:
-            for line in f:
-                if line[0:8] == 'offset_x':
-                    offset_x = int(line[11:-1])
-                    print('offset_x =', offset_x)
-                if line[0:8] == 'offset_y':
-                    offset_y = int(line[11:-1])
-                    print('offset_y =', offset_y)
-                if line[0:8] == 'offset =':
-                    offset = int(line[9:-1])
-                    print('offset =', offset)
-                if line[0:8] == "forward0":
-                    forward0 = line[11:-1]
-                    print('turning0 =', forward0)
-                if line[0:8] == "forward1":
-                    forward1 = line[11:-1]
-                    print('turning1 =', forward1)
-    except:
-        print('no config file, set config to original')
+    config = car_config.get()
+    offset_x = config.offset_x
+    offset_y = config.offset_y
+    offset = config.offset
+    forward0 = str(config.forward0)
+    forward1 = str(config.forward1)
+    print('config:', config.values())
     video_dir.setup(busnum=busnum)
     car_dir.setup(busnum=busnum)
     motor.setup(busnum=busnum) 
+    pwm_writer.attach(video_dir, car_dir, motor)
     video_dir.calibrate(offset_x, offset_y)
     car_dir.calibrate(offset)
+    pwm_writer.flush()
 
 def REVERSE(x):
     return 'False' if x == 'True' else 'True'
 
+def motor_run():
+    print('motor moving forward')
+    motor.setSpeed(50)
+    motor.motor0(forward0)
+    motor.motor1(forward1)
+
+def left_motor(direction):
+    global forward0
+    forward0 = 'True' if direction else 'False'
+    motor.motor0(forward0)
+
+def right_motor(direction):
+    global forward1
+    forward1 = 'True' if direction else 'False'
+    motor.motor1(forward1)
+
+def left_reverse():
+    global forward0
+    forward0 = REVERSE(forward0)
+    print("left motor reversed to", forward0)
+    motor.motor0(forward0)
+
+def right_reverse():
+    global forward1
+    forward1 = REVERSE(forward1)
+    print("right motor reversed to", forward1)
+    motor.motor1(forward1)
+
+def motor_stop():
+    print('motor stop')
+    motor.stop()
+
+def set_offset(value):
+    global offset
+    offset = value
+    print('Turning offset', offset)
+    car_dir.calibrate(offset)
+
+def set_offset_x(value):
+    global offset_x
+    offset_x = value
+    print('Mount offset x', offset_x)
+    video_dir.calibrate(offset_x, offset_y)
+
+def set_offset_y(value):
+    global offset_y
+    offset_y = value
+    print('Mount offset y', offset_y)
+    video_dir.calibrate(offset_x, offset_y)
+
+CONFIRMED = 'confirmed'     # Reply of confirm, ends the calibration
+
+def confirm():
+    config = car_config.get()
+    pwm_writer.flush()     # Make sure the servos sit at the confirmed offsets
+    config.save(offset_x=offset_x, offset_y=offset_y, offset=offset,
+                forward0=forward0 == 'True', forward1=forward1 == 'True')
+    print('\n*********************************')
+    print(' You are setting config file to:')
+    print('*********************************')
+    print(config.format())
+    print('*********************************\n')
+    motor.stop()
+    return CONFIRMED
+
+# Same opcodes and text commands as tcp_server.py, see protocol.py
+dispatcher = protocol.Dispatcher()
+for opcode, handler in (
+        (protocol.MOTOR_RUN,        motor_run),
+        (protocol.LEFT_MOTOR,       left_motor),
+        (protocol.RIGHT_MOTOR,      right_motor),
+        (protocol.LEFT_REVERSE,     left_reverse),
+        (protocol.RIGHT_REVERSE,    right_reverse),
+        (protocol.MOTOR_STOP,       motor_stop),
+        (protocol.OFFSET,           set_offset),
+        (protocol.OFFSET_X,         set_offset_x),
+        (protocol.OFFSET_Y,         set_offset_y),
+        (protocol.OFFSET_ADD,       lambda value: set_offset(offset + value)),
+        (protocol.OFFSET_X_ADD,     lambda value: set_offset_x(offset_x + value)),
+        (protocol.OFFSET_Y_ADD,     lambda value: set_offset_y(offset_y + value)),
+        (protocol.CONFIRM,          confirm),
+        ):
+    dispatcher.register(opcode, handler)
+
 def loop():
-    global offset_x, offset_y, offset, forward0, forward1
     while True:
         print('Waiting for connection...')
         tcpCliSock, addr = tcpSerSock.accept() 
         print('...connected from :', addr)
+        parser = framing.StreamParser()
 
         while True:
-            data = tcpCliSock.recv(BUFSIZ).decode()    # Receive data sent from the client. 
+            data = tcpCliSock.recv(BUFSIZ)    # Receive data sent from the client. 
             if not data:
                 break
-            if data == 'motor_run':
-                print('motor moving forward')
-                motor.setSpeed(50)
-                motor.motor0(forward0)
-                motor.motor1(forward1)
-            elif data[0:9] == 'leftmotor':
-                forward0 = data[9:]
-                motor.motor0(forward0)
-            elif data[0:10] == 'rightmotor':
-                forward1 = data[10:]
-                motor.motor1(forward1)
-            elif data == 'leftreverse':
-                forward0 = REVERSE(forward0)
-                print("left motor reversed to", forward0)
-                motor.motor0(forward0)
-            elif data == 'rightreverse':
-                forward1 = REVERSE(forward1)
-                print("right motor reversed to", forward1)
-                motor.motor1(forward1)
-            elif data == 'motor_stop':
-                print('motor stop')
-                motor.stop()
-            elif data[0:7] == 'offset=':
-                offset = int(data[7:])
-                car_dir.calibrate(offset)
-            elif data[0:8] == 'offsetx=':
-                offset_x = int(data[8:])
-                print('Mount offset x', offset_x)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data[0:8] == 'offsety=':
-                offset_y = int(data[8:])
-                print('Mount offset y', offset_y)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data[0:7] == 'offset+':
-                offset += int(data[7:])
-                print('Turning offset', offset)
-                car_dir.calibrate(offset)
-            elif data[0:7] == 'offset-':
-                offset -= int(data[7:])
-                print('Turning offset', offset)
-                car_dir.calibrate(offset)
-            elif data[0:8] == 'offsetx+':
-                offset_x += int(data[8:])
-                print('Mount offset x', offset_x)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data[0:8] == 'offsetx-':
-                offset_x -= int(data[8:])
-                print('Mount offset x', offset_x)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data[0:8] == 'offsety+':
-                offset_y += int(data[8:])
-                print('Mount offset y', offset_y)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data[0:8] == 'offsety-':
-                offset_y -= int(data[8:])
-                print('Mount offset y', offset_y)
-                video_dir.calibrate(offset_x, offset_y)
-            elif data == 'confirm':
-                config = f'offset_x = {offset_x}\noffset_y = {offset_y}\noffset = {offset}\nforward0 = {forward0}\nforward1 = {forward1}\n'
-                print('\n*********************************')
-                print(' You are setting config file to:')
-                print('*********************************')
-                print(config)
-                print('*********************************\n')
-                with open('config', 'w') as fd:
-                    fd.write(config)
-                motor.stop()
-                tcpCliSock.close()
-                return
-            else:
-                print('Command Error! Cannot recognize command:', data)
+            for command in parser.feed(data):
+                if isinstance(command, bytes):
+                    reply = dispatcher.dispatch_text(command.decode(errors='replace'))
+                else:
+                    reply = dispatcher.dispatch(*command)
+                if reply == CONFIRMED:
+                    tcpCliSock.close()
+                    return
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+'''
+**********************************************************************
+* Filename    : car_config.py
+* Description : The calibration config file, parsed once and cached,
+*               with mtime reload, atomic writes and change callbacks
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+The file keeps its old format, one "name = value" per line:
+
+  offset_x = 0        pan servo offset, counts
+  offset_y = 0        tilt servo offset, counts
+  offset = 0          steering servo offset, counts
+  forward0 = True     left motor direction that drives forward
+  forward1 = True     right motor direction that drives forward
+
+Works with Python 2 as well, for html_server.
+'''
+
+import os
+import tempfile
+import threading
+
+FILE_CONFIG = os.environ.get('SMARTCAR_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+def _bool(text):
+    return text.strip() == 'True'
+
+# name, type, default
+FIELDS = (
+    ('offset_x', int, 0),
+    ('offset_y', int, 0),
+    ('offset', int, 0),
+    ('forward0', bool, True),
+    ('forward1', bool, True),
+)
+_PARSERS = {int: int, bool: _bool}
+_NAMES = frozenset(name for name, _, _ in FIELDS)
+
+class Config(object):
+    '''Typed view of one config file. Read the fields as attributes.
+
+    reload() re-parses only when the file's mtime or size changed and tells
+    every subscriber which fields changed. save() writes a temp file next to
+    the config and renames it over, so readers never see half a file.'''
+
+    def __init__(self, path=FILE_CONFIG):
+        self.path = path
+        self.extra = []                 # Lines we do not know, kept on save()
+        self._stamp = None
+        self._subscribers = []
+        self._lock = threading.RLock()
+        for name, _, default in FIELDS:
+            setattr(self, name, default)
+        self.reload()
+
+    def values(self):
+        return dict((name, getattr(self, name)) for name, _, _ in FIELDS)
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)     # A rename gives a new inode
+
+    def _parse(self, text):
+        values = dict((name, default) for name, _, default in FIELDS)
+        types = dict((name, kind) for name, kind, _ in FIELDS)
+        extra = []
+        for line in text.splitlines():
+            name, sep, value = line.partition('=')
+            name = name.strip()
+            if not sep or name not in types:
+                if line.strip():
+                    extra.append(line.rstrip())
+                continue
+            try:
+                values[name] = _PARSERS[types[name]](value.strip())
+            except ValueError:
+                pass                    # Keep the default for a bad value
+        return values, extra
+
+    def reload(self, force=False):
+        '''Re-read the file if it changed on disk. Returns the changed fields.'''
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp == self._stamp and not force:
+                return set()
+            text = ''
+            if stamp is not None:
+                try:
+                    with open(self.path) as f:
+                        text = f.read()
+                except IOError:
+                    return set()
+            self._stamp = stamp
+            values, self.extra = self._parse(text)
+            return self._update(values)
+
+    def _update(self, values):
+        changed = set(name for name, value in values.items() if getattr(self, name) != value)
+        for name in changed:
+            setattr(self, name, values[name])
+        if changed:
+            for callback in list(self._subscribers):
+                callback(self, changed)
+        return changed
+
+    def format(self):
+        lines = ['%s = %s' % (name, getattr(self, name)) for name, _, _ in FIELDS]
+        return '\n'.join(lines + self.extra) + '\n'
+
+    def save(self, **values):
+        '''Set fields and write the file atomically. Returns the changed fields.'''
+        with self._lock:
+            for name in values:
+                if name not in _NAMES:
+                    raise ValueError('Unknown config field "%s"' % name)
+            old = self.values()
+            for name, value in values.items():
+                setattr(self, name, value)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp = tempfile.mkstemp(prefix='.config.', dir=directory)
+            try:
+                try:
+                    os.chmod(temp, os.stat(self.path).st_mode & 0o777)
+                except OSError:
+                    os.chmod(temp, 0o644)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(self.format())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(temp, self.path)
+            except Exception:
+                os.unlink(temp)
+                raise
+            self._stamp = self._file_stamp()
+            new = self.values()
+            for name, value in old.items():
+                setattr(self, name, value)
+            return self._update(new)
+
+    def subscribe(self, callback):
+        '''callback(config, changed_fields) after every change'''
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+def get(path=None):
+    '''The shared Config of a file (FILE_CONFIG by default), reloaded if the file changed'''
+    path = os.path.abspath(path or FILE_CONFIG)
+    with _configs_lock:
+        config = _configs.get(path)
+        if config is None:
+            config = _configs[path] = Config(path)
+            return config
+    config.reload()
+    return config
@@ -1,49 +1,60 @@
 #!/usr/bin/env python3
 import PCA9685 as servo
 import time                # Import necessary modules
+import car_config
+from servo_lut import ServoLUT
 
-FILE_CONFIG = "/home/pi/Sunfounder_Smart_Video_Car_Kit_for_RaspberryPi/server/config"
+STEERING = 0    # servo driver IC CH0
+motion = None   # A motion.MotionController ramping the steering, see motion.attach()
+steering = None # ServoLUT of turn() angle 0-255 -> OFF count, rebuilt on calibration
 
 def Map(x, in_min, in_max, out_min, out_max):
     return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
 def setup(busnum=None):
-    global leftPWM, rightPWM, homePWM, pwm
-    leftPWM = 400
-    homePWM = 450
-    rightPWM = 500
-    offset = 0
-    try:
-        with open(FILE_CONFIG) as f:
-            for line in f:
-                if line[0:8] == 'offset =':
-                    offset = int(line[9:-1])
-    except:
-        print('config error')
-    leftPWM += offset
-    homePWM += offset
-    rightPWM += offset
+    global pwm
+    config = car_config.get()
+    recalibrate(config)
+    config.subscribe(recalibrate)   # Follow later offset changes without another setup()
     if busnum == None:
-        pwm = servo.PWM()         # Initialize the servo controller.
+        pwm = servo.get_pwm()         # Shared servo controller, initialized once.
     else:
-        pwm = servo.PWM(busnum)
+        pwm = servo.get_pwm(busnum)
     pwm.frequency = 60
 
+def recalibrate(config, changed=None):
+    '''Derive the steering positions from the config offset'''
+    global leftPWM, rightPWM, homePWM, steering
+    if changed is not None and 'offset' not in changed:
+        return
+    leftPWM = 400 + config.offset
+    homePWM = 450 + config.offset
+    rightPWM = 500 + config.offset
+    if steering is None:
+        steering = ServoLUT(0, 255, leftPWM, rightPWM)
+    else:
+        steering.update(leftPWM, rightPWM)
+
+def steer(value):
+    if motion is not None:
+        motion.set_target(STEERING, value)
+    else:
+        pwm.write(STEERING, 0, value)
+
 def turn_left():
     global leftPWM
-    pwm.write(0, 0, leftPWM)  # CH0
+    steer(leftPWM)  # CH0
 
 def turn_right():
     global rightPWM
-    pwm.write(0, 0, rightPWM)
+    steer(rightPWM)
 
 def turn(angle):
-    angle = Map(angle, 0, 255, leftPWM, rightPWM)
-    pwm.write(0, 0, angle)
+    steer(steering[angle])
 
 def home():
     global homePWM
-    pwm.write(0, 0, homePWM)
+    steer(homePWM)
 
 def calibrate(x):
     pwm.write(0, 0, 300+x)
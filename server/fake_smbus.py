@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : fake_smbus.py
+* Description : An in-memory SMBus that records every transaction
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+class SMBus(object):
+    '''Drop-in stand-in for smbus.SMBus, so the drivers run without hardware.
+
+    Every call is appended to `transactions` as (name, address, register, data),
+    and written bytes land in a per-address 256 byte register file, so reads
+    return what was written before. Block writes auto-increment the register.
+    '''
+
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.transactions = []
+        self.registers = {}
+
+    def _regs(self, address):
+        if address not in self.registers:
+            self.registers[address] = bytearray(256)
+        return self.registers[address]
+
+    def write_byte_data(self, address, reg, value):
+        self.transactions.append(('write_byte_data', address, reg, value))
+        self._regs(address)[reg] = value & 0xFF
+
+    def read_byte_data(self, address, reg):
+        self.transactions.append(('read_byte_data', address, reg, None))
+        return self._regs(address)[reg]
+
+    def write_i2c_block_data(self, address, reg, data):
+        data = list(data)
+        self.transactions.append(('write_i2c_block_data', address, reg, data))
+        regs = self._regs(address)
+        for i, value in enumerate(data):
+            regs[(reg + i) & 0xFF] = value & 0xFF
+
+    def read_i2c_block_data(self, address, reg, length=32):
+        self.transactions.append(('read_i2c_block_data', address, reg, length))
+        regs = self._regs(address)
+        return [regs[(reg + i) & 0xFF] for i in range(length)]
+
+    def count(self, name=None):
+        '''Number of recorded transactions, optionally of one kind only'''
+        if name is None:
+            return len(self.transactions)
+        return len([t for t in self.transactions if t[0] == name])
+
+    def reset(self):
+        '''Forget the recorded transactions, keep the register contents'''
+        self.transactions = []
+
+    def close(self):
+        pass
+
+def test():
+    import PCA9685
+    bus = SMBus(1)
+    pwm = PCA9685.PWM(bus_number=1, bus=bus)
+    bus.reset()
+    pwm.write(0, 0, 450)
+    print('write(0, 0, 450):', bus.count(), 'transaction(s)')
+    bus.reset()
+    pwm.write_many({14: (0, 450), 15: (0, 300)})
+    print('write_many pan/tilt:', bus.count(), 'transaction(s)')
+    bus.reset()
+    pwm.write_many({0: (0, 450), 4: (0, 2000), 5: (0, 2000), 14: (0, 460), 15: (0, 310)})
+    print('write_many steering, motors, pan/tilt:', bus.count(), 'transaction(s)')
+    bus.reset()
+    pwm.write(0, 0, 450)
+    pwm.frequency = pwm.frequency
+    print('unchanged write and frequency:', bus.count(), 'transaction(s)')
+    print(f'issued {pwm.issued_writes}, elided {pwm.elided_writes}')
+
+if __name__ == '__main__':
+    test()
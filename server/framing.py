@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : framing.py
+* Description : Message framing for the TCP control protocol
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Four modes:
+  legacy   every recv() is one command, as the old clients expect
+  line     commands end with '\n'
+  length   every command is preceded by its length, 2 bytes big endian
+  binary   fixed width packets of protocol.py; replies are length framed
+
+A connection starts in legacy mode. A client switches by sending
+'framing=line\n', 'framing=length\n' or 'framing=binary\n' before
+anything else.
+'''
+
+import struct
+import protocol
+
+LEGACY = 'legacy'
+LINE = 'line'
+LENGTH = 'length'
+BINARY = 'binary'
+MODES = (LEGACY, LINE, LENGTH, BINARY)
+
+HELLO = b'framing='
+MAX_COMMAND = 1024          # Longer commands are dropped, so a bad client can not grow the buffer
+_LENGTH = struct.Struct('>H')
+
+def hello(mode):
+    '''What a client sends first to pick a framing mode'''
+    return HELLO + mode.encode() + b'\n'
+
+def encode(command, mode):
+    '''Frame one command (str or bytes) for sending'''
+    if isinstance(command, str):
+        command = command.encode()
+    if mode == LINE:
+        return command + b'\n'
+    if mode in (LENGTH, BINARY):
+        return _LENGTH.pack(len(command)) + command
+    return command
+
+class StreamParser(object):
+    '''Incremental parser: feed() it whatever recv() returned, get back the
+    list of complete commands. Partial commands wait for the next feed().
+    Commands are bytes, except in binary mode where they are already
+    decoded (opcode, args) tuples.'''
+
+    def __init__(self, mode=LEGACY):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}, not "{mode}"')
+        self.mode = mode
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._binary = protocol.BinaryParser() if mode == BINARY else None
+
+    def feed(self, data):
+        if self.mode == LEGACY:
+            if self._buffer:                # The start of a hello, waiting for its '\n'
+                self._buffer += data
+                data = bytes(self._buffer)
+                del self._buffer[:]
+            if not data.startswith(HELLO) and not (data and HELLO.startswith(data)):
+                return [bytes(data)] if data else []
+            end = data.find(b'\n')
+            if end < 0:
+                if len(data) > MAX_COMMAND:
+                    self.dropped += 1
+                else:
+                    self._buffer += data
+                return []
+            mode = bytes(data[len(HELLO):end]).decode(errors='replace').strip()
+            if mode not in MODES:
+                print('Framing Error! Unknown mode:', mode)
+                return []
+            self.mode = mode
+            data = data[end+1:]
+            if mode == BINARY:
+                self._binary = protocol.BinaryParser()
+        if self._binary is not None:
+            return self._binary.feed(data)
+        self._buffer += data
+        if self.mode == LINE:
+            return self._split_lines()
+        if self.mode == LENGTH:
+            return self._split_lengths()
+        commands = [bytes(self._buffer)] if self._buffer else []
+        del self._buffer[:]
+        return commands
+
+    def _split_lines(self):
+        buffer = self._buffer
+        commands = buffer.split(b'\n')
+        rest = commands.pop()
+        del buffer[:len(buffer) - len(rest)]
+        if len(buffer) > MAX_COMMAND:
+            self.dropped += 1
+            del buffer[:]
+        return [bytes(command.rstrip(b'\r')) for command in commands if command]
+
+    def _split_lengths(self):
+        buffer = self._buffer
+        commands = []
+        start = 0
+        end = len(buffer)
+        while end - start >= 2:
+            length, = _LENGTH.unpack_from(buffer, start)
+            if length > MAX_COMMAND:
+                self.dropped += 1
+                start = end
+                break
+            if end - start - 2 < length:
+                break
+            commands.append(bytes(buffer[start+2:start+2+length]))
+            start += 2 + length
+        del buffer[:start]
+        return commands
+
+def benchmark(count=200000, chunk=1460):
+    '''Commands per second through the parser, fed in TCP sized chunks'''
+    import random
+    import time
+    commands = [b'forward', b'speed50', b'turn=128', b'x+', b'stop', b'backward=60']
+    for mode in (LINE, LENGTH):
+        stream = b''.join(encode(random.choice(commands), mode) for _ in range(count))
+        parser = StreamParser(mode)
+        parsed = 0
+        start = time.perf_counter()
+        for i in range(0, len(stream), chunk):
+            parsed += len(parser.feed(stream[i:i+chunk]))
+        elapsed = time.perf_counter() - start
+        assert parsed == count
+        print(f'{mode:>6}: {count / elapsed:12,.0f} commands/s ({chunk} byte reads)')
+
+if __name__ == '__main__':
+    benchmark()
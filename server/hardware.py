@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : hardware.py
+* Description : Picks the smbus and GPIO implementation for the server
+*               SMARTCAR_BACKEND=pi  (default) real smbus and RPi.GPIO
+*               SMARTCAR_BACKEND=sim simulated PCA9685 and GPIO
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+import os
+
+BACKEND = os.environ.get('SMARTCAR_BACKEND', 'pi')
+
+if BACKEND == 'sim':
+    import sim_hw as smbus
+    from sim_hw import GPIO
+elif BACKEND == 'pi':
+    try:
+        import smbus
+    except ImportError:
+        smbus = None    # Only needed when PCA9685.PWM is not handed a bus object
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        GPIO = None     # Only needed by motor.py
+else:
+    raise ValueError(f'SMARTCAR_BACKEND must be "pi" or "sim", not "{BACKEND}"')
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : motion.py
+* Description : Fixed rate motion control loop with slew rate limited
+*               ramps for the motor speed and the steering servo
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Callers only set targets (motor.setSpeed, car_dir.turn, ... once
+attach() ran); the loop moves every channel towards its target at
+most `rate` counts per second and writes the channels whose value
+changed, once per tick.
+
+Profiles:
+  linear   constant slope towards the target
+  s-curve  the slope itself ramps with `accel`, so starts and stops are
+           smooth, and it slows down in time not to overshoot
+'''
+
+import math
+import os
+import threading
+import time
+
+LINEAR = 'linear'
+S_CURVE = 's-curve'
+PROFILES = (LINEAR, S_CURVE)
+
+RATE = 100                  # Ticks per second
+PROFILE = os.environ.get('SMARTCAR_MOTION', LINEAR)     # 'off' leaves the actuators to the callers
+
+SPEED_RATE = 8000           # Enable counts per second: 0 to full speed (4000) in 0.5 s
+SPEED_ACCEL = 40000         # Counts per second squared, s-curve only
+STEER_RATE = 700            # Steering counts per second: full lock to lock (100) in about 0.15 s
+STEER_ACCEL = 10000
+
+class Axis(object):
+    '''One ramped output value'''
+
+    def __init__(self, value, rate, accel=None, profile=LINEAR):
+        if profile not in PROFILES:
+            raise ValueError(f'profile must be one of {PROFILES}, not "{profile}"')
+        self.value = float(value)
+        self.target = float(value)
+        self.rate = rate
+        self.accel = accel
+        self.profile = profile
+        self.velocity = 0.0
+
+    def step(self, dt):
+        error = self.target - self.value
+        if not self.rate:
+            self.value = self.target
+        elif self.profile == LINEAR or not self.accel:
+            limit = self.rate * dt
+            self.value += max(-limit, min(limit, error))
+        else:
+            # Fastest velocity that can still stop on the target
+            stop = math.sqrt(2 * self.accel * abs(error))
+            desired = math.copysign(min(self.rate, stop), error)
+            change = self.accel * dt
+            self.velocity += max(-change, min(change, desired - self.velocity))
+            move = self.velocity * dt
+            if abs(move) >= abs(error) or abs(error) < 0.5:
+                self.value = self.target
+                self.velocity = 0.0
+            else:
+                self.value += move
+        return self.value
+
+    @property
+    def settled(self):
+        return self.value == self.target
+
+class MotionController(object):
+    '''Owns a set of PWM channels and writes them from one thread at a fixed rate'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "motion.py":'
+
+    def __init__(self, pwm, rate=RATE, jitter_samples=1000):
+        self.pwm = pwm
+        self.period = 1.0 / rate
+        self.axes = {}              # channel -> Axis
+        self._written = {}          # channel -> last written off count
+        self._lock = threading.Lock()
+        self._jitter = [0.0] * jitter_samples
+        self._running = False
+        self._thread = None
+        self.ticks = 0
+        self.writes = 0
+        self.overruns = 0
+
+    def add_channel(self, channel, value, rate, accel=None, profile=LINEAR):
+        with self._lock:
+            self.axes[channel] = Axis(value, rate, accel, profile)
+        self.pwm.write(channel, 0, int(round(value)))
+        self._written[channel] = int(round(value))
+
+    def set_target(self, channels, value):
+        '''Aim one channel, or a list of channels, at value'''
+        if isinstance(channels, int):
+            channels = (channels,)
+        with self._lock:
+            for channel in channels:
+                self.axes[channel].target = float(value)
+
+    def set_profile(self, profile, channels=None):
+        if profile not in PROFILES:
+            raise ValueError(f'profile must be one of {PROFILES}, not "{profile}"')
+        with self._lock:
+            for channel, axis in self.axes.items():
+                if channels is None or channel in channels:
+                    axis.profile = profile
+
+    def value(self, channel):
+        return self.axes[channel].value
+
+    def settled(self):
+        with self._lock:
+            return all(axis.settled for axis in self.axes.values())
+
+    def tick(self, dt):
+        '''Advance every axis by dt seconds and write what changed'''
+        changed = {}
+        with self._lock:
+            for channel, axis in self.axes.items():
+                off = int(round(axis.step(dt)))
+                if off != self._written.get(channel):
+                    changed[channel] = (0, off)
+                    self._written[channel] = off
+        if changed:
+            self.pwm.write_many(changed)
+            self.writes += len(changed)
+        self.ticks += 1
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='motion', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = self.period
+        deadline = time.monotonic() + period
+        last = time.monotonic()
+        while self._running:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            self._jitter[self.ticks % len(self._jitter)] = now - deadline
+            self.tick(now - last)
+            last = now
+            deadline += period
+            if now - deadline > period:         # Fell behind, do not try to catch up in a burst
+                self.overruns += 1
+                if self._DEBUG:
+                    print(self._DEBUG_INFO, f'Overrun by {(now - deadline) * 1000:.1f} ms')
+                deadline = now + period
+
+    def stats(self):
+        '''Tick count, channel writes and how late the ticks woke up, in seconds'''
+        n = min(self.ticks, len(self._jitter))
+        jitter = sorted(self._jitter[:n])
+        return {
+            'ticks': self.ticks,
+            'writes': self.writes,
+            'overruns': self.overruns,
+            'jitter_avg': sum(jitter) / n if n else 0.0,
+            'jitter_p99': jitter[int(n * 0.99)] if n else 0.0,
+            'jitter_max': jitter[-1] if n else 0.0,
+        }
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+def attach(motor, car_dir, rate=RATE, profile=PROFILE):
+    '''Put the motor enable channels and the steering servo under one
+    MotionController. motor.setSpeed() and car_dir's turns then only set
+    targets. Returns the controller, or None for profile 'off'.'''
+    if profile == 'off':
+        return None
+    controller = MotionController(motor.pwm, rate)
+    for channel in (motor.EN_M0, motor.EN_M1):
+        controller.add_channel(channel, 0, SPEED_RATE, SPEED_ACCEL, profile)
+    controller.add_channel(car_dir.STEERING, car_dir.homePWM, STEER_RATE, STEER_ACCEL, profile)
+    motor.motion = controller
+    car_dir.motion = controller
+    controller.start()
+    return controller
+
+def test():
+    '''Ramp the simulated car from stop to full speed and across the steering'''
+    os.environ['SMARTCAR_BACKEND'] = 'sim'
+    import sim_hw
+    import car_dir
+    import motor
+    car_dir.setup(busnum=1)
+    motor.setup(busnum=1)
+    for profile in PROFILES:
+        motor.motion = car_dir.motion = None
+        controller = attach(motor, car_dir, profile=profile)
+        start = time.monotonic()
+        motor.setSpeed(100)
+        car_dir.turn_right()
+        while not controller.settled():
+            time.sleep(0.01)
+        elapsed = time.monotonic() - start
+        controller.stop()
+        print(f'{profile:>8}: settled in {elapsed * 1000:.0f} ms, {sim_hw.state()}')
+        print(f'{"":>8}  {controller.stats()}')
+        motor.motion = car_dir.motion = None
+        motor.setSpeed(0)
+        car_dir.home()
+
+if __name__ == '__main__':
+    test()
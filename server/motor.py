@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
+from hardware import GPIO
 import PCA9685 as p
 import time    # Import necessary modules
+import car_config
 
 # ===========================================================================
 # Raspberry Pi pin11, 12, 13 and 15 to realize the clockwise/counterclockwise
@@ -21,62 +22,70 @@ EN_M1    = 5  # servo driver IC CH5
 
 pins = [Motor0_A, Motor0_B, Motor1_A, Motor1_B]
 
+_DEBUG = False
+_DEBUG_INFO = 'DEBUG "motor.py":'
+
+trace = None    # A pwm_trace.TraceRecorder, gets every direction pin change
+motion = None   # A motion.MotionController ramping the speed, see motion.attach()
+
+def output(pin, level):
+    GPIO.output(pin, level)
+    if trace is not None:
+        trace.record_pin(pin, level)
+
 def setSpeed(speed):
     speed *= 40
-    print('speed is: ', speed)
+    if _DEBUG:
+        print(_DEBUG_INFO, 'speed is: ', speed)
+    if motion is not None:
+        motion.set_target((EN_M0, EN_M1), speed)
+        return
     pwm.write(EN_M0, 0, speed)
     pwm.write(EN_M1, 0, speed)
 
 def setup(busnum=None):
-    global forward0, forward1, backward1, backward0
     global pwm
+    if GPIO is None:
+        raise ImportError('RPi.GPIO is not installed, install it or set SMARTCAR_BACKEND=sim')
     if busnum == None:
-        pwm = p.PWM()                  # Initialize the servo controller.
+        pwm = p.get_pwm()                  # Shared servo controller, initialized once.
     else:
-        pwm = p.PWM(bus_number=busnum) # Initialize the servo controller.
+        pwm = p.get_pwm(bus_number=busnum) # Shared servo controller, initialized once.
 
     pwm.frequency = 60
-    forward0 = 'True'
-    forward1 = 'True'
     GPIO.setwarnings(False)
     GPIO.setmode(GPIO.BOARD)        # Number GPIOs by its physical location
-    try:
-        with open("config") as f:
-            for line in f:
-                if line[0:8] == "forward0":
-                    forward0 = line[11:-1]
-                if line[0:8] == "forward1":
-                    forward1 = line[11:-1]
-    except:
-        pass
-    if forward0 == 'True':
-        backward0 = 'False'
-    elif forward0 == 'False':
-        backward0 = 'True'
-    if forward1 == 'True':
-        backward1 = 'False'
-    elif forward1 == 'False':
-        backward1 = 'True'
+    config = car_config.get()
+    recalibrate(config)
+    config.subscribe(recalibrate)   # Follow later direction changes without another setup()
     for pin in pins:
         GPIO.setup(pin, GPIO.OUT)   # Set all pins' mode as output
 
+def recalibrate(config, changed=None):
+    '''Motor directions from the config, as the 'True'/'False' motor0()/motor1() take'''
+    global forward0, forward1, backward1, backward0
+    forward0 = str(config.forward0)
+    forward1 = str(config.forward1)
+    backward0 = str(not config.forward0)
+    backward1 = str(not config.forward1)
+
 def motor0(x):
     if x == 'True':
-        GPIO.output(Motor0_A, GPIO.LOW)
-        GPIO.output(Motor0_B, GPIO.HIGH)
+        output(Motor0_A, GPIO.LOW)
+        output(Motor0_B, GPIO.HIGH)
     elif x == 'False':
-        GPIO.output(Motor0_A, GPIO.HIGH)
-        GPIO.output(Motor0_B, GPIO.LOW)
+        output(Motor0_A, GPIO.HIGH)
+        output(Motor0_B, GPIO.LOW)
     else:
         print('Config Error')
 
 def motor1(x):
     if x == 'True':
-        GPIO.output(Motor1_A, GPIO.LOW)
-        GPIO.output(Motor1_B, GPIO.HIGH)
+        output(Motor1_A, GPIO.LOW)
+        output(Motor1_B, GPIO.HIGH)
     elif x == 'False':
-        GPIO.output(Motor1_A, GPIO.HIGH)
-        GPIO.output(Motor1_B, GPIO.LOW)
+        output(Motor1_A, GPIO.HIGH)
+        output(Motor1_B, GPIO.LOW)
 
 def forward():
     motor0(forward0)
@@ -98,7 +107,7 @@ def backwardWithSpeed(spd = 50):
 
 def stop():
     for pin in pins:
-        GPIO.output(pin, GPIO.LOW)
+        output(pin, GPIO.LOW)
 
 def ctrl(status, direction=1):
     if status == 1:   # Run
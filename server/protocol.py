@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : protocol.py
+* Description : Opcodes, binary packets and the dispatch table shared
+*               by tcp_server.py and cali_server.py
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Binary packet, version 1:
+  byte 0   VERSION
+  byte 1   opcode
+  byte 2-  fixed width arguments of the opcode, little endian, see FORMATS
+
+The text commands of the old clients are parsed into the same
+(opcode, args) pairs, so both protocols end up in the same handler.
+'''
+
+import struct
+
+VERSION = 1
+
+# Drive, tcp_server.py
+FORWARD         = 0x01
+BACKWARD        = 0x02
+LEFT            = 0x03
+RIGHT           = 0x04
+STOP            = 0x05
+HOME            = 0x06
+X_INCREASE      = 0x07
+X_DECREASE      = 0x08
+Y_INCREASE      = 0x09
+Y_DECREASE      = 0x0A
+XY_HOME         = 0x0B
+SPEED           = 0x0C      # speed 0-100
+TURN            = 0x0D      # angle 0-255
+FORWARD_SPEED   = 0x0E      # speed 0-100
+BACKWARD_SPEED  = 0x0F      # speed 0-100
+DRIVE           = 0x10      # throttle -100-100 (0 stops), angle 0-255
+CPU_TEMP        = 0x11
+DISTANCE        = 0x12
+STATUS          = 0x13
+HEARTBEAT       = 0x14
+
+# Calibration, cali_server.py
+MOTOR_RUN       = 0x40
+MOTOR_STOP      = 0x41
+LEFT_MOTOR      = 0x42      # forward direction, 0 or 1
+RIGHT_MOTOR     = 0x43      # forward direction, 0 or 1
+LEFT_REVERSE    = 0x44
+RIGHT_REVERSE   = 0x45
+OFFSET          = 0x46      # steering offset
+OFFSET_X        = 0x47      # pan offset
+OFFSET_Y        = 0x48      # tilt offset
+OFFSET_ADD      = 0x49      # change of steering offset
+OFFSET_X_ADD    = 0x4A      # change of pan offset
+OFFSET_Y_ADD    = 0x4B      # change of tilt offset
+CONFIRM         = 0x4C
+
+_NO_ARGS = struct.Struct('<')
+FORMATS = [_NO_ARGS] * 256
+for _opcode in (SPEED, TURN, FORWARD_SPEED, BACKWARD_SPEED, LEFT_MOTOR, RIGHT_MOTOR):
+    FORMATS[_opcode] = struct.Struct('<B')
+for _opcode in (OFFSET, OFFSET_X, OFFSET_Y, OFFSET_ADD, OFFSET_X_ADD, OFFSET_Y_ADD):
+    FORMATS[_opcode] = struct.Struct('<h')
+FORMATS[DRIVE] = struct.Struct('<bB')
+
+# Text front end: whole commands, and commands followed by a number
+TEXT_COMMANDS = {
+    'forward':          FORWARD,
+    'backward':         BACKWARD,
+    'left':             LEFT,
+    'right':            RIGHT,
+    'stop':             STOP,
+    'home':             HOME,
+    'x+':               X_INCREASE,
+    'x-':               X_DECREASE,
+    'y+':               Y_INCREASE,
+    'y-':               Y_DECREASE,
+    'xy_home':          XY_HOME,
+    'read cpu_temp':    CPU_TEMP,
+    'distance':         DISTANCE,
+    'status':           STATUS,
+    'ping':             HEARTBEAT,
+    'motor_run':        MOTOR_RUN,
+    'motor_stop':       MOTOR_STOP,
+    'leftreverse':      LEFT_REVERSE,
+    'rightreverse':     RIGHT_REVERSE,
+    'confirm':          CONFIRM,
+}
+
+def _int(text):
+    return (int(text),)
+
+def _negative(text):
+    return (-int(text),)
+
+def _direction(text):
+    return (1 if text == 'True' else 0,)
+
+def _ints(text):
+    return tuple(int(value) for value in text.split(','))
+
+TEXT_PREFIXES = {
+    'speed':        (SPEED, _int),
+    'turn=':        (TURN, _int),
+    'forward=':     (FORWARD_SPEED, _int),
+    'backward=':    (BACKWARD_SPEED, _int),
+    'drive=':       (DRIVE, _ints),         # drive=<throttle>,<angle>
+    'leftmotor':    (LEFT_MOTOR, _direction),
+    'rightmotor':   (RIGHT_MOTOR, _direction),
+    'offset=':      (OFFSET, _int),
+    'offsetx=':     (OFFSET_X, _int),
+    'offsety=':     (OFFSET_Y, _int),
+    'offset+':      (OFFSET_ADD, _int),
+    'offset-':      (OFFSET_ADD, _negative),
+    'offsetx+':     (OFFSET_X_ADD, _int),
+    'offsetx-':     (OFFSET_X_ADD, _negative),
+    'offsety+':     (OFFSET_Y_ADD, _int),
+    'offsety-':     (OFFSET_Y_ADD, _negative),
+}
+_PREFIX_LENGTHS = sorted(set(len(prefix) for prefix in TEXT_PREFIXES), reverse=True)
+
+def parse_text(data):
+    '''Map a text command onto (opcode, args), or None if unknown or bad'''
+    opcode = TEXT_COMMANDS.get(data)
+    if opcode is not None:
+        return opcode, ()
+    for length in _PREFIX_LENGTHS:
+        entry = TEXT_PREFIXES.get(data[:length])
+        if entry is not None:
+            try:
+                return entry[0], entry[1](data[length:])
+            except ValueError:
+                return None
+    return None
+
+_TEXT_NAMES = {opcode: text for text, opcode in TEXT_COMMANDS.items()}
+for _prefix, (_opcode, _convert) in TEXT_PREFIXES.items():
+    if _convert is not _negative:
+        _TEXT_NAMES.setdefault(_opcode, _prefix)
+
+def format_text(opcode, args=()):
+    '''The text command for (opcode, args), e.g. to echo it to observers'''
+    name = _TEXT_NAMES.get(opcode, f'0x{opcode:02X}')
+    if opcode in (LEFT_MOTOR, RIGHT_MOTOR):
+        args = ('True' if args[0] else 'False',)
+    return name + ','.join(str(arg) for arg in args)
+
+def pack(opcode, *args):
+    '''Build a binary packet'''
+    return bytes((VERSION, opcode)) + FORMATS[opcode].pack(*args)
+
+class BinaryParser(object):
+    '''Incremental parser for binary packets. feed() returns a list of
+    (opcode, args); arguments are unpacked straight out of the received
+    data, only an incomplete tail is kept for the next feed().'''
+
+    def __init__(self):
+        self.errors = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        if self._buffer:
+            self._buffer += data
+            view = memoryview(self._buffer)
+        else:
+            view = memoryview(data)
+        packets = []
+        start = 0
+        end = len(view)
+        while end - start >= 2:
+            if view[start] != VERSION:
+                self.errors += 1        # Out of step, resync on the next version byte
+                start += 1
+                continue
+            opcode = view[start+1]
+            fmt = FORMATS[opcode]
+            if end - start - 2 < fmt.size:
+                break
+            packets.append((opcode, fmt.unpack_from(view, start+2)))
+            start += 2 + fmt.size
+        rest = bytes(view[start:])
+        view.release()
+        self._buffer = bytearray(rest)
+        return packets
+
+class Dispatcher(object):
+    '''O(1) opcode -> handler table. A handler takes the opcode's arguments
+    and returns the text to send back, or None.'''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "protocol.py":'
+
+    def __init__(self):
+        self.handlers = [None] * 256
+        self.unknown = 0
+
+    def register(self, opcode, handler):
+        self.handlers[opcode] = handler
+
+    def dispatch(self, opcode, args=()):
+        handler = self.handlers[opcode]
+        if handler is None:
+            self.unknown += 1
+            if self._DEBUG:
+                print(self._DEBUG_INFO, f'No handler for opcode 0x{opcode:02X}')
+            return None
+        if self._DEBUG:
+            print(self._DEBUG_INFO, f'opcode 0x{opcode:02X} {args}')
+        return handler(*args)
+
+    def dispatch_text(self, data):
+        command = parse_text(data)
+        if command is None:
+            self.unknown += 1
+            print('Command Error! Cannot recognize command:', data)
+            return None
+        return self.dispatch(*command)
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+def benchmark(count=200000):
+    '''Packets per second through the binary parser and the text front end'''
+    import time
+    dispatcher = Dispatcher()
+    dispatcher.register(DRIVE, lambda throttle, angle: None)
+    dispatcher.register(TURN, lambda angle: None)
+    stream = b''.join(pack(DRIVE, 50, i & 0xFF) for i in range(count))
+    parser = BinaryParser()
+    start = time.perf_counter()
+    for i in range(0, len(stream), 1460):
+        for opcode, args in parser.feed(stream[i:i+1460]):
+            dispatcher.dispatch(opcode, args)
+    elapsed = time.perf_counter() - start
+    print(f'binary: {count / elapsed:12,.0f} packets/s')
+    texts = ['turn=%d' % (i & 0xFF) for i in range(count)]
+    start = time.perf_counter()
+    for text in texts:
+        dispatcher.dispatch_text(text)
+    elapsed = time.perf_counter() - start
+    print(f'  text: {count / elapsed:12,.0f} commands/s')
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : pwm_trace.py
+* Description : Timestamped trace of PWM channel and motor pin changes,
+*               with dump to file and replay
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+import struct
+import threading
+import time
+from array import array
+import protocol
+
+PWM = 0             # ident = channel, value = on << 16 | off
+PIN = 1             # ident = GPIO pin, value = level
+MARK = 2            # ident = mark code, e.g. a received command
+ALL_CHANNELS = 0xFFFF
+CHANNELS = 16
+
+STEERING_CHANNELS = ((PWM, 0),)
+PAN_TILT_CHANNELS = ((PWM, 14), (PWM, 15))
+SPEED_CHANNELS = ((PWM, 4), (PWM, 5))
+DIRECTION_PINS = ((PIN, 11), (PIN, 12), (PIN, 13), (PIN, 15))
+
+# (kind, ident) of the channels each tcp_server.py command writes, by opcode
+COMMAND_CHANNELS = {
+    protocol.FORWARD:           DIRECTION_PINS,
+    protocol.BACKWARD:          DIRECTION_PINS,
+    protocol.STOP:              DIRECTION_PINS,
+    protocol.LEFT:              STEERING_CHANNELS,
+    protocol.RIGHT:             STEERING_CHANNELS,
+    protocol.HOME:              STEERING_CHANNELS,
+    protocol.TURN:              STEERING_CHANNELS,
+    protocol.X_INCREASE:        PAN_TILT_CHANNELS,
+    protocol.X_DECREASE:        PAN_TILT_CHANNELS,
+    protocol.Y_INCREASE:        PAN_TILT_CHANNELS,
+    protocol.Y_DECREASE:        PAN_TILT_CHANNELS,
+    protocol.XY_HOME:           PAN_TILT_CHANNELS,
+    protocol.SPEED:             SPEED_CHANNELS,
+    protocol.FORWARD_SPEED:     SPEED_CHANNELS + DIRECTION_PINS,
+    protocol.BACKWARD_SPEED:    SPEED_CHANNELS + DIRECTION_PINS,
+    protocol.DRIVE:             STEERING_CHANNELS + SPEED_CHANNELS + DIRECTION_PINS,
+    protocol.CPU_TEMP:          (),
+    protocol.STATUS:            (),
+    protocol.HEARTBEAT:         (),
+}
+
+_MAGIC = b'SCTR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+
+class TraceRecorder(object):
+    '''Ring buffer of (time, kind, ident, value) events kept in flat arrays.
+
+    Times come from time.monotonic(). Once full, the oldest events are
+    overwritten; `recorded` counts every event ever seen.
+    '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.kinds = array('B', bytes(capacity))
+        self.idents = array('H', bytes(2 * capacity))
+        self.values = array('I', bytes(4 * capacity))
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, ident, value):
+        with self._lock:
+            i = self.recorded % self.capacity
+            self.times[i] = time.monotonic()
+            self.kinds[i] = kind
+            self.idents[i] = ident
+            self.values[i] = value
+            self.recorded += 1
+
+    def record_pwm(self, channel, on, off):
+        self.record(PWM, channel, (int(on) & 0xFFFF) << 16 | (int(off) & 0xFFFF))
+
+    def record_pin(self, pin, level):
+        self.record(PIN, pin, 1 if level else 0)
+
+    def mark(self, code=0):
+        '''Put a marker in the trace, e.g. when a command arrives'''
+        self.record(MARK, code, 0)
+
+    def __len__(self):
+        return min(self.recorded, self.capacity)
+
+    def _order(self):
+        '''Indices of the kept events, oldest first'''
+        if self.recorded <= self.capacity:
+            return range(self.recorded)
+        start = self.recorded % self.capacity
+        return list(range(start, self.capacity)) + list(range(start))
+
+    def events(self):
+        '''Kept events as (time, kind, ident, value), oldest first'''
+        with self._lock:
+            return [(self.times[i], self.kinds[i], self.idents[i], self.values[i]) for i in self._order()]
+
+    def clear(self):
+        with self._lock:
+            self.recorded = 0
+
+    def dump(self, path):
+        '''Write the kept events to a binary file'''
+        with self._lock:
+            order = self._order()
+            n = len(order)
+            columns = []
+            for column in (self.times, self.kinds, self.idents, self.values):
+                if self.recorded <= self.capacity:
+                    data = column[:n]
+                else:
+                    start = self.recorded % self.capacity
+                    data = column[start:] + column[:start]
+                columns.append(data.tobytes())
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, n))
+            for data in columns:
+                f.write(data)
+
+    @classmethod
+    def load(cls, path):
+        '''Read a file written by dump()'''
+        with open(path, 'rb') as f:
+            magic, version, n = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f'{path} is not a version {_VERSION} trace file')
+            trace = cls(capacity=max(n, 1))
+            for column in (trace.times, trace.kinds, trace.idents, trace.values):
+                column[:n] = array(column.typecode, f.read(column.itemsize * n))
+            trace.recorded = n
+        return trace
+
+    def replay(self, pwm=None, gpio=None, speed=1.0):
+        '''Apply the trace to a PCA9685.PWM and/or GPIO module, keeping the
+        recorded timing divided by speed (0 replays as fast as possible)'''
+        events = self.events()
+        if not events:
+            return
+        t0 = events[0][0]
+        start = time.monotonic()
+        for t, kind, ident, value in events:
+            if speed:
+                delay = (t - t0) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == PWM and pwm is not None:
+                on, off = value >> 16, value & 0xFFFF
+                if ident == ALL_CHANNELS:
+                    pwm.write_all_value(on, off)
+                else:
+                    pwm.write(ident, on, off)
+            elif kind == PIN and gpio is not None:
+                gpio.output(ident, gpio.HIGH if value else gpio.LOW)
+
+    def latencies(self, code=None, channels=COMMAND_CHANNELS):
+        '''Seconds from each mark (of the given code) to the first event that
+        gives one of its command's channels a new value.
+
+        channels maps a mark code to the (kind, ident) pairs its command
+        writes; a code not in it may change any channel. Marks of commands
+        that write nothing are skipped, and so is a mark whose channels get
+        a later mark before they change: that command changed nothing.
+        '''
+        result = []
+        pending = []            # (mark time, frozenset of channels or None for all)
+        values = {}             # (kind, ident) -> last value
+        for t, kind, ident, value in self.events():
+            if kind == MARK:
+                touched = channels.get(ident)
+                if touched is not None:
+                    touched = frozenset(touched)
+                pending = [(m, c) for m, c in pending
+                           if c is not None and touched is not None and not c & touched]
+                if (code is None or ident == code) and touched != frozenset():
+                    pending.append((t, touched))
+                continue
+            if kind == PWM and ident == ALL_CHANNELS:
+                keys = [(PWM, channel) for channel in range(CHANNELS)]
+            else:
+                keys = [(kind, ident)]
+            changed = frozenset(key for key in keys if values.get(key) != value)
+            for key in keys:
+                values[key] = value
+            if not changed or not pending:
+                continue
+            waiting = []
+            for m, c in pending:
+                if c is None or c & changed:
+                    result.append(t - m)
+                else:
+                    waiting.append((m, c))
+            pending = waiting
+        return result
+
+def install(recorder, *modules):
+    '''Trace every PCA9685.PWM write and the pins of motor-like modules'''
+    import PCA9685
+    PCA9685.PWM.trace = recorder
+    for module in modules:
+        module.trace = recorder
+
+def uninstall(*modules):
+    import PCA9685
+    PCA9685.PWM.trace = None
+    for module in modules:
+        module.trace = None
+
+def summary(recorder):
+    counts = {PWM: 0, PIN: 0, MARK: 0}
+    for _, kind, _, _ in recorder.events():
+        counts[kind] += 1
+    print(f'{len(recorder)} event(s): {counts[PWM]} pwm, {counts[PIN]} pin, {counts[MARK]} mark')
+    latencies = sorted(recorder.latencies())
+    if latencies:
+        print('command to actuation: min %.3f ms, median %.3f ms, max %.3f ms' % (
+            latencies[0] * 1000, latencies[len(latencies)//2] * 1000, latencies[-1] * 1000))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] not in ('show', 'replay'):
+        print(f'Usage: {sys.argv[0]} show|replay <trace file> [speed]')
+        sys.exit(1)
+    recorder = TraceRecorder.load(sys.argv[2])
+    summary(recorder)
+    if sys.argv[1] == 'replay':
+        import PCA9685
+        from hardware import GPIO
+        import motor
+        motor.setup()
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        recorder.replay(PCA9685.get_pwm(), GPIO, speed)
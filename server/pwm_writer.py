@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : pwm_writer.py
+* Description : A coalescing background I2C writer for PCA9685.PWM
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+import threading
+import time
+
+class PWMWriter(object):
+    '''Queue channel values and write them to a PWM from one background thread.
+
+    write() and write_many() take the same arguments as PCA9685.PWM and return
+    at once. Pending values of the same channel collapse to the latest one, and
+    the thread sends at most one write_many() batch per tick.
+
+    If a batch fails, the thread records the exception in `error` and stops.
+    The next write(), write_many() or flush() raises it.
+    '''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "pwm_writer.py":'
+
+    def __init__(self, pwm, tick=0.01):
+        self.pwm = pwm
+        self.tick = tick
+        self._pending = {}          # channel -> (on, off, time queued)
+        self._cond = threading.Condition()
+        self._queued = 0            # sequence number of the last queued value
+        self._applied = 0           # sequence number of the last written batch
+        self._running = True
+        self.error = None           # What killed the thread, raised to the callers
+        self._reset_stats()
+        self._thread = threading.Thread(target=self._run, name='pwm writer', daemon=True)
+        self._thread.start()
+
+    def _reset_stats(self):
+        self.queued_values = 0
+        self.coalesced_values = 0
+        self.batches = 0
+        self.max_depth = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._latency_count = 0
+
+    def write(self, channel, on, off):
+        '''Queue on and off value of a channel'''
+        self.write_many({channel: (on, off)})
+
+    def write_many(self, values):
+        '''Queue on and off values of several channels, given as {channel: (on, off)}'''
+        now = time.monotonic()
+        with self._cond:
+            if self.error is not None:
+                raise self.error
+            for channel, (on, off) in values.items():
+                if channel in self._pending:
+                    self.coalesced_values += 1
+                self._pending[channel] = (on, off, now)
+                self.queued_values += 1
+            self._queued += 1
+            self.max_depth = max(self.max_depth, len(self._pending))
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        '''Block until everything queued so far is on the chip.
+        Return False if the timeout runs out first.'''
+        with self._cond:
+            target = self._queued
+            done = self._cond.wait_for(lambda: self._applied >= target or not self._running, timeout)
+            if self.error is not None:
+                raise self.error
+            return done
+
+    @property
+    def frequency(self):
+        return self.pwm.frequency
+
+    @frequency.setter
+    def frequency(self, freq):
+        self.flush()
+        self.pwm.frequency = freq
+
+    def stop(self):
+        '''Write what is still pending and stop the thread'''
+        if self.error is None:
+            self.flush()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+                batch = self._pending
+                self._pending = {}
+                target = self._queued
+            try:
+                self.pwm.write_many({channel: (on, off) for channel, (on, off, _) in batch.items()})
+            except BaseException as e:      # Including the SystemExit of PCA9685's I2C check
+                with self._cond:
+                    self.error = e
+                    self._running = False
+                    self._cond.notify_all()
+                if self._DEBUG:
+                    print(self._DEBUG_INFO, f'Write failed, stopping: {e!r}')
+                return
+            done = time.monotonic()
+            with self._cond:
+                for _, _, queued in batch.values():
+                    latency = done - queued
+                    self._latency_sum += latency
+                    self._latency_max = max(self._latency_max, latency)
+                    self._latency_count += 1
+                self.batches += 1
+                self._applied = target
+                self._cond.notify_all()
+            if self._DEBUG:
+                print(self._DEBUG_INFO, f'Wrote {len(batch)} channel(s)')
+            if self.tick:
+                time.sleep(self.tick)
+
+    def stats(self, reset=False):
+        '''Counters, queue depth and queue-to-chip latency in seconds'''
+        with self._cond:
+            count = self._latency_count
+            stats = {
+                'queued': self.queued_values,
+                'coalesced': self.coalesced_values,
+                'batches': self.batches,
+                'depth': len(self._pending),
+                'max_depth': self.max_depth,
+                'latency_avg': self._latency_sum / count if count else 0.0,
+                'latency_max': self._latency_max,
+            }
+            if reset:
+                self._reset_stats()
+        return stats
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+_writers = {}
+
+def attach(*modules):
+    '''Swap the pwm of driver modules (car_dir, video_dir, motor) for a
+    PWMWriter. Modules sharing one PWM object share one writer.'''
+    for module in modules:
+        pwm = module.pwm
+        if isinstance(pwm, PWMWriter):
+            continue
+        if id(pwm) not in _writers:
+            _writers[id(pwm)] = PWMWriter(pwm)
+        module.pwm = _writers[id(pwm)]
+    return list(_writers.values())
+
+def flush(timeout=None):
+    '''Barrier on every attached writer'''
+    return all([writer.flush(timeout) for writer in _writers.values()])
+
+def test():
+    import fake_smbus
+    import PCA9685
+    bus = fake_smbus.SMBus(1)
+    writer = PWMWriter(PCA9685.PWM(bus_number=1, bus=bus))
+    bus.reset()
+    for angle in range(200):
+        writer.write(0, 0, 400 + angle % 100)
+    writer.flush()
+    print(f'200 steering values -> {bus.count()} transaction(s)')
+    print(writer.stats())
+    writer.stop()
+
+if __name__ == '__main__':
+    test()
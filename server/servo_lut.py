@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : servo_lut.py
+* Description : Precomputed input -> PCA9685 OFF count tables for the
+*               servos, with calibration and limits baked in
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+class ServoLUT(object):
+    '''Integer table from an input value (0-255 steering, a camera count, ...)
+    to the OFF count to write. The linear map from [in_min, in_max] onto
+    [out_min, out_max] and the clamping to `limits` happen once, in update();
+    a lookup is an index into a list. Counts are truncated with int(), as
+    PCA9685.write() truncated the float Map() gave it. Inputs outside
+    [in_min, in_max] are clamped too, so nothing out of limits ever reaches
+    the chip.'''
+
+    def __init__(self, in_min, in_max, out_min, out_max, limits=None):
+        self.in_min = in_min
+        self.in_max = in_max
+        self._last = in_max - in_min
+        self.table = []
+        self._key = None
+        self.builds = 0
+        self.update(out_min, out_max, limits)
+
+    def update(self, out_min, out_max, limits=None):
+        '''New calibration; the table is only rebuilt if something changed'''
+        if limits is None:
+            limits = (min(out_min, out_max), max(out_min, out_max))
+        key = (out_min, out_max, tuple(limits))
+        if key == self._key:
+            return False
+        self._key = key
+        lo, hi = limits
+        span = self.in_max - self.in_min
+        self.table = [min(max(int(x * (out_max - out_min) / span + out_min), lo), hi)
+                      for x in range(span + 1)]
+        self.builds += 1
+        return True
+
+    @property
+    def limits(self):
+        return self._key[2]
+
+    def __getitem__(self, value):
+        i = value - self.in_min
+        if 0 <= i <= self._last:
+            try:
+                return self.table[i]
+            except TypeError:       # A float input
+                return self.table[int(i)]
+        return self.table[0 if i < 0 else self._last]
+
+    def __len__(self):
+        return len(self.table)
+
+def benchmark(count=200000):
+    '''Lookups per second against the float Map() they replace'''
+    import time
+    def Map(x, in_min, in_max, out_min, out_max):
+        return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    lut = ServoLUT(0, 255, 400, 500)
+    angles = [i & 0xFF for i in range(count)]
+    start = time.perf_counter()
+    for angle in angles:
+        Map(angle, 0, 255, 400, 500)
+    mapped = time.perf_counter() - start
+    start = time.perf_counter()
+    for angle in angles:
+        lut[angle]
+    looked_up = time.perf_counter() - start
+    print(f'   Map(): {count / mapped:12,.0f} /s')
+    print(f'lookup(): {count / looked_up:12,.0f} /s')
+
+if __name__ == '__main__':
+    benchmark()
@@ -7,7 +7,7 @@ MaxPulse = 700
 
 def setup():
     global pwm
-    pwm = servo.PWM()
+    pwm = servo.get_pwm()
 
 def servo_test():
     for value in range(MinPulse, MaxPulse):
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : sim_hw.py
+* Description : Simulated PCA9685 and RPi.GPIO, used when
+*               SMARTCAR_BACKEND=sim (see hardware.py)
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+import collections
+import os
+import time
+import threading
+import fake_smbus
+
+TRANSACTION_LOG = 1000      # Transactions an SMBus keeps; counts cover all of them
+
+class PCA9685Model(object):
+    '''Register level model of a PCA9685.
+
+    Writes are decoded the way the chip does it: block writes only advance
+    the register with MODE1 auto-increment on, ALL_LED registers load every
+    channel, PRESCALE only changes while SLEEP is set, and RESTART reads
+    back as 0.
+    '''
+    OSC_CLOCK = 25000000.0
+    _MODE1      = 0x00
+    _PRESCALE   = 0xFE
+    _LED0_ON_L  = 0x06
+    _ALL_LED_ON_L = 0xFA
+    _RESTART    = 0x80
+    _AI         = 0x20
+    _SLEEP      = 0x10
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.registers[self._MODE1] = 0x11      # Power-on: SLEEP | ALLCALL
+        self.registers[self._PRESCALE] = 0x1E   # Power-on: 200 Hz
+
+    def write(self, reg, data):
+        auto_increment = self.registers[self._MODE1] & self._AI
+        for value in data:
+            self._write_register(reg, value & 0xFF)
+            if auto_increment:
+                reg = (reg + 1) & 0xFF
+
+    def _write_register(self, reg, value):
+        if reg == self._PRESCALE and not self.registers[self._MODE1] & self._SLEEP:
+            return
+        if reg == self._MODE1:
+            value &= ~self._RESTART
+        if self._ALL_LED_ON_L <= reg <= self._ALL_LED_ON_L + 3:
+            for channel in range(16):
+                self.registers[self._LED0_ON_L + 4*channel + reg - self._ALL_LED_ON_L] = value
+        self.registers[reg] = value
+
+    def read(self, reg, length=1):
+        if not self.registers[self._MODE1] & self._AI:
+            return [self.registers[reg]] * length
+        return [self.registers[(reg + i) & 0xFF] for i in range(length)]
+
+    @property
+    def frequency(self):
+        return self.OSC_CLOCK / 4096 / (self.registers[self._PRESCALE] + 1)
+
+    @property
+    def sleeping(self):
+        return bool(self.registers[self._MODE1] & self._SLEEP)
+
+    def channel(self, channel):
+        '''Raw (on, off) counts of a channel'''
+        r = self.registers
+        base = self._LED0_ON_L + 4*channel
+        return ((r[base+1] << 8) | r[base], (r[base+3] << 8) | r[base+2])
+
+    def duty(self, channel):
+        '''High time of a channel as a fraction of the period'''
+        if self.sleeping:
+            return 0.0
+        on, off = self.channel(channel)
+        if off & 0x1000:            # Full off wins over full on
+            return 0.0
+        if on & 0x1000:
+            return 1.0
+        return ((off - on) % 4096) / 4096.0
+
+    def pulse_width(self, channel):
+        '''High time of a channel in microseconds'''
+        return self.duty(channel) / self.frequency * 1000000
+
+    def pulse_widths(self):
+        return [self.pulse_width(channel) for channel in range(16)]
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+def device(bus, address=0x40):
+    '''The simulated chip at (bus, address), shared by every SMBus of this process'''
+    with _devices_lock:
+        if (bus, address) not in _devices:
+            _devices[(bus, address)] = PCA9685Model()
+        return _devices[(bus, address)]
+
+class SMBus(fake_smbus.SMBus):
+    '''smbus.SMBus talking to simulated PCA9685 chips.
+    SMARTCAR_SIM_I2C_DELAY adds a per-transaction bus time in seconds.
+    Only the last TRANSACTION_LOG transactions are kept, so a soak run does
+    not grow; count() counts them all.'''
+    transaction_time = float(os.environ.get('SMARTCAR_SIM_I2C_DELAY', 0))
+
+    def __init__(self, bus=None):
+        fake_smbus.SMBus.__init__(self, bus)
+        self.reset()
+
+    def _record(self, *transaction):
+        self.transactions.append(transaction)
+        self.counts[transaction[0]] += 1
+
+    def count(self, name=None):
+        if name is None:
+            return sum(self.counts.values())
+        return self.counts[name]
+
+    def reset(self):
+        self.transactions = collections.deque(maxlen=TRANSACTION_LOG)
+        self.counts = collections.Counter()
+
+    def _transfer(self):
+        if self.transaction_time:
+            time.sleep(self.transaction_time)
+
+    def write_byte_data(self, address, reg, value):
+        self._record('write_byte_data', address, reg, value)
+        self._transfer()
+        device(self.bus, address).write(reg, [value])
+
+    def read_byte_data(self, address, reg):
+        self._record('read_byte_data', address, reg, None)
+        self._transfer()
+        return device(self.bus, address).read(reg)[0]
+
+    def write_i2c_block_data(self, address, reg, data):
+        data = list(data)
+        self._record('write_i2c_block_data', address, reg, data)
+        self._transfer()
+        device(self.bus, address).write(reg, data)
+
+    def read_i2c_block_data(self, address, reg, length=32):
+        self._record('read_i2c_block_data', address, reg, length)
+        self._transfer()
+        return device(self.bus, address).read(reg, length)
+
+class _GPIO(object):
+    '''The parts of RPi.GPIO the car uses, keeping pin levels in memory'''
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.listeners = []
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, initial=LOW):
+        if self.mode is None:
+            raise RuntimeError('Please set pin numbering mode using GPIO.setmode(GPIO.BOARD) or GPIO.setmode(GPIO.BCM)')
+        self.directions[pin] = direction
+        self.levels.setdefault(pin, initial)
+
+    def output(self, pin, value):
+        if self.directions.get(pin) != self.OUT:
+            raise RuntimeError(f'The GPIO channel {pin} has not been set up as an OUTPUT')
+        self.levels[pin] = 1 if value else 0
+        for listener in self.listeners:
+            listener(pin, self.levels[pin])
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def cleanup(self):
+        self.directions = {}
+        self.levels = {}
+
+GPIO = _GPIO()
+
+def state(bus=1, address=0x40, pins=(11, 12, 13, 15)):
+    '''Readable snapshot of the simulated car: pulse widths and motor pins'''
+    chip = device(bus, address)
+    return {
+        'frequency': round(chip.frequency, 2),
+        'steering_us': round(chip.pulse_width(0), 1),
+        'motor_enable_duty': (round(chip.duty(4), 3), round(chip.duty(5), 3)),
+        'pan_us': round(chip.pulse_width(14), 1),
+        'tilt_us': round(chip.pulse_width(15), 1),
+        'pins': {pin: GPIO.input(pin) for pin in pins},
+    }
+
+def test():
+    os.environ['SMARTCAR_BACKEND'] = 'sim'
+    import sim_hw       # The instance hardware.py uses, not __main__
+    import car_dir
+    import video_dir
+    import motor
+    car_dir.setup(busnum=1)
+    video_dir.setup(busnum=1)
+    motor.setup(busnum=1)
+    car_dir.home()
+    video_dir.home_x_y()
+    motor.setSpeed(50)
+    motor.forward()
+    print(sim_hw.state())
+
+if __name__ == '__main__':
+    test()
@@ -1,118 +1,267 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
+from hardware import GPIO
 import video_dir
 import car_dir
 import motor
-from socket import *
+import pwm_writer
+import pwm_trace
+import framing
+import protocol
+import udp_control
+import watchdog
+import motion
+import car_config
+import asyncio
+import atexit
+import os
+from concurrent.futures import ThreadPoolExecutor
 from time import ctime          # Import necessary modules   
 
 ctrl_cmd = ['forward', 'backward', 'left', 'right', 'stop', 'read cpu_temp', 'home', 'distance', 'x+', 'x-', 'y+', 'y-', 'xy_home']
 
+# Commands an observer may send, they do not move the car.
+observer_cmd = {protocol.CPU_TEMP, protocol.DISTANCE, protocol.STATUS}
+
 busnum = 1          # Edit busnum to 0, if you uses Raspberry Pi 1 or 0
 
-HOST = ''           # The variable of HOST is null, so the function bind( ) can be bound to all valid addresses.
+HOST = ''           # The variable of HOST is null, so the server listens on all valid addresses.
 PORT = 21567
 BUFSIZ = 1024       # Size of the buffer
-ADDR = (HOST, PORT)
-
-tcpSerSock = socket(AF_INET, SOCK_STREAM)    # Create a socket.
-tcpSerSock.bind(ADDR)    # Bind the IP address and port number of the server. 
-tcpSerSock.listen(5)     # The parameter of listen() defines the number of connections permitted at one time. Once the 
-						 # connections are full, others will be rejected. 
-
-video_dir.setup(busnum=busnum)
-car_dir.setup(busnum=busnum)
-motor.setup(busnum=busnum)     # Initialize the Raspberry Pi GPIO connected to the DC motor. 
-video_dir.home_x_y()
-car_dir.home()
-
-while True:
-	print('Waiting for connection...')
-	# Waiting for connection. Once receiving a connection, the function accept() returns a separate 
-	# client socket for the subsequent communication. By default, the function accept() is a blocking 
-	# one, which means it is suspended before the connection comes.
-	tcpCliSock, addr = tcpSerSock.accept() 
-	print('...connected from :', addr)     # Print the IP address of the client connected with the server.
-
-	while True:
-		data = ''
-		data = tcpCliSock.recv(BUFSIZ).decode()    # Receive data sent from the client. 
-		# Analyze the command received and control the car accordingly.
-		if not data:
-			break
-		if data == ctrl_cmd[0]:
-			print('motor moving forward')
-			motor.forward()
-		elif data == ctrl_cmd[1]:
-			print('recv backward cmd')
-			motor.backward()
-		elif data == ctrl_cmd[2]:
-			print('recv left cmd')
-			car_dir.turn_left()
-		elif data == ctrl_cmd[3]:
-			print('recv right cmd')
-			car_dir.turn_right()
-		elif data == ctrl_cmd[6]:
-			print('recv home cmd')
-			car_dir.home()
-		elif data == ctrl_cmd[4]:
-			print('recv stop cmd')
-			motor.ctrl(0)
-		elif data == ctrl_cmd[5]:
-			print('read cpu temp...')
-			temp = cpu_temp.read()
-			tcpCliSock.send(('[%s] %0.2f' % (ctime(), temp)).encode())
-		elif data == ctrl_cmd[8]:
-			print('recv x+ cmd')
-			video_dir.move_increase_x()
-		elif data == ctrl_cmd[9]:
-			print('recv x- cmd')
-			video_dir.move_decrease_x()
-		elif data == ctrl_cmd[10]:
-			print('recv y+ cmd')
-			video_dir.move_increase_y()
-		elif data == ctrl_cmd[11]:
-			print('recv y- cmd')
-			video_dir.move_decrease_y()
-		elif data == ctrl_cmd[12]:
-			print('home_x_y')
-			video_dir.home_x_y()
-		elif data[0:5] == 'speed':     # Change the speed
-			print(data)
-			numLen = len(data) - len('speed')
-			if numLen == 1 or numLen == 2 or numLen == 3:
-				tmp = data[-numLen:]
-				print('tmp(str) = %s' % tmp)
-				spd = int(tmp)
-				print('spd(int) = %d' % spd)
-				if spd < 24:
-					spd = 24
-				motor.setSpeed(spd)
-		elif data[0:5] == 'turn=':    #Turning Angle
-			print('data =', data)
-			angle = data.split('=')[1]
-			try:
-				angle = int(angle)
-				car_dir.turn(angle)
-			except:
-				print('Error: angle =', angle)
-		elif data[0:8] == 'forward=':
-			print('data =', data)
-			spd = data[8:]
-			try:
-				spd = int(spd)
-				motor.forward(spd)
-			except:
-				print('Error speed =', spd)
-		elif data[0:9] == 'backward=':
-			print('data =', data)
-			spd = data.split('=')[1]
-			try:
-				spd = int(spd)
-				motor.backward(spd)
-			except:
-				print('ERROR, speed =', spd)
-		else:
-			print('Command Error! Cannot recognize command: ' + data)
-
-tcpSerSock.close()
\ No newline at end of file
+
+TELEMETRY_INTERVAL = 1.0        # Seconds between status pushes to every client
+SEND_BUFFER_LIMIT = 64 * 1024   # Skip pushes to clients with more than this still unsent
+
+# Set SMARTCAR_UDP=1 to also take throttle/steering/camera datagrams on
+# udp_control.PORT, from the same machine as the controlling TCP client.
+udp_enabled = os.environ.get('SMARTCAR_UDP') == '1'
+
+trace_file = os.environ.get('SMARTCAR_TRACE')
+recorder = None
+
+def setup():
+	global recorder
+	video_dir.setup(busnum=busnum)
+	car_dir.setup(busnum=busnum)
+	motor.setup(busnum=busnum)     # Initialize the Raspberry Pi GPIO connected to the DC motor. 
+	pwm_writer.attach(video_dir, car_dir, motor)    # Write I2C from a background thread, so commands never wait on the bus
+	motion.attach(motor, car_dir)   # Ramp speed and steering at a fixed rate (SMARTCAR_MOTION=linear|s-curve|off)
+	video_dir.home_x_y()
+	car_dir.home()
+
+	# Set SMARTCAR_TRACE to a file name to record every channel/pin change, and
+	# when each command arrived, for `python3 pwm_trace.py show|replay <file>`.
+	if trace_file:
+		recorder = pwm_trace.TraceRecorder()
+		pwm_trace.install(recorder, motor)
+		atexit.register(recorder.dump, trace_file)
+
+def status():
+	return 'status x=%s y=%s' % (video_dir.Current_x, video_dir.Current_y)
+
+# =============================================================================
+# The control commands. Text and binary commands both arrive here as
+# (opcode, args) through the dispatcher; every handler runs on the hardware
+# thread and returns the text to send back, if any.
+# =============================================================================
+def read_cpu_temp():
+	temp = cpu_temp.read()
+	return '[%s] %0.2f' % (ctime(), temp)
+
+def set_speed(spd):
+	motor.setSpeed(max(spd, 24))
+
+def drive(throttle, angle):
+	car_dir.turn(angle)
+	if throttle > 0:
+		motor.forwardWithSpeed(throttle)
+	elif throttle < 0:
+		motor.backwardWithSpeed(-throttle)
+	else:
+		motor.stop()
+
+def stop_all():
+	'''What the deadman watchdog does to a car nobody is driving'''
+	motor.stop()
+	car_dir.home()
+
+def apply_state(state):
+	'''Newest UDP control state; unchanged channels cost no I2C write'''
+	throttle, steer, pan, tilt = state
+	drive(throttle, steer)
+	video_dir.move_to(video_dir.home_x + pan, video_dir.home_y + tilt)
+
+dispatcher = protocol.Dispatcher()
+for opcode, handler in (
+		(protocol.FORWARD,          motor.forward),
+		(protocol.BACKWARD,         motor.backward),
+		(protocol.LEFT,             car_dir.turn_left),
+		(protocol.RIGHT,            car_dir.turn_right),
+		(protocol.HOME,             car_dir.home),
+		(protocol.STOP,             motor.stop),
+		(protocol.CPU_TEMP,         read_cpu_temp),
+		(protocol.X_INCREASE,       video_dir.move_increase_x),
+		(protocol.X_DECREASE,       video_dir.move_decrease_x),
+		(protocol.Y_INCREASE,       video_dir.move_increase_y),
+		(protocol.Y_DECREASE,       video_dir.move_decrease_y),
+		(protocol.XY_HOME,          video_dir.home_x_y),
+		(protocol.STATUS,           status),
+		(protocol.SPEED,            set_speed),
+		(protocol.TURN,             car_dir.turn),
+		(protocol.FORWARD_SPEED,    motor.forwardWithSpeed),
+		(protocol.BACKWARD_SPEED,   motor.backwardWithSpeed),
+		(protocol.DRIVE,            drive),
+		(protocol.HEARTBEAT,        lambda: None),      # Only keeps the watchdog quiet
+		):
+	dispatcher.register(opcode, handler)
+
+class ControlServer(object):
+	'''Accepts any number of clients. The first one to connect drives the car,
+	the others are observers that get every reply and the telemetry. When the
+	controller leaves, the longest connected observer takes over.'''
+
+	def __init__(self, host=HOST, port=PORT):
+		self.host = host
+		self.port = port
+		self.clients = []           # StreamWriters, in connection order
+		self.parsers = {}           # StreamWriter -> framing.StreamParser
+		self.controller = None
+		self.udp = None             # udp_control.UDPControl, if enabled
+		self.watchdog = watchdog.Watchdog(self.deadman)
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hardware')
+
+	def send(self, writer, text):
+		'''Queue text for one client, dropping it if the client is not keeping up'''
+		if writer.is_closing():
+			return
+		if writer.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+			return
+		writer.write(framing.encode(text, self.parsers[writer].mode))
+
+	def publish(self, text):
+		for writer in self.clients:
+			self.send(writer, text)
+
+	async def run(self, opcode, args):
+		'''Run a command on the hardware thread, off the event loop'''
+		loop = asyncio.get_running_loop()
+		try:
+			return await loop.run_in_executor(self.executor, dispatcher.dispatch, opcode, args)
+		except Exception as e:
+			print('Command Error!', protocol.format_text(opcode, args), e)
+
+	async def handle_client(self, reader, writer):
+		addr = writer.get_extra_info('peername')
+		self.clients.append(writer)
+		self.parsers[writer] = framing.StreamParser()
+		if self.controller is None:
+			self.controller = writer
+		print('...connected from :', addr, 'as', 'controller' if self.controller is writer else 'observer')
+		try:
+			while True:
+				data = await reader.read(BUFSIZ)    # Receive data sent from the client. 
+				if not data:
+					break
+				# One read may carry several framed commands, or part of one
+				for command in self.parsers[writer].feed(data):
+					if isinstance(command, bytes):
+						text = command.decode(errors='replace')
+						command = protocol.parse_text(text)
+						if command is None:
+							print('Command Error! Cannot recognize command: ' + text)
+							continue
+					await self.dispatch(writer, *command)
+		except ConnectionError:
+			pass
+		finally:
+			self.clients.remove(writer)
+			del self.parsers[writer]
+			if self.controller is writer:
+				self.deadman(writer)		# Stop before anyone else takes over
+				self.controller = self.clients[0] if self.clients else None
+				if self.controller is not None:
+					self.send(self.controller, 'controller')
+			self.watchdog.forget(writer)
+			writer.close()
+			print('...disconnected :', addr)
+
+	async def dispatch(self, writer, opcode, args=()):
+		if writer is not self.controller and opcode not in observer_cmd:
+			print('Observer command ignored:', protocol.format_text(opcode, args))
+			return
+		if writer is self.controller:
+			self.watchdog.feed(writer)
+		if opcode == protocol.HEARTBEAT:
+			return
+		if recorder is not None:
+			recorder.mark(opcode)     # On arrival, before the wait for the hardware thread
+		reply = await self.run(opcode, args)
+		if reply is not None:
+			self.send(writer, reply)
+		if len(self.clients) > 1:
+			echo = 'cmd ' + protocol.format_text(opcode, args)
+			for observer in self.clients:
+				if observer is not writer:
+					self.send(observer, echo)
+
+	def deadman(self, controller):
+		'''The controller went silent or left: stop the car'''
+		self.watchdog.forget(controller)
+		print('Deadman: stopping the car, controller', controller.get_extra_info('peername'), 'went silent or left')
+		if self.udp is not None:
+			self.udp.reset()
+		try:
+			asyncio.get_running_loop().run_in_executor(self.executor, stop_all)
+		except RuntimeError:		# Shutting down, the hardware thread is gone
+			stop_all()
+
+	def udp_accepted(self, addr):
+		if self.controller is not None:
+			self.watchdog.feed(self.controller)
+
+	def udp_allowed(self, addr):
+		'''Only the controller's host may drive over UDP'''
+		if self.controller is None:
+			return False
+		return addr[0] == self.controller.get_extra_info('peername')[0]
+
+	async def telemetry(self):
+		loop = asyncio.get_running_loop()
+		config = car_config.get()
+		while True:
+			await asyncio.sleep(TELEMETRY_INTERVAL)
+			# Pick up a new calibration (cali_server.py, html_server) on the hardware thread
+			await loop.run_in_executor(self.executor, config.reload)
+			if self.clients:
+				self.publish(status())
+
+	async def serve(self):
+		server = await asyncio.start_server(self.handle_client, self.host or None, self.port, reuse_address=True)
+		print('Waiting for connection...')
+		telemetry = asyncio.ensure_future(self.telemetry())
+		if self.watchdog.timeout:
+			deadman = asyncio.ensure_future(self.watchdog.run())
+		transport = None
+		if udp_enabled:
+			loop = asyncio.get_running_loop()
+			transport, self.udp = await loop.create_datagram_endpoint(
+				lambda: udp_control.UDPControl(apply_state, self.executor, self.udp_allowed, on_accept=self.udp_accepted),
+				local_addr=(self.host or '0.0.0.0', udp_control.PORT))
+			print('UDP control on port', udp_control.PORT)
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			telemetry.cancel()
+			if self.watchdog.timeout:
+				deadman.cancel()
+			if transport is not None:
+				transport.close()
+				print('UDP control:', self.udp.stats())
+			self.executor.shutdown()
+
+if __name__ == '__main__':
+	setup()
+	try:
+		asyncio.run(ControlServer().serve())
+	except KeyboardInterrupt:
+		pass
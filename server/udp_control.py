@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : udp_control.py
+* Description : Low latency UDP channel for continuous throttle,
+*               steering and camera control
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+
+Every datagram carries the whole control state, so a lost one needs no
+resend, the next one replaces it:
+
+  version   1 byte, protocol.VERSION
+  seq       4 bytes, +1 per datagram, wraps around
+  timestamp 8 bytes, sender's monotonic clock in seconds
+  throttle  1 byte signed, -100 (full backward) to 100 (full forward)
+  steer     1 byte, 0 (left) to 255 (right), as turn=
+  pan, tilt 2 bytes signed each, servo counts away from the camera home
+
+Little endian. Datagrams older than the newest one seen, or that spent
+more than MAX_AGE longer in flight than the fastest one, are dropped.
+Sender and car clocks need not agree: only the change of the delay counts.
+The fastest one is taken over the last one to two DELAY_WINDOWs, so the
+clocks drifting apart, or a lasting change of route, moves the baseline
+along instead of making every datagram stale.
+'''
+
+import asyncio
+import struct
+import time
+import protocol
+
+PORT = 21568
+MAX_AGE = 0.2           # Seconds a datagram may lag behind the fastest one
+RESET_TIME = 1.0        # Silence after which any sequence number is accepted again
+DELAY_WINDOW = 10.0     # Seconds of datagrams the fastest delay is taken over
+
+_PACKET = struct.Struct('<BIdbBhh')
+SIZE = _PACKET.size
+
+def pack(seq, timestamp, throttle, steer, pan=0, tilt=0):
+    return _PACKET.pack(protocol.VERSION, seq & 0xFFFFFFFF, timestamp, throttle, steer, pan, tilt)
+
+def _newer(seq, last):
+    '''Serial number comparison, so the 32 bit wrap-around is not a step back'''
+    return 0 < ((seq - last) & 0xFFFFFFFF) < 0x80000000
+
+class LatestState(object):
+    '''Keeps the newest valid control state out of a stream of datagrams'''
+
+    def __init__(self, max_age=MAX_AGE, reset_time=RESET_TIME, window=DELAY_WINDOW, clock=time.monotonic):
+        self.max_age = max_age
+        self.reset_time = reset_time
+        self.window = window
+        self.clock = clock
+        self.state = None           # (throttle, steer, pan, tilt)
+        self.seq = None
+        self.received = 0
+        self.accepted = 0
+        self.bad = 0
+        self.out_of_order = 0
+        self.stale = 0
+        self._last_time = None
+        self._window_start = None
+        self._window_min = None     # Fastest delay of this window
+        self._previous_min = None   # and of the one before
+
+    def _min_delay(self, delay, now):
+        '''Take delay into the windows; the fastest delay of the last one to
+        two windows'''
+        if self._window_start is None or now - self._window_start >= self.window:
+            self._previous_min = self._window_min
+            self._window_min = None
+            self._window_start = now
+        if self._window_min is None or delay < self._window_min:
+            self._window_min = delay
+        if self._previous_min is None:
+            return self._window_min
+        return min(self._window_min, self._previous_min)
+
+    def accept(self, data, now=None):
+        '''Take one datagram; True if it became the current state'''
+        if now is None:
+            now = self.clock()
+        self.received += 1
+        if len(data) != SIZE or data[0] != protocol.VERSION:
+            self.bad += 1
+            return False
+        _, seq, timestamp, throttle, steer, pan, tilt = _PACKET.unpack(data)
+        if self._last_time is None or now - self._last_time >= self.reset_time:
+            self.seq = None             # A new session, the sender may have restarted
+            self._window_start = self._window_min = self._previous_min = None
+        elif not _newer(seq, self.seq):
+            self.out_of_order += 1
+            return False
+        delay = now - timestamp
+        if delay - self._min_delay(delay, now) > self.max_age:
+            self.stale += 1
+            return False
+        self.seq = seq
+        self._last_time = now
+        self.state = (throttle, steer, pan, tilt)
+        self.accepted += 1
+        return True
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'accepted': self.accepted,
+            'bad': self.bad,
+            'out_of_order': self.out_of_order,
+            'stale': self.stale,
+        }
+
+class UDPControl(asyncio.DatagramProtocol):
+    '''Datagram endpoint for the event loop. Valid datagrams only update the
+    state; apply(state) runs on the executor with whatever is newest when it
+    gets there, so a burst of datagrams costs one actuator update.
+    allow(addr) decides which senders may drive, on_accept(addr) hears of
+    every valid datagram.'''
+
+    def __init__(self, apply, executor=None, allow=None, max_age=MAX_AGE, on_accept=None):
+        self.apply = apply
+        self.executor = executor
+        self.allow = allow
+        self.on_accept = on_accept
+        self.latest = LatestState(max_age=max_age)
+        self.refused = 0
+        self.applied = 0
+        self._applied_state = None
+        self._pending = False
+
+    def datagram_received(self, data, addr):
+        if self.allow is not None and not self.allow(addr):
+            self.refused += 1
+            return
+        if not self.latest.accept(data):
+            return
+        if self.on_accept is not None:
+            self.on_accept(addr)
+        if not self._pending:
+            self._schedule()
+
+    def reset(self):
+        '''Forget what was applied, e.g. after the car was stopped behind
+        our back, so the next datagram is applied even if it is unchanged'''
+        self._applied_state = None
+
+    def _schedule(self):
+        self._pending = True
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._apply)
+        future.add_done_callback(self._done)
+
+    def _apply(self):
+        state = self.latest.state
+        if state != self._applied_state:
+            self.apply(state)
+            self._applied_state = state
+            self.applied += 1
+
+    def _done(self, future):
+        self._pending = False
+        if future.exception() is not None:
+            print('UDP control error!', future.exception())
+        elif self.latest.state != self._applied_state:
+            self._schedule()        # Came in while the last one was being applied
+
+    def stats(self):
+        stats = self.latest.stats()
+        stats['refused'] = self.refused
+        stats['applied'] = self.applied
+        return stats
+
+def simulate(loss=0.1, latency=0.03, jitter=0.05, stalls=0.002, rate=100, duration=10.0, max_age=MAX_AGE):
+    '''Loss/latency harness: a sender at `rate` Hz sweeps the steering through
+    a link that drops `loss` of the datagrams and delays the rest by `latency`
+    plus up to `jitter` seconds (which reorders them). With probability
+    `stalls` per datagram the link freezes for 0.5 seconds and then delivers
+    the backlog at once, like Wi-Fi does. Runs on a simulated clock.
+    Prints what the filter kept and how old the applied state was.'''
+    import heapq
+    import random
+    now = 0.0
+    latest = LatestState(max_age=max_age, clock=lambda: now)
+    in_flight = []
+    ages = []
+    seq = 0
+    sent = 0
+    step = 1.0 / rate
+    t = 0.0
+    stalled_until = 0.0
+    while t < duration or in_flight:
+        if t < duration:
+            sent += 1
+            if random.random() >= loss:
+                if random.random() < stalls:
+                    stalled_until = t + 0.5
+                arrival = max(t, stalled_until) + latency + random.uniform(0, jitter)
+                heapq.heappush(in_flight, (arrival, seq, pack(seq, t + 1000.0, 50, seq % 256)))
+            seq += 1
+            t += step
+        else:
+            t = in_flight[0][0]
+        while in_flight and in_flight[0][0] <= t:
+            now, sent_seq, data = heapq.heappop(in_flight)
+            if latest.accept(data):
+                ages.append(now - sent_seq * step)
+    stats = latest.stats()
+    print(f'sent {sent}, lost {sent - stats["received"]}, ' + ', '.join(f'{k} {v}' for k, v in stats.items()))
+    if ages:
+        ages.sort()
+        print('age of applied state: median %.1f ms, p99 %.1f ms, max %.1f ms' % (
+            ages[len(ages)//2] * 1000, ages[int(len(ages) * 0.99)] * 1000, ages[-1] * 1000))
+    return stats
+
+if __name__ == '__main__':
+    import sys
+    args = [float(arg) for arg in sys.argv[1:5]]
+    simulate(*args)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import PCA9685 as servo
 import time  # Import necessary modules
+import car_config
 
 MinPulse = 200
 MaxPulse = 700
@@ -8,43 +9,46 @@ MaxPulse = 700
 Current_x = 0
 Current_y = 0
 
-def setup(busnum=None):
-    global Xmin, Ymin, Xmax, Ymax, home_x, home_y, pwm
-    offset_x = 0
-    offset_y = 0
-    
-    # Use with statement for file opening
-    try:
-        with open('config') as file:
-            for line in file:
-                if line.startswith('offset_x'):
-                    offset_x = int(line.split('=')[1].strip())
-                elif line.startswith('offset_y'):
-                    offset_y = int(line.split('=')[1].strip())
-    except FileNotFoundError:
-        pass  # Config file not found; ignore the error
+# The one place pan (CH14) and tilt (CH15) counts get clamped to the
+# calibrated limits, set by setup().
+def pan(x):
+    return min(max(x, Xmin), Xmax)
+
+def tilt(y):
+    return min(max(y, Ymin), Ymax)
 
-    Xmin = MinPulse + offset_x
-    Xmax = MaxPulse + offset_x
-    Ymin = MinPulse + offset_y
-    Ymax = MaxPulse + offset_y
-    home_x = (Xmax + Xmin) / 2
-    home_y = Ymin + 80
+def setup(busnum=None):
+    global pwm
+    config = car_config.get()
+    recalibrate(config)
+    config.subscribe(recalibrate)   # Follow later offset changes without another setup()
     if busnum is None:
-        pwm = servo.PWM()  # Initialize the servo controller.
+        pwm = servo.get_pwm()  # Shared servo controller, initialized once.
     else:
-        pwm = servo.PWM(bus_number=busnum)  # Initialize the servo controller.
+        pwm = servo.get_pwm(bus_number=busnum)  # Shared servo controller, initialized once.
     pwm.frequency = 60
 
+# ==========================================================================================
+# Derive the limits and the home position from the config offsets.
+# ==========================================================================================
+def recalibrate(config, changed=None):
+    global Xmin, Ymin, Xmax, Ymax, home_x, home_y
+    if changed is not None and not changed & {'offset_x', 'offset_y'}:
+        return
+    Xmin = MinPulse + config.offset_x
+    Xmax = MaxPulse + config.offset_x
+    Ymin = MinPulse + config.offset_y
+    Ymax = MaxPulse + config.offset_y
+    home_x = pan((Xmax + Xmin) // 2)
+    home_y = tilt(Ymin + 80)
+
 # ==========================================================================================
 # Control the servo connected to channel 14 of the servo control board to make the camera 
 # turning towards the positive direction of the x axis.
 # ==========================================================================================
 def move_decrease_x():
     global Current_x
-    Current_x += 25
-    if Current_x > Xmax:
-        Current_x = Xmax
+    Current_x = pan(Current_x + 25)
     pwm.write(14, 0, Current_x)  # CH14 <---> X axis
 
 # ==========================================================================================
@@ -53,9 +57,7 @@ def move_decrease_x():
 # ==========================================================================================
 def move_increase_x():
     global Current_x
-    Current_x -= 25
-    if Current_x < Xmin:
-        Current_x = Xmin
+    Current_x = pan(Current_x - 25)
     pwm.write(14, 0, Current_x)
 
 # ==========================================================================================
@@ -64,9 +66,7 @@ def move_increase_x():
 # ==========================================================================================
 def move_increase_y():
     global Current_y
-    Current_y += 25
-    if Current_y > Ymax:
-        Current_y = Ymax
+    Current_y = tilt(Current_y + 25)
     pwm.write(15, 0, Current_y)  # CH15 <---> Y axis
 
 # ==========================================================================================
@@ -75,9 +75,7 @@ def move_increase_y():
 # ==========================================================================================
 def move_decrease_y():
     global Current_y
-    Current_y -= 25
-    if Current_y < Ymin:
-        Current_y = Ymin
+    Current_y = tilt(Current_y - 25)
     pwm.write(15, 0, Current_y)
 
 # ==========================================================================================		
@@ -92,6 +90,16 @@ def home_x_y():
     pwm.write(14, 0, Current_x)
     pwm.write(15, 0, Current_y)
 
+# ==========================================================================================
+# Move the camera straight to servo counts x (CH14) and y (CH15), kept within the limits.
+# ==========================================================================================
+def move_to(x, y):
+    global Current_x, Current_y
+    Current_x = pan(x)
+    Current_y = tilt(y)
+    pwm.write(14, 0, Current_x)
+    pwm.write(15, 0, Current_y)
+
 def calibrate(x, y):
     pwm.write(14, 0, (MaxPulse + MinPulse) / 2 + x)
     pwm.write(15, 0, (MaxPulse + MinPulse) / 2 + y)
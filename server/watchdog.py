@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+'''
+**********************************************************************
+* Filename    : watchdog.py
+* Description : Deadman watchdog, stops the car when a controller
+*               goes silent
+* Brand       : SunFounder
+* E-mail      : service@sunfounder.com
+* Website     : www.sunfounder.com
+* Version     : v1.0.0
+**********************************************************************
+'''
+
+import asyncio
+import os
+import time
+
+TIMEOUT = float(os.environ.get('SMARTCAR_DEADMAN', 1.0))     # Seconds, 0 turns the watchdog off
+
+class Watchdog(object):
+    '''Remembers when each controller last sent a valid command. Once one has
+    been silent for `timeout` seconds, on_expire(controller) is called, once
+    per silence; the next command arms it again.
+
+    feed() only stores a time stamp, the checking happens in run() (or in
+    check() when driven by hand), so commands never wait on the watchdog.
+    '''
+    _DEBUG = False
+    _DEBUG_INFO = 'DEBUG "watchdog.py":'
+
+    def __init__(self, on_expire, timeout=TIMEOUT, clock=time.monotonic):
+        self.on_expire = on_expire
+        self.timeout = timeout
+        self.clock = clock
+        self.expired = 0
+        self._last = {}             # controller -> time of the last valid command
+
+    def feed(self, controller):
+        self._last[controller] = self.clock()
+
+    def forget(self, controller):
+        '''The controller is gone; stop tracking it without firing'''
+        self._last.pop(controller, None)
+
+    def check(self, now=None):
+        '''Fire for every controller silent for too long. Returns the seconds
+        until the next controller could expire, or None if none is armed.'''
+        if now is None:
+            now = self.clock()
+        wait = None
+        for controller, last in list(self._last.items()):
+            left = last + self.timeout - now
+            if left <= 0:
+                del self._last[controller]
+                self.expired += 1
+                if self._DEBUG:
+                    print(self._DEBUG_INFO, f'{controller} silent for {now - last:.3f} s')
+                self.on_expire(controller)
+            elif wait is None or left < wait:
+                wait = left
+        return wait
+
+    async def run(self):
+        '''Check on the event loop, sleeping until the next possible expiry'''
+        while True:
+            wait = self.check()
+            await asyncio.sleep(self.timeout if wait is None else wait)
+
+    @property
+    def debug(self):
+        return self._DEBUG
+
+    @debug.setter
+    def debug(self, debug):
+        '''Set if debug information shows'''
+        if debug in (True, False):
+            self._DEBUG = debug
+        else:
+            raise ValueError('debug must be "True" (Set debug on) or "False" (Set debug off), not "{0}"'.format(debug))
+
+def test():
+    '''Drive the simulated car, go silent, and see the motor pins drop'''
+    os.environ['SMARTCAR_BACKEND'] = 'sim'
+    import sim_hw
+    import car_dir
+    import motor
+    car_dir.setup(busnum=1)
+    motor.setup(busnum=1)
+    now = [0.0]
+
+    def stop(controller):
+        motor.stop()
+        car_dir.home()
+
+    dog = Watchdog(stop, timeout=0.5, clock=lambda: now[0])
+    dog.feed('client')
+    motor.forwardWithSpeed(60)
+    car_dir.turn(255)
+    for now[0] in (0.1, 0.2, 0.3):
+        dog.feed('client')          # Heartbeats keep it going
+        dog.check()
+    print('driving:', sim_hw.state()['pins'], 'expired', dog.expired)
+    now[0] = 0.9
+    dog.check()
+    print('silent: ', sim_hw.state()['pins'], 'steering_us', sim_hw.state()['steering_us'], 'expired', dog.expired)
+
+if __name__ == '__main__':
+    test()